@@ -1,8 +1,39 @@
 # backup_service.py
+# Copies loans.db into backup.db. Users, loans and installments carry updated_at, and
+# the time of the last successful run is kept in backup.db's job_state, so a run only
+# reads the rows changed since then (indexed updated_at ranges) and upserts them in
+# batches; deleted loans are found through the tombstones table. A backup.db without a
+# watermark (new or from before this scheme) gets one full copy.
+# Loans deleted from loans.db stay in the backup with status "deleted".
+# Snapshot mode (run_snapshot, BACKUP_MODE = "snapshot") instead writes a consistent
+# copy of the whole file with SQLite's online backup API into SNAPSHOT_DIR as
+# loans-<UTC time>.db, keeping the newest SNAPSHOT_KEEP.
+#
+#   python backup_service.py              # incremental
+#   python backup_service.py --full       # copy everything again
+#   python backup_service.py --snapshot   # timestamped snapshot file
+import argparse
 import datetime
-from sqlalchemy import create_engine
+import glob
+import logging
+import os
+import sqlite3
+import time
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import sessionmaker
-from models import Base, User, Loan, Installment
+from models import Base, User, Loan, Installment, Tombstone
+from db import get_engine
+from config import (
+    BACKUP_OVERLAP_SECONDS, BACKUP_BATCH_SIZE, BACKUP_MODE, SNAPSHOT_DIR, SNAPSHOT_KEEP,
+    SNAPSHOT_PAGES_PER_STEP, SNAPSHOT_STEP_SLEEP, SNAPSHOT_MAX_RESTARTS,
+)
+from job_state import get_datetime, set_datetime
+import migrations
+
+logger = logging.getLogger(__name__)
 
 # مسیر دیتابیس اصلی شما
 MAIN_DB_URL = "sqlite:///loans.db"
@@ -12,130 +43,238 @@ BACKUP_DB_URL = "sqlite:///backup.db"
 
 
 def get_session(db_url):
-    engine = create_engine(db_url, echo=False)
+    """db_url: database URL or an existing Engine"""
+    # same pooled engine (and SQLite profile) the bot uses; in WAL mode the long backup
+    # read no longer blocks handler writes
+    engine = db_url if isinstance(db_url, Engine) else get_engine(db_url)
+    fresh = migrations.is_fresh(engine)
     Base.metadata.create_all(engine)
+    migrations.migrate(engine, fresh=fresh)
     return sessionmaker(bind=engine)()
 
 
-def sync_user(main_user, backup_session):
-    user = backup_session.query(User).filter_by(chat_id=main_user.chat_id).first()
-    if not user:
-        user = User(
-            chat_id=main_user.chat_id,
-            name=main_user.name,
-            timezone=main_user.timezone
-        )
-        backup_session.add(user)
-        backup_session.commit()
-    return user
-
-
-def sync_loan(main_loan, backup_user, backup_session):
-    loan = backup_session.query(Loan).filter_by(id=main_loan.id).first()
-    if not loan:
-        loan = Loan(
-            id=main_loan.id,
-            user_id=backup_user.id,
-            bank=main_loan.bank,
-            loan_name=main_loan.loan_name,
-            principal=main_loan.principal,
-            annual_interest_rate=main_loan.annual_interest_rate,
-            term_months=main_loan.term_months,
-            payment_cycle=main_loan.payment_cycle,
-            first_payment_date=main_loan.first_payment_date,
-            reminder_days_before=main_loan.reminder_days_before,
-            created_at=main_loan.created_at,
-            updated_at=main_loan.updated_at,
-        )
-        backup_session.add(loan)
-    else:
-        # آپدیت مقادیر
-        loan.bank = main_loan.bank
-        loan.loan_name = main_loan.loan_name
-        loan.principal = main_loan.principal
-        loan.annual_interest_rate = main_loan.annual_interest_rate
-        loan.term_months = main_loan.term_months
-        loan.payment_cycle = main_loan.payment_cycle
-        loan.first_payment_date = main_loan.first_payment_date
-        loan.reminder_days_before = main_loan.reminder_days_before
-        loan.updated_at = datetime.datetime.utcnow()
-
-    # بررسی وضعیت وام
-    unpaid = sum(1 for inst in main_loan.installments if not inst.is_paid)
-    if unpaid == 0:
-        loan.status = "completed"
-    else:
-        loan.status = "active"
+# backup.db's job_state: start time of the last successful run
+WATERMARK = "backup.last_run"
 
-    return loan
 
+def _upsert(session, table, rows, key="id"):
+    """INSERT ... ON CONFLICT(key) DO UPDATE for a batch of row dicts, in one executemany"""
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[key],
+        set_={c.name: stmt.excluded[c.name] for c in table.columns if c.name in rows[0] and c.name != key},
+    )
+    session.execute(stmt, rows)
+
+
+def _changed(session, table, since):
+    """batches of row dicts with updated_at >= since (every row when since is None)"""
+    query = select(table).order_by(table.c.id)
+    if since is not None:
+        query = query.where(table.c.updated_at >= since)
+    for part in session.execute(query).mappings().partitions(BACKUP_BATCH_SIZE):
+        yield [dict(row) for row in part]
+
+
+def _copy_users(backup_session, rows):
+    # backup users have their own ids and are matched by chat_id
+    _upsert(backup_session, User.__table__, [{k: v for k, v in row.items() if k != "id"} for row in rows],
+            key="chat_id")
+
+
+def copy_users(main_session, backup_session, since):
+    count = 0
+    for rows in _changed(main_session, User.__table__, since):
+        _copy_users(backup_session, rows)
+        count += len(rows)
+    return count
+
+
+def copy_loans(main_session, backup_session, since):
+    count = 0
+    users = User.__table__
+    for rows in _changed(main_session, Loan.__table__, since):
+        # owners: main user id → chat_id → backup user id (upserted too, in case they are missing)
+        owners = [dict(r) for r in main_session.execute(
+            select(users).where(users.c.id.in_({row["user_id"] for row in rows}))).mappings()]
+        _copy_users(backup_session, owners)
+        chat_of = {owner["id"]: owner["chat_id"] for owner in owners}
+        backup_id = dict(backup_session.execute(
+            select(users.c.chat_id, users.c.id).where(users.c.chat_id.in_(list(chat_of.values())))).all())
+        for row in rows:
+            row["user_id"] = backup_id[chat_of[row["user_id"]]]
+        _upsert(backup_session, Loan.__table__, rows)
+        count += len(rows)
+    return count
+
+
+def copy_installments(main_session, backup_session, since):
+    count = 0
+    for rows in _changed(main_session, Installment.__table__, since):
+        _upsert(backup_session, Installment.__table__, rows)
+        count += len(rows)
+    return count
 
-def sync_installments(main_loan, backup_loan, backup_session):
-    backup_existing = {
-        inst.id: inst for inst in backup_session.query(Installment).filter_by(loan_id=backup_loan.id).all()
-    }
 
-    for inst in main_loan.installments:
-        if inst.id in backup_existing:
-            b = backup_existing[inst.id]
-            b.sequence_number = inst.sequence_number
-            b.due_date = inst.due_date
-            b.amount_total = inst.amount_total
-            b.amount_principal = inst.amount_principal
-            b.amount_interest = inst.amount_interest
-            b.is_paid = inst.is_paid
-            b.paid_amount = inst.paid_amount
-            b.paid_at = inst.paid_at
-        else:
-            new_inst = Installment(
-                id=inst.id,
-                loan_id=backup_loan.id,
-                sequence_number=inst.sequence_number,
-                due_date=inst.due_date,
-                amount_total=inst.amount_total,
-                amount_principal=inst.amount_principal,
-                amount_interest=inst.amount_interest,
-                is_paid=inst.is_paid,
-                paid_amount=inst.paid_amount,
-                paid_at=inst.paid_at
-            )
-            backup_session.add(new_inst)
-
-
-def mark_deleted_loans(backup_session, active_loan_ids):
-    """Loans that exist in backup but not in main database should become status=deleted"""
-    old_loans = backup_session.query(Loan).all()
-    for loan in old_loans:
-        if loan.id not in active_loan_ids:
-            loan.status = "deleted"
-
-
-def run_backup():
+def mark_deleted_loans(main_session, backup_session, since):
+    """
+    Loans deleted from the main database become status=deleted in the backup.
+    Incremental: from the tombstones written since the last run. Full: by comparing loan ids,
+    since deletions from before the tombstones are not recorded anywhere.
+    """
+    loans = Loan.__table__
+    if since is not None:
+        deleted = main_session.execute(
+            select(Tombstone.row_id).where(Tombstone.table_name == Loan.__tablename__,
+                                           Tombstone.deleted_at >= since)).scalars().all()
+        # a deleted loan's id may have been reused by a newer loan that is still there
+        alive = set(main_session.execute(select(loans.c.id).where(loans.c.id.in_(deleted))).scalars())
+        deleted = [loan_id for loan_id in deleted if loan_id not in alive]
+    else:
+        main_ids = set(main_session.execute(select(loans.c.id)).scalars())
+        deleted = [loan_id for loan_id in backup_session.execute(
+            select(loans.c.id).where(loans.c.status != "deleted")).scalars() if loan_id not in main_ids]
+    for start in range(0, len(deleted), BACKUP_BATCH_SIZE):
+        backup_session.execute(update(loans).where(loans.c.id.in_(deleted[start:start + BACKUP_BATCH_SIZE]))
+                               .values(status="deleted"))
+    return len(deleted)
+
+
+def run_backup(main_db_url=MAIN_DB_URL, backup_db_url=BACKUP_DB_URL, full=False):
+    """
+    Copy what changed since the last successful run (everything when full or on the first run).
+    returns: dict of row counts copied per table, "deleted" loans and "full"
+    """
     print("🔄 شروع بکاپ‌گیری ...")
 
-    main_session = get_session(MAIN_DB_URL)
-    backup_session = get_session(BACKUP_DB_URL)
+    main_session = get_session(main_db_url)
+    backup_session = get_session(backup_db_url)
+    try:
+        # the watermark is taken before reading; rows written by transactions still open
+        # at that moment are covered by the overlap on the next run
+        started = datetime.datetime.utcnow()
+        last_run = None if full else get_datetime(backup_session, WATERMARK)
+        since = last_run - datetime.timedelta(seconds=BACKUP_OVERLAP_SECONDS) if last_run else None
+
+        result = {
+            "full": since is None,
+            "users": copy_users(main_session, backup_session, since),
+            "loans": copy_loans(main_session, backup_session, since),
+            "installments": copy_installments(main_session, backup_session, since),
+            "deleted": mark_deleted_loans(main_session, backup_session, since),
+        }
+        set_datetime(backup_session, WATERMARK, started)
+        backup_session.commit()
+
+        # tombstones older than this run's window were applied by an earlier run
+        if since is not None:
+            main_session.execute(delete(Tombstone.__table__).where(Tombstone.deleted_at < since))
+            main_session.commit()
+    finally:
+        # return both connections to the pool
+        main_session.close()
+        backup_session.close()
+
+    print(f"✅ بکاپ با موفقیت انجام شد: {result}")
+    return result
+
 
-    main_users = main_session.query(User).all()
-    active_loan_ids = []
+class _SnapshotRestarts(Exception):
+    pass
 
-    for m_user in main_users:
-        b_user = sync_user(m_user, backup_session)
 
-        for m_loan in m_user.loans:
-            b_loan = sync_loan(m_loan, b_user, backup_session)
-            backup_session.commit()
+def _snapshot_progress(stats, sleep, max_restarts):
+    def progress(status, remaining, total):
+        # remaining does not shrink when another connection wrote to the source: the copy restarted
+        if stats["remaining"] is not None and remaining >= stats["remaining"]:
+            stats["restarts"] += 1
+            if max_restarts is not None and stats["restarts"] > max_restarts:
+                raise _SnapshotRestarts()
+        stats["steps"] += 1
+        stats["remaining"], stats["pages"] = remaining, total
+        logger.debug("Snapshot: %d of %d pages left", remaining, total)
+        # no lock is held between steps; sleeping here lets the bot's writers in
+        if remaining and sleep:
+            time.sleep(sleep)
+    return progress
 
-            active_loan_ids.append(m_loan.id)
-            sync_installments(m_loan, b_loan, backup_session)
-            backup_session.commit()
 
-    # پیدا کردن وام‌هایی که حذف شده‌اند
-    mark_deleted_loans(backup_session, active_loan_ids)
-    backup_session.commit()
+def prune_snapshots(directory, stem, keep):
+    """delete all but the newest keep snapshots of stem (names sort by time); returns removed paths"""
+    paths = sorted(glob.glob(os.path.join(directory, f"{stem}-*.db")))
+    removed = paths[:-keep] if keep else []
+    for path in removed + glob.glob(os.path.join(directory, f"{stem}-*.db.part")):
+        os.remove(path)
+    return removed
 
-    print("✅ بکاپ با موفقیت انجام شد.")
+
+def run_snapshot(main_db_url=MAIN_DB_URL, directory=SNAPSHOT_DIR, keep=SNAPSHOT_KEEP,
+                 pages=SNAPSHOT_PAGES_PER_STEP, sleep=SNAPSHOT_STEP_SLEEP, max_restarts=SNAPSHOT_MAX_RESTARTS):
+    """
+    Write a consistent copy of the main database with sqlite3.Connection.backup, pages per
+    step and a pause of sleep seconds between steps.
+    A write to the source between two steps restarts the copy; after max_restarts the rest
+    is copied in one step, which in WAL mode only holds a read snapshot and blocks no writer.
+    returns: dict(path, pages, steps, restarts, single_step, seconds, bytes, removed)
+    """
+    url = main_db_url.url if isinstance(main_db_url, Engine) else make_url(main_db_url)
+    source_path = url.database
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+    path = os.path.join(directory, f"{stem}-{stamp}.db")
+    part = path + ".part"
+    print("🔄 شروع اسنپ‌شات ...")
+
+    started = time.monotonic()
+    stats = {"steps": 0, "restarts": 0, "remaining": None, "pages": 0, "single_step": False}
+    source = sqlite3.connect(source_path, timeout=30)
+    target = sqlite3.connect(part)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=_snapshot_progress(stats, sleep, max_restarts))
+        except _SnapshotRestarts:
+            stats["single_step"] = True
+            source.backup(target, pages=-1)
+        # one self-contained file (the copied header still says WAL)
+        target.execute("PRAGMA journal_mode=DELETE")
+        check = target.execute("PRAGMA quick_check").fetchone()[0]
+        if check != "ok":
+            raise RuntimeError(f"snapshot failed quick_check: {check}")
+    except BaseException:
+        target.close()
+        os.remove(part)
+        raise
+    finally:
+        source.close()
+    target.close()
+    os.replace(part, path)
+
+    result = {
+        "path": path,
+        "pages": stats["pages"],
+        "steps": stats["steps"],
+        "restarts": stats["restarts"],
+        "single_step": stats["single_step"],
+        "seconds": round(time.monotonic() - started, 3),
+        "bytes": os.path.getsize(path),
+        "removed": prune_snapshots(directory, stem, keep),
+    }
+    print(f"✅ اسنپ‌شات ذخیره شد: {result}")
+    return result
+
+
+def run_scheduled_backup():
+    """the periodic backup job: BACKUP_MODE "sync" (run_backup) or "snapshot" (run_snapshot)"""
+    return run_snapshot() if BACKUP_MODE == "snapshot" else run_backup()
 
 
 if __name__ == "__main__":
-    run_backup()
+    parser = argparse.ArgumentParser(description="copy loans.db into backup.db, or write a snapshot file")
+    parser.add_argument("--full", action="store_true", help="copy every row, not only the changed ones")
+    parser.add_argument("--snapshot", action="store_true", help="write a timestamped snapshot to SNAPSHOT_DIR")
+    args = parser.parse_args()
+    if args.snapshot:
+        run_snapshot()
+    else:
+        run_backup(full=args.full)
@@ -0,0 +1,173 @@
+# bench.py
+# Micro benchmark suite for logic.py and calendar_helper.py.
+#
+#   python bench.py                                  # run, print, write bench_results.json
+#   python bench.py --save-baseline                  # run and store bench_baseline.json
+#   python bench.py --baseline bench_baseline.json --threshold 0.25
+#
+# With --baseline the exit code is 1 when any case got slower than
+# baseline * (1 + threshold), so the script can gate CI.
+import argparse
+import datetime
+import json
+import platform
+import sys
+import time
+import timeit
+
+import jdatetime
+
+from logic import (
+    calculate_amortization, calculate_amortization_batch, add_months_jalali_preserve_day, ENGINES,
+)
+from calendar_helper import jalali_month_matrix
+
+TERMS = (12, 60, 120, 360)
+BATCH_SIZES = (1, 10, 100, 1_000, 10_000, 100_000)
+BATCH_TERM = 60
+PRINCIPAL = 100_000_000.0
+ANNUAL_RATE = 23.0
+
+# first payment dates on the jalali month-end edge cases (day 29..31, leap esfand)
+EDGE_DATES = {
+    "d29": jdatetime.date(1403, 6, 29).togregorian(),
+    "d30": jdatetime.date(1403, 6, 30).togregorian(),
+    "d31": jdatetime.date(1403, 6, 31).togregorian(),
+    "esfand30": jdatetime.date(1403, 12, 30).togregorian(),
+}
+
+DEFAULT_OUTPUT = "bench_results.json"
+DEFAULT_BASELINE = "bench_baseline.json"
+DEFAULT_THRESHOLD = 0.20
+
+
+def _time(func, repeat, min_time=0.02):
+    """
+    Best and mean milliseconds per call of func().
+    number is calibrated from one warm-up call so each repeat runs for about min_time.
+    """
+    timer = timeit.Timer(func)
+    single = timer.timeit(number=1)
+    number = max(1, int(min_time / single)) if single > 0 else 1
+    runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {"best_ms": min(runs) * 1000, "mean_ms": sum(runs) / len(runs) * 1000, "number": number}
+
+
+def bench_engines(terms=TERMS, repeat=5):
+    """calculate_amortization per engine, term and edge date."""
+    results = {}
+    for term in terms:
+        for engine in ENGINES:
+            for label, first in EDGE_DATES.items():
+                name = f"calculate_amortization[{engine},term={term},{label}]"
+                results[name] = _time(
+                    lambda: calculate_amortization(PRINCIPAL, ANNUAL_RATE, term, first, engine=engine),
+                    repeat)
+    return results
+
+
+def bench_add_months(repeat=5):
+    """add_months_jalali_preserve_day across a full term from each edge date."""
+    results = {}
+    for label, first in EDGE_DATES.items():
+        jfirst = jdatetime.date.fromgregorian(date=first)
+        for term in TERMS:
+            results[f"add_months_jalali_preserve_day[term={term},{label}]"] = _time(
+                lambda: [add_months_jalali_preserve_day(jfirst, i) for i in range(term)], repeat)
+    return results
+
+
+def bench_month_matrix(repeat=5):
+    """jalali_month_matrix for every month of a leap year (1403)."""
+    return {
+        "jalali_month_matrix[1403/1-12]": _time(
+            lambda: [jalali_month_matrix(1403, m) for m in range(1, 13)], repeat),
+    }
+
+
+def bench_batch(sizes=BATCH_SIZES, repeat=3):
+    """calculate_amortization_batch over `size` loans with mixed edge dates."""
+    results = {}
+    dates = list(EDGE_DATES.values())
+    for size in sizes:
+        principals = [PRINCIPAL + 1000 * i for i in range(size)]
+        rates = [ANNUAL_RATE] * size
+        terms = [BATCH_TERM] * size
+        firsts = [dates[i % len(dates)] for i in range(size)]
+        results[f"calculate_amortization_batch[n={size},term={BATCH_TERM}]"] = _time(
+            lambda: calculate_amortization_batch(principals, rates, terms, firsts),
+            repeat)
+    return results
+
+
+def run_suite(max_batch=max(BATCH_SIZES), repeat=5):
+    results = {}
+    results.update(bench_engines(repeat=repeat))
+    results.update(bench_add_months(repeat=repeat))
+    results.update(bench_month_matrix(repeat=repeat))
+    results.update(bench_batch(sizes=[s for s in BATCH_SIZES if s <= max_batch]))
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    current, baseline: suite dicts as written by run_suite
+    returns: list of (name, baseline_ms, current_ms, ratio, regressed) for cases present in both
+    """
+    rows = []
+    for name, cur in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base:
+            continue
+        ratio = cur["best_ms"] / base["best_ms"] if base["best_ms"] else float("inf")
+        rows.append((name, base["best_ms"], cur["best_ms"], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="loan_bot micro benchmarks")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="where to write JSON results")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown before a case counts as regressed (0.2 = 20%%)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help=f"also write the results to {DEFAULT_BASELINE}")
+    parser.add_argument("--max-batch", type=int, default=max(BATCH_SIZES),
+                        help="largest batch size to run")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    suite = run_suite(max_batch=args.max_batch, repeat=args.repeat)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(suite, f, indent=2)
+    if args.save_baseline:
+        with open(DEFAULT_BASELINE, "w", encoding="utf-8") as f:
+            json.dump(suite, f, indent=2)
+
+    if not args.baseline:
+        for name, r in suite["results"].items():
+            print(f"{r['best_ms']:>12.3f} ms  {name}")
+        print(f"done in {time.perf_counter() - started:.1f}s → {args.output}")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    rows = compare(suite, baseline, args.threshold)
+    regressed = [r for r in rows if r[4]]
+    for name, base_ms, cur_ms, ratio, bad in rows:
+        flag = "REGRESSED" if bad else ""
+        print(f"{base_ms:>12.3f} → {cur_ms:>10.3f} ms  x{ratio:5.2f}  {flag:9} {name}")
+    print(f"{len(regressed)} of {len(rows)} cases regressed more than {args.threshold:.0%}")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
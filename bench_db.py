@@ -0,0 +1,198 @@
+# bench_db.py
+# Database scenarios that the micro benchmarks in bench.py do not cover.
+#
+#   python bench_db.py                        # backup: 300 loans, 4 writer threads
+#   python bench_db.py --loans 1000 --writers 8 --output bench_db_results.json
+#   python bench_db.py --scenario incremental --loans 2000 --payments 50
+#   python bench_db.py --scenario snapshot    # like backup, with backup_service.run_snapshot()
+#
+# backup:
+# Each profile gets a fresh temporary loans.db. Writer threads pay installments the
+# way pay_callback does (mark paid + record_payment + commit) for as long as
+# backup_service.run_backup() copies the database, and every write's latency is recorded.
+#   legacy: the old db.py engine (rollback journal, synchronous=FULL, a new connection per session)
+#   tuned:  db.make_engine() with SQLITE_PRAGMAS and the connection pool from config.py
+#
+# incremental: a full backup_service.run_backup() of the seeded database, then a few
+# payments, then the incremental run that copies only what they changed.
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import backup_service
+import migrations
+from db import make_engine
+from logic import iter_amortization
+from models import Base, User, Loan, Installment
+from progress import record_payment, repair_progress
+
+PROFILES = {
+    "legacy": lambda url: create_engine(url, connect_args={"check_same_thread": False}),
+    "tuned": make_engine,
+}
+TERM = 60
+
+
+def seed(engine, loans, users=50):
+    Base.metadata.create_all(engine)
+    migrations.migrate(engine, fresh=True)
+    first = datetime.date(2025, 1, 10)
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [{"id": u + 1, "chat_id": 1000 + u, "name": f"u{u}"}
+                                              for u in range(users)])
+        conn.execute(insert(Loan.__table__), [
+            {"id": i + 1, "user_id": i % users + 1, "bank": "bank", "loan_name": f"loan {i}",
+             "principal": 100_000_000.0 + i, "annual_interest_rate": 23.0, "term_months": TERM,
+             "first_payment_date": first, "status": "active"}
+            for i in range(loans)])
+        rows = []
+        for i in range(loans):
+            for r in iter_amortization(100_000_000.0 + i, 23.0, TERM, first):
+                rows.append({"loan_id": i + 1, "sequence_number": r["installment"], "due_date": r["due_date"],
+                             "amount_total": r["payment"], "amount_principal": r["principal"],
+                             "amount_interest": r["interest"], "is_paid": False})
+        conn.execute(insert(Installment.__table__), rows)
+        repair_progress(conn)
+    return loans * TERM
+
+
+def _writer(Session, ids, stop, latencies, errors):
+    for inst_id in ids:
+        if stop.is_set():
+            return
+        started = time.perf_counter()
+        session = Session()
+        try:
+            inst = session.get(Installment, inst_id)
+            inst.is_paid = True
+            inst.paid_at = datetime.datetime.utcnow()
+            inst.paid_amount = inst.amount_total
+            record_payment(session, inst.loan, inst)
+            session.commit()
+            latencies.append((time.perf_counter() - started) * 1000)
+        except OperationalError:
+            session.rollback()
+            errors.append(inst_id)
+        finally:
+            session.close()
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run_profile(name, loans, writers, snapshot=False):
+    with tempfile.TemporaryDirectory() as tmp:
+        main_url = f"sqlite:///{os.path.join(tmp, 'loans.db')}"
+        backup_url = f"sqlite:///{os.path.join(tmp, 'backup.db')}"
+        main_engine, backup_engine = PROFILES[name](main_url), PROFILES[name](backup_url)
+        total = seed(main_engine, loans)
+        Session = sessionmaker(bind=main_engine, autoflush=False, autocommit=False)
+
+        ids = list(range(1, total + 1))
+        random.Random(0).shuffle(ids)
+        chunks = [ids[w::writers] for w in range(writers)]
+        stop = threading.Event()
+        latencies, errors = [], []
+        threads = [threading.Thread(target=_writer, args=(Session, chunk, stop, latencies, errors))
+                   for chunk in chunks]
+
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        if snapshot:
+            copy = backup_service.run_snapshot(main_engine, directory=tmp)
+        else:
+            copy = backup_service.run_backup(main_engine, backup_engine)
+        backup_s = time.perf_counter() - started
+        stop.set()
+        for t in threads:
+            t.join()
+        main_engine.dispose()
+        backup_engine.dispose()
+
+    return {
+        "backup_s": backup_s,
+        "writes": len(latencies),
+        "writes_per_s": len(latencies) / backup_s if backup_s else None,
+        "locked_errors": len(errors),
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "max_ms": max(latencies) if latencies else None,
+        "copy": copy,
+    }
+
+
+def run_incremental_scenario(loans, payments):
+    with tempfile.TemporaryDirectory() as tmp:
+        main_engine = make_engine(f"sqlite:///{os.path.join(tmp, 'loans.db')}")
+        backup_engine = make_engine(f"sqlite:///{os.path.join(tmp, 'backup.db')}")
+        total = seed(main_engine, loans)
+        # every seeded row is younger than the overlap, which would make the second run a full copy again
+        backup_service.BACKUP_OVERLAP_SECONDS = 0
+        results = {}
+        started = time.perf_counter()
+        results["full"] = dict(backup_service.run_backup(main_engine, backup_engine),
+                               seconds=time.perf_counter() - started)
+
+        Session = sessionmaker(bind=main_engine)
+        ids = random.Random(0).sample(range(1, total + 1), payments)
+        _writer(Session, ids, threading.Event(), [], [])
+        started = time.perf_counter()
+        results["incremental"] = dict(backup_service.run_backup(main_engine, backup_engine),
+                                      seconds=time.perf_counter() - started)
+        main_engine.dispose()
+        backup_engine.dispose()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="database benchmarks: writes during a backup, incremental backups")
+    parser.add_argument("--scenario", choices=("backup", "incremental", "snapshot"), default="backup")
+    parser.add_argument("--loans", type=int, default=300)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument("--payments", type=int, default=50, help="incremental: installments paid between the runs")
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.scenario == "incremental":
+        results = run_incremental_scenario(args.loans, args.payments)
+        for mode, r in results.items():
+            print(f"{mode:>11}: {r['seconds']:.2f}s — {r['users']} users, {r['loans']} loans, "
+                  f"{r['installments']} installments, {r['deleted']} deleted")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({"scenario": "incremental", "loans": args.loans, "payments": args.payments,
+                           "results": results}, f, indent=2)
+        return 0
+
+    snapshot = args.scenario == "snapshot"
+    results = {name: run_profile(name, args.loans, args.writers, snapshot) for name in args.profiles}
+    for name, r in results.items():
+        print(f"{name:>7}: backup {r['backup_s']:.2f}s, {r['writes']} writes ({r['writes_per_s']:.0f}/s), "
+              f"{r['locked_errors']} locked, p50 {r['p50_ms']:.1f} / p95 {r['p95_ms']:.1f} / "
+              f"p99 {r['p99_ms']:.1f} / max {r['max_ms']:.1f} ms")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"scenario": args.scenario, "loans": args.loans, "writers": args.writers,
+                       "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,19 @@
 # calendar_helper.py
 # Small inline Jalali calendar builder for telegram InlineKeyboardMarkup
-import jdatetime
-import datetime
+import functools
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+import jalali_table
+from config import KEYBOARD_CACHE_SIZE
+
+# how many years (back from the current one) the first-payment year picker offers
+YEAR_PICKER_SPAN = 30
+
 def jalali_month_matrix(year, month):
     # returns list of lists of day numbers for week rows (starting Saturday)
-    first = jdatetime.date(year, month, 1)
-    # weekday in jdatetime: Monday=0 .. Sunday=6 but Persian week often Saturday first; 
-    # we'll align so that calendar starts Saturday. jdatetime.weekday() returns 0=Monday
-    offset = (first.togregorian().weekday() + 2) % 7  # transform to Saturday=0
-    import calendar
-    # number of days in jalali month: use jdatetime to get next month minus one
-    try:
-        next_month = jdatetime.date(year + (month // 12), (month % 12) + 1, 1)
-    except Exception:
-        # handle December-> next year
-        if month == 12:
-            next_month = jdatetime.date(year+1, 1, 1)
-        else:
-            raise
-    last = next_month - jdatetime.timedelta(days=1)
-    days = last.day
+    # offset of the first day (Saturday=0) and month length come from the precomputed table
+    offset = jalali_table.month_start_weekday(year, month)
+    days = jalali_table.month_length(year, month)
     # build rows
     rows = []
     week = [None]*7
@@ -67,3 +59,68 @@ def build_month_keyboard(year, month, prefix="cal"):
     # cancel
     keyboard.append([InlineKeyboardButton("لغو", callback_data=f"{prefix}|cancel")])
     return InlineKeyboardMarkup(keyboard)
+
+
+# ----------------------------------------------------------------------
+# Step-by-step pickers used by the add-loan conversation (year -> month -> day)
+# ----------------------------------------------------------------------
+def build_year_picker(current_year, prefix="cal"):
+    keyboard = []
+    for y in range(current_year, current_year - YEAR_PICKER_SPAN, -1):
+        keyboard.append([InlineKeyboardButton(str(y), callback_data=f"{prefix}_year|{y}")])
+    keyboard.append([InlineKeyboardButton("❌ لغو", callback_data=f"{prefix}_cancel")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def build_month_picker(year, prefix="cal"):
+    keyboard = []
+    for m in range(1, 13):
+        keyboard.append([InlineKeyboardButton(f"{m}", callback_data=f"{prefix}_month|{year}|{m}")])
+    keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data=f"{prefix}_cancel")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def build_day_picker(year, month, prefix="cal"):
+    keyboard = []
+    row = []
+    for d in range(1, jalali_table.month_length(year, month) + 1):
+        row.append(InlineKeyboardButton(str(d), callback_data=f"{prefix}_day|{year}|{month}|{d}"))
+        if len(row) == 7:
+            keyboard.append(row)
+            row = []
+    if row:
+        keyboard.append(row)
+    keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data=f"{prefix}_cancel")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+_BUILDERS = {
+    "month": lambda year, month, prefix: build_month_keyboard(year, month, prefix=prefix),
+    "years": lambda year, month, prefix: build_year_picker(year, prefix=prefix),
+    "months": lambda year, month, prefix: build_month_picker(year, prefix=prefix),
+    "days": lambda year, month, prefix: build_day_picker(year, month, prefix=prefix),
+}
+
+
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def get_keyboard(kind, year, month=None, prefix="cal"):
+    """
+    kind: "month" (full calendar), "years", "months" or "days"
+    Returns a prebuilt InlineKeyboardMarkup for (kind, year, month, prefix).
+    Markups are immutable in python-telegram-bot v20, so one instance is shared by every chat.
+    """
+    return _BUILDERS[kind](year, month, prefix)
+
+
+def warm_keyboard_cache(current_year, prefix="cal"):
+    """
+    Prebuild the pickers for the years the year picker offers (called once at startup).
+    Only the kinds the /addloan handlers ask for: years, months and days; the full "month"
+    calendar is built on demand.
+    """
+    get_keyboard("years", current_year, None, prefix)
+    for year in range(current_year, current_year - YEAR_PICKER_SPAN, -1):
+        get_keyboard("months", year, None, prefix)
+        for month in range(1, 13):
+            get_keyboard("days", year, month, prefix)
+    return get_keyboard.cache_info()
@@ -4,3 +4,84 @@ TIMEZONE = "Europe/Amsterdam"  # default timezone
 # Optional: set the hour when the daily job runs (0-23), else it will run every 24h from start
 DAILY_JOB_HOUR_UTC = None
 ADMIN_CHAT_ID = 257464496
+
+# Number of amortization schedules kept in the in-memory LRU cache (0 disables it)
+SCHEDULE_CACHE_SIZE = 1024
+
+# Amortization engine: "float" (historic float math) or "fixed" (integer minor units)
+AMORTIZATION_ENGINE = "float"
+# Minor units per currency unit for the fixed engine (100 → cents, 1 → whole rials)
+AMOUNT_MINOR_UNITS = 100
+
+# Prebuilt calendar / year / month / day picker keyboards kept in memory
+KEYBOARD_CACHE_SIZE = 2048
+
+# SQLite connection profile, applied to every new connection (see db.make_engine).
+# WAL lets the backup read while handlers write; synchronous=NORMAL is durable in WAL mode
+# except for the last commits before a power loss.
+SQLITE_PRAGMAS = {
+    "busy_timeout": 5000,        # ms to wait on a locked database before "database is locked"
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -20000,        # negative → KiB, about 20 MB of page cache per connection
+    "mmap_size": 268435456,      # 256 MB memory-mapped reads
+    "temp_store": "MEMORY",
+}
+# Connection pool for file databases (connections are reused, so the pragmas and
+# the page cache survive between sessions)
+DB_POOL_SIZE = 5
+DB_POOL_MAX_OVERFLOW = 10
+DB_POOL_TIMEOUT = 30
+# Threads that run handler database work off the event loop (db.run_db); keep it
+# within DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW
+DB_EXECUTOR_WORKERS = 4
+# Updates whose database work takes longer than this are logged (db.with_session)
+DB_SLOW_UPDATE_SECONDS = 0.5
+# Updates processed at the same time (different chats; one chat's updates still run in order)
+MAX_CONCURRENT_UPDATES = 64
+
+# Reminder delivery (delivery.py). Telegram allows about 30 messages/s per bot and
+# 1 message/s per private chat; 429 responses carry a RetryAfter that is honoured.
+DELIVERY_CONCURRENCY = 20
+DELIVERY_GLOBAL_RATE = 30
+DELIVERY_CHAT_RATE = 1
+DELIVERY_MAX_ATTEMPTS = 5
+DELIVERY_BACKOFF_BASE = 0.5  # seconds, doubled per retry of a network error
+DELIVERY_BACKOFF_MAX = 30
+
+# Reminder messages: "single" (one per installment, how the bot always sent them) or
+# "digest" (one per chat and day); users can switch with /reminders, this applies until they do
+REMINDER_MODE_DEFAULT = "single"
+# installments per digest message (each gets its own pay button)
+DIGEST_MAX_ITEMS = 20
+# Days the reminder job looks back for reminders missed while the bot was down
+REMINDER_CATCHUP_DAYS = 3
+# In-memory reminder scheduler (scheduler.py): days of upcoming reminders held in memory,
+# and the local hour they go out at for users who did not pick one (/remindtime)
+REMINDER_HORIZON_DAYS = 7
+REMINDER_SEND_HOUR = 9
+# failed sends are retried after this many minutes
+REMINDER_RETRY_MINUTES = 60
+# Worker mode (workers.py): reminder processes, each owning a shard of the chats;
+# 0 → the bot process schedules and sends reminders itself
+REMINDER_WORKERS = 0
+# how often a worker reloads its shard (it does not see the bot's updates)
+REMINDER_WORKER_RELOAD_SECONDS = 60
+# how often the coordinator logs the per-shard stats
+WORKER_STATS_INTERVAL_SECONDS = 300
+# Incremental backup (backup_service.py): rows changed since the last successful run
+# minus this overlap are copied again, for transactions that were still open then
+BACKUP_OVERLAP_SECONDS = 300
+# rows per upsert executemany
+BACKUP_BATCH_SIZE = 1000
+# What the periodic backup job runs: "sync" (row copy into backup.db) or "snapshot"
+# (a timestamped file copy through SQLite's online backup API)
+BACKUP_MODE = "sync"
+# Snapshots: directory, how many to keep (newest), pages per backup step (4 KiB each),
+# pause between steps for the bot's writers, and how many restarts (caused by writes
+# during the copy) before the rest is copied in one step
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_KEEP = 14
+SNAPSHOT_PAGES_PER_STEP = 1024
+SNAPSHOT_STEP_SLEEP = 0.005
+SNAPSHOT_MAX_RESTARTS = 3
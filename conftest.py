@@ -0,0 +1,25 @@
+# conftest.py
+# Shared pytest fixtures. The tests run in a temporary directory of their own, so the
+# relative sqlite:///loans.db of config.py (and backup.db, snapshots/) never touches a
+# real database.
+import os
+import tempfile
+
+import pytest
+
+os.chdir(tempfile.mkdtemp(prefix="loan-tests-"))
+
+
+@pytest.fixture
+def fresh_db():
+    """an empty, fully migrated loans.db; returns db.engine"""
+    from db import engine, init_db
+
+    engine.dispose()
+    for name in os.listdir("."):
+        if name.startswith("loans.db"):
+            os.remove(name)
+    init_db()
+    yield engine
+    engine.dispose()
+
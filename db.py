@@ -1,11 +1,189 @@
 # db.py
-from sqlalchemy import create_engine
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
-from config import DB_URL
+from sqlalchemy.pool import QueuePool, StaticPool
+from config import (
+    DB_URL, SQLITE_PRAGMAS, DB_POOL_SIZE, DB_POOL_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_EXECUTOR_WORKERS,
+    DB_SLOW_UPDATE_SECONDS,
+)
 from models import Base
+import migrations
+
+logger = logging.getLogger(__name__)
+
+
+def _pragma_listener(pragmas):
+    def on_connect(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+    return on_connect
+
+
+def make_engine(url, pragmas=None, echo=False):
+    """
+    Create an engine with the SQLite profile from config.py.
+    url: database URL
+    pragmas: dict of PRAGMA name → value run on every new connection (default: SQLITE_PRAGMAS, {} for none)
+    Other backends get a plain create_engine().
+    """
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite":
+        return create_engine(url, echo=echo)
+    if url.database in (None, "", ":memory:"):
+        # one shared connection, otherwise every checkout would see its own empty database
+        engine = create_engine(url, echo=echo, poolclass=StaticPool,
+                               connect_args={"check_same_thread": False})
+    else:
+        # SQLAlchemy 1.4 defaults to NullPool for SQLite files: a new connection (and a cold
+        # page cache) per session. Keep a bounded pool instead.
+        engine = create_engine(url, echo=echo, poolclass=QueuePool,
+                               pool_size=DB_POOL_SIZE, max_overflow=DB_POOL_MAX_OVERFLOW,
+                               pool_timeout=DB_POOL_TIMEOUT,
+                               connect_args={"check_same_thread": False})
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+    if pragmas:
+        event.listen(engine, "connect", _pragma_listener(pragmas))
+    return engine
+
+
+@functools.lru_cache(maxsize=None)
+def get_engine(url):
+    """one shared engine (and pool) per database URL"""
+    return make_engine(url)
 
-engine = create_engine(DB_URL, connect_args={"check_same_thread": False})
+
+engine = get_engine(DB_URL)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+# handlers never query on the event loop; a slow query only holds one of these threads
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+async def run_db(fn, *args, **kwargs):
+    """
+    Run the blocking fn(*args, **kwargs) on db_executor and await its result.
+    fn should return plain values, not ORM objects whose attributes would lazy-load on the loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(fn, *args, **kwargs))
+
+
+
+class UpdateSession:
+    """
+    The session of one update (see with_session). It is opened lazily on db_executor by the
+    first run() and committed or rolled back and closed there by finish(); a run() after
+    finish() opens a new one.
+    """
+
+    def __init__(self):
+        self.session = None
+        self.calls = 0
+        self.db_seconds = 0.0
+
+    def _timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+
+    def _call(self, fn, args, kwargs):
+        if self.session is None:
+            self.session = SessionLocal()
+        return fn(self.session, *args, **kwargs)
+
+    def _finish(self, commit):
+        if self.session is None:
+            return
+        try:
+            if commit:
+                self.session.commit()
+            else:
+                self.session.rollback()
+        finally:
+            self.session.close()
+            self.session = None
+
+    async def run(self, fn, *args, **kwargs):
+        """await fn(session, *args, **kwargs) on db_executor"""
+        self.calls += 1
+        return await run_db(self._timed, self._call, fn, args, kwargs)
+
+    async def finish(self, commit=True):
+        await run_db(self._timed, self._finish, commit)
+
+
+class DbTimings:
+    """database time per handler, as recorded by with_session"""
+
+    def __init__(self):
+        self._stats = {}
+
+    def record(self, name, seconds, calls):
+        s = self._stats.setdefault(name, {"updates": 0, "calls": 0, "total_s": 0.0, "max_s": 0.0})
+        s["updates"] += 1
+        s["calls"] += calls
+        s["total_s"] += seconds
+        s["max_s"] = max(s["max_s"], seconds)
+
+    def stats(self):
+        """{handler: {updates, calls, total_ms, mean_ms, max_ms}}, slowest total first"""
+        return {
+            name: {
+                "updates": s["updates"],
+                "calls": s["calls"],
+                "total_ms": s["total_s"] * 1000,
+                "mean_ms": s["total_s"] / s["updates"] * 1000,
+                "max_ms": s["max_s"] * 1000,
+            }
+            for name, s in sorted(self._stats.items(), key=lambda item: -item[1]["total_s"])
+        }
+
+    def clear(self):
+        self._stats.clear()
+
+
+db_timings = DbTimings()
+
+
+def with_session(handler):
+    """
+    Decorator for handlers and jobs: handler(*args, db) gets one UpdateSession per call.
+    It is committed when the handler returns, rolled back when it raises and always closed;
+    its database time is added to db_timings. Handlers that write call await db.finish()
+    right after the write, so the transaction never stays open across a Telegram call.
+    """
+    @functools.wraps(handler)
+    async def wrapper(*args):
+        db = UpdateSession()
+        ok = False
+        try:
+            result = await handler(*args, db)
+            ok = True
+            return result
+        finally:
+            await db.finish(commit=ok)
+            db_timings.record(handler.__name__, db.db_seconds, db.calls)
+            if db.db_seconds > DB_SLOW_UPDATE_SECONDS:
+                logger.warning("%s spent %.0f ms in the database (%d calls)",
+                               handler.__name__, db.db_seconds * 1000, db.calls)
+    return wrapper
+
+
 def init_db():
+    fresh = migrations.is_fresh(engine)
     Base.metadata.create_all(engine)
+    # create_all never touches existing tables; bring older loans.db files up to date in place
+    migrations.migrate(engine, fresh=fresh)
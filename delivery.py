@@ -0,0 +1,202 @@
+# delivery.py
+# Rate-limited, concurrent message delivery for the reminder job.
+# Messages are sent by DELIVERY_CONCURRENCY workers. Each send waits for a token
+# of the message's chat (DELIVERY_CHAT_RATE/s) and of the bot (DELIVERY_GLOBAL_RATE/s).
+# A 429 (RetryAfter) pauses every worker for the time Telegram asks for and retries.
+# Network errors are retried with exponential backoff. Permanent errors (blocked bot,
+# chat not found / bad request, migrated chat) fail the message at once and are
+# reported in stats.permanent, so the caller does not try them again either.
+#
+#   python fake_bot.py                    # run the pipeline against a local fake bot
+#   python -m pytest -q test_delivery.py  # the same fake bot, as tests
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from config import (
+    DELIVERY_CONCURRENCY, DELIVERY_GLOBAL_RATE, DELIVERY_CHAT_RATE, DELIVERY_MAX_ATTEMPTS,
+    DELIVERY_BACKOFF_BASE, DELIVERY_BACKOFF_MAX,
+)
+
+logger = logging.getLogger(__name__)
+
+# BadRequest subclasses NetworkError in python-telegram-bot 20, so these are caught first
+PERMANENT_ERRORS = (BadRequest, Forbidden, ChatMigrated)
+SENT, FAILED, PERMANENT = "sent", "failed", "permanent"
+
+
+class TokenBucket:
+    """
+    rate tokens per second, at most capacity stored (capacity 1 → evenly spaced sends).
+    Only used from one event loop, so no lock is needed.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """seconds until a token is available (0 → now)"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def try_acquire(self):
+        if self.delay() == 0.0:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
+
+
+class DeliveryStats:
+    def __init__(self):
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.rate_limited = 0  # RetryAfter responses
+        self.errors = []       # (chat_id, repr(error)) of failed messages
+        self.delivered = []    # indexes (in the send_all input) of the messages that went out
+        self.permanent = []    # indexes of the messages that failed for good (not worth retrying)
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def as_dict(self):
+        return {
+            "queued": self.queued,
+            "sent": self.sent,
+            "failed": self.failed,
+            "permanent": len(self.permanent),
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "elapsed_s": round(self.elapsed, 3),
+            "per_second": round(self.sent / self.elapsed, 2) if self.elapsed else None,
+        }
+
+    def __repr__(self):
+        return f"DeliveryStats({self.as_dict()})"
+
+
+class Delivery:
+    """
+    Send many messages through bot.send_message within Telegram's limits.
+    messages for send_all(): dicts of send_message keyword arguments (chat_id, text, reply_markup, ...)
+    """
+
+    def __init__(self, bot, concurrency=DELIVERY_CONCURRENCY, global_rate=DELIVERY_GLOBAL_RATE,
+                 chat_rate=DELIVERY_CHAT_RATE, max_attempts=DELIVERY_MAX_ATTEMPTS,
+                 backoff_base=DELIVERY_BACKOFF_BASE, backoff_max=DELIVERY_BACKOFF_MAX):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # capacity 1: sends are spaced evenly, never a burst above the per-second limit
+        self.global_bucket = TokenBucket(global_rate, capacity=1)
+        self.chat_buckets = defaultdict(lambda: TokenBucket(chat_rate, capacity=1))
+        self.paused_until = 0.0
+        self.stats = DeliveryStats()
+
+    async def _acquire(self, chat_bucket):
+        # the chat token is taken last, right before the send, so waiting for a pause or a
+        # global token can never squeeze two messages of one chat closer than its limit
+        while True:
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            wait = chat_bucket.delay()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            await self.global_bucket.acquire()
+            if self.paused_until <= time.monotonic() and chat_bucket.try_acquire():
+                return
+
+    async def _send(self, message):
+        """returns SENT, FAILED (retries used up) or PERMANENT"""
+        chat_id = message["chat_id"]
+        error = None
+        outcome = FAILED
+        for attempt in range(1, self.max_attempts + 1):
+            if attempt > 1:
+                self.stats.retries += 1
+            await self._acquire(self.chat_buckets[chat_id])
+            try:
+                await self.bot.send_message(**message)
+                self.stats.sent += 1
+                return SENT
+            except RetryAfter as e:
+                # flood control is per bot: every worker waits, not only this one
+                self.stats.rate_limited += 1
+                self.paused_until = max(self.paused_until, time.monotonic() + float(e.retry_after))
+                error = e
+            except PERMANENT_ERRORS as e:
+                # bot blocked, chat not found, bad markup, ...: retrying will not help
+                error = e
+                outcome = PERMANENT
+                break
+            except NetworkError as e:
+                # includes TimedOut
+                error = e
+                if attempt < self.max_attempts:
+                    delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            except TelegramError as e:
+                # other API errors (e.g. InvalidToken): give up on this message
+                error = e
+                break
+        self.stats.failed += 1
+        self.stats.errors.append((chat_id, repr(error)))
+        logger.error("Giving up on message to %s: %s", chat_id, error)
+        return outcome
+
+    async def _worker(self, queue):
+        while True:
+            index, message = await queue.get()
+            try:
+                outcome = await self._send(message)
+                if outcome == SENT:
+                    self.stats.delivered.append(index)
+                elif outcome == PERMANENT:
+                    self.stats.permanent.append(index)
+            except Exception:
+                self.stats.failed += 1
+                logger.exception("Unexpected error sending to %s", message.get("chat_id"))
+            finally:
+                queue.task_done()
+
+    async def send_all(self, messages):
+        """send every message; returns DeliveryStats (stats.delivered: indexes of the sent messages)"""
+        queue = asyncio.Queue()
+        for item in enumerate(messages):
+            queue.put_nowait(item)
+            self.stats.queued += 1
+        workers = [asyncio.create_task(self._worker(queue))
+                   for _ in range(min(self.concurrency, queue.qsize()))]
+        try:
+            await queue.join()
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        self.stats.finished = time.monotonic()
+        return self.stats
@@ -0,0 +1,123 @@
+# fake_bot.py
+# Local stand-in for telegram.Bot to exercise delivery.py without Telegram.
+# FakeBot.send_message answers after a simulated latency and behaves like the
+# Bot API under load:
+#   - more than global_rate messages in one second, or two messages to one chat
+#     within 1/chat_rate seconds → RetryAfter (counted as limit_violations)
+#   - failure_rate of the calls → TimedOut
+#   - every flood_every-th call → RetryAfter(retry_after), as a flood-control burst
+#   - chats in blocked_chats → Forbidden
+#   - chats in bad_chats → BadRequest("Chat not found"), a NetworkError subclass in PTB 20
+#
+#   python fake_bot.py --messages 300 --chats 200 --failure-rate 0.02 --flood-every 100 --bad 2
+import argparse
+import asyncio
+import random
+import sys
+import time
+import types
+from collections import deque
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut
+
+from delivery import Delivery
+
+
+class FakeBot:
+    def __init__(self, latency=0.05, global_rate=30, chat_rate=1, failure_rate=0.0,
+                 flood_every=0, retry_after=1, blocked_chats=(), bad_chats=(), seed=0):
+        self.latency = latency
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.failure_rate = failure_rate
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.blocked_chats = set(blocked_chats)
+        self.bad_chats = set(bad_chats)
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.limit_violations = 0
+        self.injected_floods = 0
+        self.network_errors = 0
+        self.delivered = []  # (chat_id, text)
+        self.calls_by_chat = {}
+        self._window = deque()
+        self._last_by_chat = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        self.calls += 1
+        self.calls_by_chat[chat_id] = self.calls_by_chat.get(chat_id, 0) + 1
+        now = time.monotonic()
+        try:
+            if chat_id in self.blocked_chats:
+                raise Forbidden("Forbidden: bot was blocked by the user")
+            if chat_id in self.bad_chats:
+                raise BadRequest("Chat not found")
+            if self.flood_every and self.calls % self.flood_every == 0:
+                self.injected_floods += 1
+                raise RetryAfter(self.retry_after)
+            while self._window and self._window[0] <= now - 1:
+                self._window.popleft()
+            last = self._last_by_chat.get(chat_id)
+            if len(self._window) >= self.global_rate or (last is not None and now - last < 1 / self.chat_rate):
+                self.limit_violations += 1
+                raise RetryAfter(self.retry_after)
+            if self.random.random() < self.failure_rate:
+                self.network_errors += 1
+                raise TimedOut()
+            self._window.append(now)
+            self._last_by_chat[chat_id] = now
+        finally:
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+        self.delivered.append((chat_id, text))
+        return types.SimpleNamespace(message_id=len(self.delivered), chat_id=chat_id, text=text)
+
+
+def simulated_messages(count, chats, seed=0):
+    rnd = random.Random(seed)
+    return [{"chat_id": 1000 + rnd.randrange(chats), "text": f"reminder {i}"} for i in range(count)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="run delivery.Delivery against FakeBot")
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per API call")
+    parser.add_argument("--failure-rate", type=float, default=0.02)
+    parser.add_argument("--flood-every", type=int, default=100)
+    parser.add_argument("--blocked", type=int, default=2, help="chats that blocked the bot")
+    parser.add_argument("--bad", type=int, default=2, help="chats that answer BadRequest (chat not found)")
+    args = parser.parse_args(argv)
+
+    messages = simulated_messages(args.messages, args.chats)
+    blocked = {1000 + i for i in range(args.blocked)}
+    bad = {1000 + args.blocked + i for i in range(args.bad)}
+    bot = FakeBot(latency=args.latency, failure_rate=args.failure_rate,
+                  flood_every=args.flood_every, blocked_chats=blocked, bad_chats=bad)
+    stats = asyncio.run(Delivery(bot).send_all(messages))
+
+    failing = blocked | bad
+    expected = sum(1 for m in messages if m["chat_id"] not in failing)
+    print(stats.as_dict())
+    print(f"fake bot: {bot.calls} calls, {len(bot.delivered)} delivered (expected {expected}), "
+          f"{bot.limit_violations} limit violations, {bot.injected_floods} injected floods, "
+          f"{bot.network_errors} network errors")
+    print(f"serial sends would take about {args.messages * args.latency:.1f}s of latency alone, "
+          f"plus per-chat spacing for chats with several messages")
+    # permanent failures are tried exactly once: one call per message to those chats
+    once = all(bot.calls_by_chat.get(chat, 0) == sum(1 for m in messages if m["chat_id"] == chat)
+               for chat in failing)
+    print(f"permanent failures: {len(stats.permanent)}, tried once each: {once}")
+    ok = (len(bot.delivered) == expected and stats.failed == len(messages) - expected
+          and len(stats.permanent) == len(messages) - expected and once)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
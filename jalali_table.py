@@ -0,0 +1,131 @@
+# jalali_table.py
+# Precomputed Jalali calendar for O(1) conversions.
+# For every month of FIRST_YEAR..LAST_YEAR we keep the gregorian ordinal of its
+# first day, its length and the weekday it starts on, so gregorian -> jalali is a
+# bisect plus a subtraction and jalali -> gregorian is an index plus an add.
+# Dates outside the table fall back to jdatetime.
+#
+#   python jalali_table.py     # validate every day of the table against jdatetime
+import bisect
+import datetime
+import sys
+from array import array
+
+import jdatetime
+
+FIRST_YEAR = 1200  # 1821-03-21
+LAST_YEAR = 1600   # ends 2222-03-20
+
+# طول ماه‌ها در سال عادی (اسفند در سال کبیسه ۳۰ روز است)
+MONTH_DAYS = (31, 31, 31, 31, 31, 31, 30, 30, 30, 30, 30, 29)
+
+
+def is_leap(year):
+    # same 33-year rule jdatetime uses
+    return year % 33 in (1, 5, 9, 13, 17, 22, 26, 30)
+
+
+def _build_tables():
+    starts = array("l")
+    lengths = bytearray()
+    ordinal = jdatetime.date(FIRST_YEAR, 1, 1).togregorian().toordinal()
+    for year in range(FIRST_YEAR, LAST_YEAR + 1):
+        for month in range(1, 13):
+            length = 30 if month == 12 and is_leap(year) else MONTH_DAYS[month - 1]
+            starts.append(ordinal)
+            lengths.append(length)
+            ordinal += length
+    starts.append(ordinal)  # sentinel: the day after the table ends
+    return starts, bytes(lengths)
+
+
+MONTH_STARTS, MONTH_LENGTHS = _build_tables()
+# weekday of each month's first day, Saturday=0 .. Friday=6 (ordinal 1 was a Monday)
+MONTH_WEEKDAYS = bytes((o + 1) % 7 for o in MONTH_STARTS[:-1])
+FIRST_ORDINAL = MONTH_STARTS[0]
+END_ORDINAL = MONTH_STARTS[-1]
+
+
+def _index(year, month):
+    if not 1 <= month <= 12:
+        raise ValueError(f"invalid jalali month: {month}")
+    if FIRST_YEAR <= year <= LAST_YEAR:
+        return (year - FIRST_YEAR) * 12 + month - 1
+    return None
+
+
+def month_length(year, month):
+    i = _index(year, month)
+    if i is not None:
+        return MONTH_LENGTHS[i]
+    return 30 if month == 12 and is_leap(year) else MONTH_DAYS[month - 1]
+
+
+def month_start_ordinal(year, month):
+    """gregorian ordinal of the first day of jalali year/month"""
+    i = _index(year, month)
+    if i is not None:
+        return MONTH_STARTS[i]
+    return jdatetime.date(year, month, 1).togregorian().toordinal()
+
+
+def month_start_weekday(year, month):
+    """weekday of the first day of jalali year/month, Saturday=0 .. Friday=6"""
+    i = _index(year, month)
+    if i is not None:
+        return MONTH_WEEKDAYS[i]
+    return (month_start_ordinal(year, month) + 1) % 7
+
+
+def to_gregorian(year, month, day):
+    """jalali (year, month, day) -> datetime.date; ValueError for invalid dates"""
+    if not 1 <= day <= month_length(year, month):
+        raise ValueError(f"invalid jalali date: {year}-{month}-{day}")
+    return datetime.date.fromordinal(month_start_ordinal(year, month) + day - 1)
+
+
+def to_jalali(gdate):
+    """datetime.date -> jalali (year, month, day)"""
+    o = gdate.toordinal()
+    if FIRST_ORDINAL <= o < END_ORDINAL:
+        i = bisect.bisect_right(MONTH_STARTS, o) - 1
+        years, month0 = divmod(i, 12)
+        return FIRST_YEAR + years, month0 + 1, o - MONTH_STARTS[i] + 1
+    jd = jdatetime.date.fromgregorian(date=gdate)
+    return jd.year, jd.month, jd.day
+
+
+def format_jalali(gdate):
+    """datetime.date -> "yyyy/m/d" in jalali, as shown in bot messages"""
+    y, m, d = to_jalali(gdate)
+    return f"{y}/{m}/{d}"
+
+
+def validate(first_year=FIRST_YEAR, last_year=LAST_YEAR):
+    """
+    Compare every day of first_year..last_year with jdatetime (both directions and weekdays).
+    returns: list of mismatch descriptions (empty when the table is correct)
+    """
+    errors = []
+    o = jdatetime.date(first_year, 1, 1).togregorian().toordinal()
+    end = jdatetime.date(last_year + 1, 1, 1).togregorian().toordinal()
+    while o < end:
+        gdate = datetime.date.fromordinal(o)
+        jd = jdatetime.date.fromgregorian(date=gdate)
+        expected = (jd.year, jd.month, jd.day)
+        if to_jalali(gdate) != expected:
+            errors.append(f"to_jalali({gdate}) = {to_jalali(gdate)}, jdatetime says {expected}")
+        elif to_gregorian(*expected) != gdate:
+            errors.append(f"to_gregorian{expected} = {to_gregorian(*expected)}, expected {gdate}")
+        elif jd.day == 1 and month_start_weekday(jd.year, jd.month) != (gdate.weekday() + 2) % 7:
+            errors.append(f"weekday of {jd.year}/{jd.month} is wrong")
+        o += 1
+    return errors
+
+
+if __name__ == "__main__":
+    problems = validate()
+    for p in problems[:20]:
+        print(p)
+    print(f"{len(problems)} mismatches in {FIRST_YEAR}..{LAST_YEAR}")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,38 @@
+# job_state.py
+# Persisted state of background jobs (watermarks, last successful run, ...), one
+# string value per name in the job_state table.
+import datetime
+
+from models import JobState
+
+
+def get_state(session, name, default=None):
+    row = session.get(JobState, name)
+    return row.value if row is not None else default
+
+
+def set_state(session, name, value):
+    """store value (str) under name; committed with the caller's transaction"""
+    row = session.get(JobState, name)
+    if row is None:
+        session.add(JobState(name=name, value=value))
+    else:
+        row.value = value
+
+
+def get_date(session, name):
+    value = get_state(session, name)
+    return datetime.date.fromisoformat(value) if value else None
+
+
+def set_date(session, name, day):
+    set_state(session, name, day.isoformat())
+
+
+def get_datetime(session, name):
+    value = get_state(session, name)
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def set_datetime(session, name, moment):
+    set_state(session, name, moment.isoformat())
@@ -54,23 +54,42 @@
 # logic.py
 import math
 import datetime
+import itertools
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from fractions import Fraction
 import jdatetime
+import numpy as np
 from dateutil.relativedelta import relativedelta
 
+import jalali_table
+from config import SCHEDULE_CACHE_SIZE, AMORTIZATION_ENGINE, AMOUNT_MINOR_UNITS
+
 def add_months_preserve_day(date_obj, months):
     """
     date_obj: datetime.date (گرگوری)
     months: int
     Return: datetime.date (گرگوری) — ماه‌ها را بر اساس تقویم جلالی/شمسی اضافه می‌کند و روز را حفظ می‌کند.
     """
-    # تبدیل گرگوری -> جلالی
-    jstart = jdatetime.date.fromgregorian(date=date_obj)
+    # تبدیل گرگوری -> جلالی (از جدول پیش‌محاسبه‌شده)
+    y, m, d = jalali_table.to_jalali(date_obj)
 
     # محاسبه تاریخ جلالی جدید با حفظ روز (یا کپ به آخر ماه جلالی اگر روز معتبر نباشد)
-    new_j = add_months_jalali_preserve_day(jstart, months)
+    new_y, new_m, new_d = _add_months_jalali(y, m, d, months)
 
     # تبدیل برگردانده شده به گرگوری برای ذخیره/پردازش بعدی
-    return new_j.togregorian()
+    return jalali_table.to_gregorian(new_y, new_m, new_d)
+
+
+def _add_months_jalali(y, m, d, months):
+    total = m + months
+    # محاسبه سال و ماه جدید در جلالی
+    new_y = y + (total - 1) // 12
+    new_m = (total - 1) % 12 + 1
+    # اگر روز در ماه هدف وجود نداشته باشد، به آخرین روز ماه کپ می‌شود
+    return new_y, new_m, min(d, jalali_table.month_length(new_y, new_m))
 
 
 def add_months_jalali_preserve_day(jdate, months):
@@ -79,47 +98,155 @@ def add_months_jalali_preserve_day(jdate, months):
     months: int
     return: jdatetime.date
     افزایشی امن روی ماه‌های جلالی با تلاش برای نگه داشتن روزِ همان‌قدر؛
-    در صورت ناموجود بودن روز در ماه هدف، روز به سمت پایین تا اولین روز معتبر کاهش می‌یابد.
+    در صورت ناموجود بودن روز در ماه هدف، روز به آخرین روز معتبر آن ماه کاهش می‌یابد.
     """
-    y = jdate.year
-    m = jdate.month
-    d = jdate.day
+    return jdatetime.date(*_add_months_jalali(jdate.year, jdate.month, jdate.day, months))
 
-    total = m + months
-    # محاسبه سال و ماه جدید در جلالی
-    new_y = y + (total - 1) // 12
-    new_m = (total - 1) % 12 + 1
 
-    # تلاش برای ساخت تاریخ با همان روز؛ در صورت خطا روز را یکی یکی کم می‌کنیم (کپ به انتهای ماه)
-    for try_day in range(d, 0, -1):
-        try:
-            return jdatetime.date(new_y, new_m, try_day)
-        except ValueError:
-            continue
-
-    # به طور منطقی هرگز اینجا نخواهیم رسید چون روز=1 همیشه معتبر است
-    raise ValueError("unable to construct valid jalali date")
-
-
-def calculate_amortization(principal, annual_rate, term_months, first_payment_date):
+def jalali_monthly_series(first_date, n):
     """
-    principal: float
-    annual_rate: percent (e.g., 18.5)
-    term_months: int
-    first_payment_date: datetime.date (گرگوری)
-    returns: list of dicts for each installment (due_date is datetime.date (gregorian))
+    first_date: datetime.date (گرگوری)
+    n: int
+    yields: n datetime.date (گرگوری) — first_date and the same jalali day in each following month,
+            capped to the end of shorter months exactly like add_months_preserve_day(first_date, i)
     """
-    if term_months <= 0:
-        return []
+    if n <= 0:
+        return
+    year, month, day = jalali_table.to_jalali(first_date)
+    for _ in range(n):
+        capped_day = min(day, jalali_table.month_length(year, month))
+        yield datetime.date.fromordinal(jalali_table.month_start_ordinal(year, month) + capped_day - 1)
+        month += 1
+        if month > 12:
+            month = 1
+            year += 1
 
-    r = annual_rate / 100 / 12  # monthly rate
+
+def _rate_and_payment(principal, annual_rate, term_months):
+    # monthly rate and (unrounded) annuity payment, shared by every engine below
+    r = annual_rate / 100 / 12
     if r == 0:
         payment = round(principal / term_months, 2)
     else:
         payment = principal * r / (1 - (1 + r) ** -term_months)
+    return r, payment
+
+
+# ----------------------------------------------------------------------
+# Compact schedule storage
+# ----------------------------------------------------------------------
+SCHEDULE_KEYS = ("installment", "due_date", "payment", "interest", "principal", "remaining")
+
+
+class ScheduleRow(Mapping):
+    """Read-only view of one Schedule row; behaves like the old row dict."""
+    __slots__ = ("_schedule", "_index")
+
+    def __init__(self, schedule, index):
+        self._schedule = schedule
+        self._index = index
+
+    def __getitem__(self, key):
+        s, i = self._schedule, self._index
+        if key == "installment":
+            return i + 1
+        if key == "due_date":
+            return datetime.date.fromordinal(s.due_ordinals[i])
+        if key in ("payment", "interest", "principal", "remaining"):
+            return getattr(s, key)[i]
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(SCHEDULE_KEYS)
+
+    def __len__(self):
+        return len(SCHEDULE_KEYS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class Schedule(Sequence):
+    """
+    Amortization schedule stored column-wise: payment, interest, principal and
+    remaining are array('d') columns and due dates are gregorian ordinals.
+    Indexing returns ScheduleRow views, so row["payment"] etc. keep working,
+    while bulk consumers can read the columns directly.
+    """
+    _COLUMNS = ("payment", "interest", "principal", "remaining", "due_ordinals")
+    __slots__ = _COLUMNS + ("_frozen",)
+
+    def __init__(self):
+        self._frozen = False
+        self.payment = array("d")
+        self.interest = array("d")
+        self.principal = array("d")
+        self.remaining = array("d")
+        self.due_ordinals = array("l")
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError("frozen Schedule cannot be modified")
+        object.__setattr__(self, name, value)
+
+    def freeze(self):
+        """Turn the columns into read-only memoryviews; used for shared (cached) schedules."""
+        for name in self._COLUMNS:
+            object.__setattr__(self, name, memoryview(getattr(self, name)).toreadonly())
+        object.__setattr__(self, "_frozen", True)
+        return self
+
+    @property
+    def frozen(self):
+        return self._frozen
+
+    def append(self, due_date, payment, interest, principal, remaining):
+        if self._frozen:
+            raise AttributeError("frozen Schedule cannot be modified")
+        self.due_ordinals.append(due_date.toordinal())
+        self.payment.append(payment)
+        self.interest.append(interest)
+        self.principal.append(principal)
+        self.remaining.append(remaining)
+
+    def __len__(self):
+        return len(self.payment)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ScheduleRow(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("schedule index out of range")
+        return ScheduleRow(self, index)
+
+    def __eq__(self, other):
+        if isinstance(other, Schedule):
+            return all(getattr(self, c) == getattr(other, c) for c in self._COLUMNS)
+        if isinstance(other, Sequence):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def due_dates(self):
+        return [datetime.date.fromordinal(o) for o in self.due_ordinals]
+
+    def to_list(self):
+        return [dict(row) for row in self]
+
+    def __repr__(self):
+        return f"Schedule({self.to_list()!r})"
+
+
+def _amortization_rows(principal, annual_rate, term_months, first_payment_date):
+    # (installment, due_date, payment, interest, principal, remaining) tuples
+    if term_months <= 0:
+        return
+
+    r, payment = _rate_and_payment(principal, annual_rate, term_months)
 
-    schedule = []
     balance = principal
+    due_dates = jalali_monthly_series(first_payment_date, term_months)
     for i in range(1, term_months + 1):
         interest = round(balance * r, 10)
         principal_part = payment - interest
@@ -134,16 +261,413 @@ def calculate_amortization(principal, annual_rate, term_months, first_payment_da
         interest = round(interest, 2)
         balance = round(balance - principal_part, 2)
 
-        # <-- این خط حالا تاریخ درست (گرگوری) را باز می‌گرداند،
-        #      زیرا add_months_preserve_day ماه‌ها را در تقویم جلالی اضافه می‌کند
-        due_date = add_months_preserve_day(first_payment_date, i - 1)
-
-        schedule.append({
-            "installment": i,
-            "due_date": due_date,
-            "payment": payment_amount,
-            "interest": interest,
-            "principal": principal_part,
-            "remaining": balance
-        })
+        # ماه‌ها در تقویم جلالی اضافه می‌شوند (همان نتیجه‌ی add_months_preserve_day)
+        yield i, next(due_dates), payment_amount, interest, principal_part, balance
+
+
+# ----------------------------------------------------------------------
+# Fixed-point engine: integer minor units (cents / rials)
+# ----------------------------------------------------------------------
+ENGINE_FLOAT = "float"
+ENGINE_FIXED = "fixed"
+ENGINES = (ENGINE_FLOAT, ENGINE_FIXED)
+
+_default_engine = None
+
+
+def set_default_engine(engine):
+    """Select the engine used when callers don't pass engine= explicitly."""
+    global _default_engine
+    _default_engine = _resolve_engine(engine)
+
+
+def _resolve_engine(engine):
+    engine = engine or _default_engine
+    if engine not in ENGINES:
+        raise ValueError(f"unknown amortization engine: {engine!r}")
+    return engine
+
+
+# a misspelt config.AMORTIZATION_ENGINE fails at import, not at the first schedule
+set_default_engine(AMORTIZATION_ENGINE)
+
+
+def _exact(value):
+    # the decimal the user typed (18.5, 1234.56), not its binary approximation
+    return Fraction(repr(float(value)))
+
+
+def _div_round_half_even(numerator, denominator):
+    q, rem = divmod(numerator, denominator)
+    twice = 2 * rem
+    if twice > denominator or (twice == denominator and q & 1):
+        q += 1
+    return q
+
+
+def _amortization_rows_fixed(principal, annual_rate, term_months, first_payment_date, minor_units):
+    # same tuples as _amortization_rows, computed in integer minor units:
+    # principal parts add up to the principal exactly and the hot loop never touches a float
+    if term_months <= 0:
+        return
+
+    balance = round(_exact(principal) * minor_units)
+    rate = _exact(annual_rate) / 1200  # monthly rate as an exact fraction
+    rate_num, rate_den = rate.numerator, rate.denominator
+
+    if rate == 0:
+        payment = round(Fraction(balance, term_months))
+    else:
+        growth = (1 + rate) ** term_months
+        payment = round(balance * rate * growth / (growth - 1))
+
+    due_dates = jalali_monthly_series(first_payment_date, term_months)
+    for i in range(1, term_months + 1):
+        interest = _div_round_half_even(balance * rate_num, rate_den)
+        if i == term_months:
+            principal_part = balance
+            payment_amount = interest + principal_part
+        else:
+            principal_part = payment - interest
+            payment_amount = payment
+        balance -= principal_part
+
+        yield (i, next(due_dates), payment_amount / minor_units, interest / minor_units,
+               principal_part / minor_units, balance / minor_units)
+
+
+def _engine_rows(principal, annual_rate, term_months, first_payment_date, engine):
+    if _resolve_engine(engine) == ENGINE_FIXED:
+        return _amortization_rows_fixed(principal, annual_rate, term_months, first_payment_date,
+                                        AMOUNT_MINOR_UNITS)
+    return _amortization_rows(principal, annual_rate, term_months, first_payment_date)
+
+
+def iter_amortization(principal, annual_rate, term_months, first_payment_date, engine=None):
+    """
+    principal: float
+    annual_rate: percent (e.g., 18.5)
+    term_months: int
+    first_payment_date: datetime.date (گرگوری)
+    engine: "float" | "fixed" | None (None → default engine, see set_default_engine)
+    yields: one dict per installment, lazily (same rows as calculate_amortization)
+    """
+    for row in _engine_rows(principal, annual_rate, term_months, first_payment_date, engine):
+        yield dict(zip(SCHEDULE_KEYS, row))
+
+
+def calculate_amortization(principal, annual_rate, term_months, first_payment_date, engine=None):
+    """
+    principal: float
+    annual_rate: percent (e.g., 18.5)
+    term_months: int
+    first_payment_date: datetime.date (گرگوری)
+    engine: "float" | "fixed" | None (None → default engine, see set_default_engine)
+    returns: Schedule — one row per installment; rows support the old dict access
+             (row["due_date"] is datetime.date (gregorian), amounts are float)
+    """
+    schedule = Schedule()
+    for _, due_date, payment, interest, principal_part, remaining in _engine_rows(
+            principal, annual_rate, term_months, first_payment_date, engine):
+        schedule.append(due_date, payment, interest, principal_part, remaining)
     return schedule
+
+
+# ----------------------------------------------------------------------
+# Schedule cache
+# ----------------------------------------------------------------------
+class ScheduleCache:
+    """
+    Bounded LRU cache of schedules keyed on (principal, rate, term, first payment date, engine).
+    Entries are frozen Schedules, so callers sharing them cannot corrupt each other.
+    capacity=0 disables caching (every call is a miss).
+    """
+
+    def __init__(self, capacity=SCHEDULE_CACHE_SIZE):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, principal, annual_rate, term_months, first_payment_date, engine=None):
+        engine = _resolve_engine(engine)
+        key = (float(principal), float(annual_rate), int(term_months), first_payment_date, engine)
+        with self._lock:
+            schedule = self._entries.get(key)
+            if schedule is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return schedule
+            self.misses += 1
+
+        schedule = calculate_amortization(principal, annual_rate, term_months, first_payment_date,
+                                          engine=engine).freeze()
+        if self.capacity > 0:
+            with self._lock:
+                self._entries[key] = schedule
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+        return schedule
+
+    def resize(self, capacity):
+        with self._lock:
+            self.capacity = capacity
+            while len(self._entries) > max(capacity, 0):
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+schedule_cache = ScheduleCache()
+
+
+def cached_amortization(principal, annual_rate, term_months, first_payment_date, engine=None):
+    """
+    Same as calculate_amortization but served from the shared LRU cache.
+    returns: frozen Schedule (read-only; call .to_list() for a private mutable copy)
+    """
+    return schedule_cache.get(principal, annual_rate, term_months, first_payment_date, engine)
+
+
+# ----------------------------------------------------------------------
+# Single-row lookups
+# ----------------------------------------------------------------------
+def _fixed_row(principal, annual_rate, term_months, first_payment_date, k):
+    # the fixed engine has no float drift to replay; walk its integer rows up to k
+    rows = _engine_rows(principal, annual_rate, term_months, first_payment_date, ENGINE_FIXED)
+    return next(itertools.islice(rows, k - 1, None))
+
+
+def remaining_balance_at(principal, annual_rate, term_months, k, exact=True, engine=None):
+    """
+    principal: float
+    annual_rate: percent (e.g., 18.5)
+    term_months: int
+    k: int — number of installments already paid (0 returns principal)
+    exact: bool — True: same value as calculate_amortization(...)[k-1]["remaining"];
+           False: annuity closed form rounded to cents, O(1) but without the per-row cent drift
+    engine: "float" | "fixed" | None, as in calculate_amortization
+    returns: float
+    """
+    if k < 0 or k > term_months:
+        raise ValueError("k must be between 0 and term_months")
+    if k == 0:
+        return principal
+    if k == term_months:
+        return 0.0
+    if exact and _resolve_engine(engine) == ENGINE_FIXED:
+        # amounts don't depend on the dates; any first date will do
+        return _fixed_row(principal, annual_rate, term_months, datetime.date(2000, 1, 1), k)[5]
+
+    r, payment = _rate_and_payment(principal, annual_rate, term_months)
+    if not exact:
+        if r == 0:
+            return round(principal - k * payment, 2)
+        growth = (1 + r) ** k
+        return round(principal * growth - payment * (growth - 1) / r, 2)
+
+    # each row rounds the previous balance, so the drift is path dependent;
+    # replay only the balance recurrence (no dates, no dicts)
+    balance = principal
+    for _ in range(k):
+        principal_part = round(payment - round(balance * r, 10), 2)
+        balance = round(balance - principal_part, 2)
+    return balance
+
+
+def installment_at(principal, annual_rate, term_months, first_payment_date, k, exact=True, engine=None):
+    """
+    principal: float
+    annual_rate: percent (e.g., 18.5)
+    term_months: int
+    first_payment_date: datetime.date (گرگوری)
+    k: int — installment number, 1..term_months
+    exact: bool — see remaining_balance_at
+    engine: "float" | "fixed" | None, as in calculate_amortization
+    returns: dict shaped like one calculate_amortization row (with exact=True, equal to it)
+    """
+    if k < 1 or k > term_months:
+        raise ValueError("k must be between 1 and term_months")
+    if exact and _resolve_engine(engine) == ENGINE_FIXED:
+        return dict(zip(SCHEDULE_KEYS, _fixed_row(principal, annual_rate, term_months, first_payment_date, k)))
+
+    r, payment = _rate_and_payment(principal, annual_rate, term_months)
+    balance = remaining_balance_at(principal, annual_rate, term_months, k - 1, exact=exact)
+
+    interest = round(balance * r, 10)
+    if k == term_months:
+        principal_part = balance
+        payment_amount = round(interest + principal_part, 2)
+    else:
+        payment_amount = round(payment, 2)
+        principal_part = round(payment - interest, 2)
+
+    return {
+        "installment": k,
+        "due_date": add_months_preserve_day(first_payment_date, k - 1),
+        "payment": payment_amount,
+        "interest": round(interest, 2),
+        "principal": principal_part,
+        "remaining": round(balance - principal_part, 2),
+    }
+
+
+# ----------------------------------------------------------------------
+# Batch engine: many loans in one NumPy pass
+# ----------------------------------------------------------------------
+# تعداد وام‌هایی که در هر بلوک با هم پردازش می‌شوند (برای محدود نگه داشتن حافظه)
+BATCH_BLOCK_SIZE = 4096
+
+
+_SPLITTER = 134217729.0  # 2**27 + 1 (Veltkamp split)
+
+
+def _split(a):
+    c = _SPLITTER * a
+    hi = c - (c - a)
+    return hi, a - hi
+
+
+def _round_like_python(values, ndigits):
+    """
+    values: np.ndarray (float64)
+    ndigits: int
+    return: np.ndarray — element-wise equal to round(v, ndigits) for every v.
+
+    Python's round() rounds the exact decimal value of v (half to even), while
+    np.round() rounds the already-rounded binary product v * 10**ndigits.  The
+    two only disagree on .5 ties, so the exact error of that product is
+    recovered with Dekker's two-product and used to settle the ties.  From
+    2**53 up the float spacing is wider than the rounding step and round()
+    returns v itself; exact powers of two and non-finite values go to round().
+    """
+    scale = 10.0 ** ndigits
+    scale_hi, scale_lo = _split(scale)
+    with np.errstate(over="ignore", invalid="ignore"):
+        scaled = values * scale
+        values_hi, values_lo = _split(values)
+        # values * scale == scaled + err, exactly
+        err = ((values_hi * scale_hi - scaled) + values_hi * scale_lo + values_lo * scale_hi) \
+            + values_lo * scale_lo
+        rounded = np.rint(scaled)
+        frac = scaled - rounded  # exact, in [-0.5, 0.5]
+
+        # scaled sits on a .5 tie but the exact value is past it (or short of it)
+        half = (np.abs(frac) == 0.5) & (err != 0) & (np.sign(err) == np.sign(frac))
+        rounded = np.where(half, rounded + 2 * frac, rounded)
+        # scaled is an integer and the exact value is a true .5 tie: round half to even
+        tie = (frac == 0) & (np.abs(err) == 0.5) & (np.fmod(rounded, 2) != 0)
+        rounded = np.where(tie, rounded + np.sign(err), rounded)
+
+        magnitude = np.abs(scaled)
+        small = magnitude < 2.0 ** 53
+        out = np.where(small, rounded / scale, values)
+        suspect = ~np.isfinite(err) | (~small & (np.abs(np.frexp(values)[0]) == 0.5))
+    if suspect.any():
+        idx = np.nonzero(suspect)[0]
+        out[idx] = [round(v, ndigits) for v in values[idx].tolist()]
+    return out
+
+
+def _amortize_block(principal, r, payment, term):
+    """
+    Vectorized version of the calculate_amortization loop for one block of loans.
+    returns: (payment, interest, principal, remaining) arrays of shape (n, max_term)
+    """
+    n = len(principal)
+    max_term = int(term.max()) if n else 0
+    out_payment = np.zeros((n, max_term))
+    out_interest = np.zeros((n, max_term))
+    out_principal = np.zeros((n, max_term))
+    out_remaining = np.zeros((n, max_term))
+
+    # longest terms first: at row i only the prefix of loans with term >= i is still running
+    order = np.argsort(-term, kind="stable")
+    principal, r, payment, term = principal[order], r[order], payment[order], term[order]
+
+    rounded_payment = _round_like_python(payment, 2)
+    balance = principal.copy()
+    for i in range(1, max_term + 1):
+        alive = int(np.searchsorted(-term, -i, side="right"))
+        balance = balance[:alive]
+        rate = r[:alive]
+        interest = _round_like_python(balance * rate, 10)
+        last = term[:alive] == i
+        principal_part = np.where(last, balance, _round_like_python(payment[:alive] - interest, 2))
+        payment_amount = np.where(last, _round_like_python(interest + balance, 2), rounded_payment[:alive])
+        balance = _round_like_python(balance - principal_part, 2)
+
+        rows = order[:alive]
+        out_payment[rows, i - 1] = payment_amount
+        out_interest[rows, i - 1] = _round_like_python(interest, 2)
+        out_principal[rows, i - 1] = principal_part
+        out_remaining[rows, i - 1] = balance
+    return out_payment, out_interest, out_principal, out_remaining
+
+
+def calculate_amortization_batch(principals, annual_rates, terms, first_payment_dates):
+    """
+    principals: sequence of float
+    annual_rates: sequence of percent (e.g., 18.5)
+    terms: sequence of int
+    first_payment_dates: sequence of datetime.date (گرگوری)
+    returns: list of Schedule, schedules[j] == calculate_amortization(principals[j], annual_rates[j],
+             terms[j], first_payment_dates[j]) for every j
+    """
+    principal = np.asarray(principals, dtype=np.float64)
+    annual_rate = np.asarray(annual_rates, dtype=np.float64)
+    term = np.asarray(terms, dtype=np.int64)
+    first_dates = list(first_payment_dates)
+    if not (len(principal) == len(annual_rate) == len(term) == len(first_dates)):
+        raise ValueError("principals, annual_rates, terms and first_payment_dates must have the same length")
+
+    r = annual_rate / 100 / 12  # monthly rate
+    # payment is computed once per loan with Python's own pow() so it stays bit-identical
+    payment = np.array([
+        _rate_and_payment(p, rate, n)[1] if n > 0 else 0.0
+        for p, rate, n in zip(principal.tolist(), annual_rate.tolist(), term.tolist())
+    ])
+
+    # due dates depend only on the first date, so loans sharing one reuse the same list
+    longest = {}
+    for first, n in zip(first_dates, term.tolist()):
+        longest[first] = max(n, longest.get(first, 0))
+    due_ordinals = {
+        first: array("l", (d.toordinal() for d in jalali_monthly_series(first, n)))
+        for first, n in longest.items()
+    }
+
+    schedules = []
+    for start in range(0, len(principal), BATCH_BLOCK_SIZE):
+        block = slice(start, start + BATCH_BLOCK_SIZE)
+        block_term = np.maximum(term[block], 0)
+        pay, interest, principal_part, remaining = _amortize_block(
+            principal[block], r[block], payment[block], block_term)
+
+        for j, n in enumerate(block_term.tolist()):
+            schedule = Schedule()
+            # columns are copied straight from the float64 buffers
+            schedule.payment.frombytes(pay[j, :n].tobytes())
+            schedule.interest.frombytes(interest[j, :n].tobytes())
+            schedule.principal.frombytes(principal_part[j, :n].tobytes())
+            schedule.remaining.frombytes(remaining[j, :n].tobytes())
+            schedule.due_ordinals.extend(due_ordinals.get(first_dates[start + j], ())[:n])
+            schedules.append(schedule)
+    return schedules
@@ -2,8 +2,8 @@
 import logging
 import asyncio
 import datetime
-import jdatetime
-import pytz
+import itertools
+from sqlalchemy import insert
 
 from telegram import (
     Update,
@@ -13,15 +13,23 @@ from telegram import (
     KeyboardButton,
 )
 from telegram.ext import (
-    Application, CommandHandler, ContextTypes, ConversationHandler,
+    Application, BaseUpdateProcessor, CommandHandler, ContextTypes, ConversationHandler,
     MessageHandler, CallbackQueryHandler, filters
 )
 
-from db import init_db, SessionLocal
+from db import init_db, UpdateSession, with_session, db_timings
 from models import User, Loan, Installment
-from logic import calculate_amortization
-from calendar_helper import build_month_keyboard
-from config import BOT_TOKEN, TIMEZONE
+from logic import cached_amortization, installment_at, iter_amortization, schedule_cache
+from progress import record_payment, start_progress
+from reminders import (
+    remind_on_for, remind_at_for, local_today, get_reminder_mode, set_reminder_mode,
+    get_reminder_time, set_reminder_time, MODE_SINGLE, MODE_DIGEST,
+)
+from scheduler import ReminderScheduler
+from workers import Coordinator
+from calendar_helper import get_keyboard, warm_keyboard_cache
+from jalali_table import to_gregorian, to_jalali, format_jalali
+from config import BOT_TOKEN, ADMIN_CHAT_ID, DIGEST_MAX_ITEMS, REMINDER_WORKERS, MAX_CONCURRENT_UPDATES
 
 # backup service (make sure backup_service.py exists and is configured to use loans.db and backup.db)
 import backup_service
@@ -35,24 +43,31 @@ logger = logging.getLogger(__name__)
 # Backup interval in hours (fixed)
 BACKUP_INTERVAL_HOURS = 6  # every 6 hours
 
-# Helpers
-def get_session():
-    return SessionLocal()
+# Installments are inserted in chunks of this size while the schedule is streamed
+INSTALLMENT_INSERT_BATCH = 120
+
+# Static keyboards are immutable in python-telegram-bot v20, so they are built once
+REMINDER_DAYS_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("1 روز قبل", callback_data="rem|1"),
+        InlineKeyboardButton("2 روز قبل", callback_data="rem|2"),
+        InlineKeyboardButton("3 روز قبل", callback_data="rem|3"),
+    ]
+])
 
+# Helpers
 def jalali_to_gregorian_date(jalali_str):
     # jalali_str like "1403-08-25"
     y, m, d = [int(x) for x in jalali_str.split("-")]
-    jdate = jdatetime.date(y, m, d)
-    gdate = jdate.togregorian()
-    return gdate  # datetime.date
+    return to_gregorian(y, m, d)  # datetime.date
 
 def format_currency(n):
     return f"{n:,.2f}"
 
 
-def get_local_today():
-    tz = pytz.timezone(TIMEZONE)
-    return datetime.datetime.now(tz).date()
+def get_local_today(timezone=None):
+    # timezone: the user's (User.timezone); None → config.TIMEZONE
+    return local_today(timezone)
 
 
 def due_range_label(days: int) -> str:
@@ -101,15 +116,189 @@ def due_range_markup():
         [InlineKeyboardButton("🔙 بازگشت", callback_data="menu|home")],
     ])
 
-# Handlers
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id = update.effective_chat.id
-    session = get_session()
+# Database work of the handlers. These are blocking and run on the DB thread pool in
+# the update's session (await db.run(...), see db.with_session); they only flush. A
+# handler that writes calls await db.finish() right after the write, so the commit (and
+# SQLite's write lock) never waits on a Telegram call and nothing is shown or scheduled
+# before it lands. They return plain values so nothing lazy-loads on the event loop.
+def _register_user(session, chat_id, name):
+    if not session.query(User.id).filter_by(chat_id=chat_id).first():
+        session.add(User(chat_id=chat_id, name=name))
+        session.flush()
+
+
+def _create_loan(session, chat_id, data, choice):
+    """
+    Create the loan and its installments in one transaction; returns the fields shown in the confirmation.
+    choice == "yes" marks the installments due before today as paid while the rows are built.
+    """
+    user = session.query(User).filter_by(chat_id=chat_id).first()
+
+    # ساخت وام
+    loan = Loan(
+        user_id=user.id,
+        bank=data['bank'],
+        loan_name=data['bank'],
+        principal=data['principal'],
+        annual_interest_rate=data['rate'],
+        term_months=data['term'],
+        first_payment_date=jalali_to_gregorian_date(data['first_payment_jalali']),
+        reminder_days_before=data['reminder_days']
+    )
+    session.add(loan)
+    session.flush()  # loan.id, without committing
+
+    # ساخت اقساط (جدول به صورت جریانی تولید و در دسته‌های کوچک با executemany درج می‌شود)
+    schedule = iter_amortization(
+        loan.principal,
+        loan.annual_interest_rate,
+        loan.term_months,
+        loan.first_payment_date
+    )
+    # اگر کاربر گفت اقساط قبلی پرداخت شده‌اند، همین‌جا در حافظه علامت می‌خورند
+    # «امروز» در منطقه زمانی خود کاربر، نه سرور
+    paid_before = get_local_today(user.timezone) if choice == "yes" else None
+    paid_at = datetime.datetime.utcnow()
+    paid_count = 0
+    outstanding = 0.0
+
+    while True:
+        chunk = list(itertools.islice(schedule, INSTALLMENT_INSERT_BATCH))
+        if not chunk:
+            break
+        rows = []
+        for row in chunk:
+            is_paid = paid_before is not None and row['due_date'] < paid_before
+            remind_on = remind_on_for(row['due_date'], loan.reminder_days_before)
+            if is_paid:
+                paid_count += 1
+            else:
+                outstanding += row['principal']
+            rows.append({
+                "loan_id": loan.id,
+                "sequence_number": row['installment'],
+                "due_date": row['due_date'],
+                "amount_total": row['payment'],
+                "amount_principal": row['principal'],
+                "amount_interest": row['interest'],
+                "is_paid": is_paid,
+                "paid_amount": row['payment'] if is_paid else None,
+                "paid_at": paid_at if is_paid else None,
+                "remind_on": remind_on,
+                "remind_at": None if is_paid else remind_at_for(remind_on, user.timezone, user.reminder_hour),
+            })
+        session.execute(insert(Installment.__table__), rows)
+
+    # شمارنده‌های پیشرفت وام، در همان تراکنش
+    start_progress(session, loan, paid_count, outstanding)
+    result = {
+        "id": loan.id,
+        "bank": loan.bank,
+        "principal": loan.principal,
+        "rate": loan.annual_interest_rate,
+        "term": loan.term_months,
+        "reminder_days": loan.reminder_days_before,
+    }
+    session.flush()
+    return result
+
+
+def _upcoming_for_chat(session, chat_id, days):
+    """None when the chat is not registered, else [(due_date, loan_id, bank, sequence_number, amount_total)]"""
+    user = session.query(User).filter_by(chat_id=chat_id).first()
+    if not user:
+        return None
+    return [
+        (inst.due_date, inst.loan.id, inst.loan.bank, inst.sequence_number, inst.amount_total)
+        for inst in collect_upcoming_installments(session, user.id, days, user.timezone)
+    ]
+
+
+def _loans_for_chat(session, chat_id):
+    """None when the chat is not registered, else [(loan_id, loan_name, bank)]"""
     user = session.query(User).filter_by(chat_id=chat_id).first()
     if not user:
-        user = User(chat_id=chat_id, name=update.effective_user.first_name or "User")
-        session.add(user)
-        session.commit()
+        return None
+    return session.query(Loan.id, Loan.loan_name, Loan.bank).filter_by(user_id=user.id).all()
+
+
+def _pay_installment(session, inst_id):
+    """
+    Mark an installment paid.
+    returns: None if it does not exist, else dict(already_paid, sequence_number, loan_id, chat_id, completed)
+    """
+    inst = session.query(Installment).filter_by(id=inst_id).first()
+    if not inst:
+        return None
+    if inst.is_paid:
+        return {"already_paid": True}
+    inst.is_paid = True
+    inst.paid_at = datetime.datetime.utcnow()
+    inst.paid_amount = inst.amount_total
+    loan = inst.loan
+    record_payment(session, loan, inst)
+    result = {
+        "already_paid": False,
+        "sequence_number": inst.sequence_number,
+        "loan_id": loan.id,
+        "chat_id": loan.user.chat_id,
+        # no unpaid installment left
+        "completed": loan.next_installment_id is None,
+    }
+    session.flush()
+    return result
+
+
+def _loan_detail(session, loan_id):
+    """None if the loan does not exist, else (loan fields, [(id, sequence_number, amount_total, due_date, is_paid)])"""
+    loan = session.query(Loan).filter_by(id=loan_id).first()
+    if not loan:
+        return None
+    fields = {
+        "id": loan.id,
+        "bank": loan.bank,
+        "principal": loan.principal,
+        "rate": loan.annual_interest_rate,
+        "term": loan.term_months,
+        "paid_count": loan.paid_count or 0,
+        "outstanding_principal": loan.outstanding_principal or 0,
+    }
+    insts = (
+        session.query(Installment.id, Installment.sequence_number, Installment.amount_total,
+                      Installment.due_date, Installment.is_paid)
+        .filter_by(loan_id=loan_id).order_by(Installment.sequence_number).all()
+    )
+    # the schedule balance after each row is not stored; the view is rendered again on
+    # every visit and after every payment, so the loan's schedule comes from the shared cache
+    schedule = cached_amortization(loan.principal, loan.annual_interest_rate, loan.term_months,
+                                   loan.first_payment_date)
+    fields["remaining"] = {inst.id: schedule.remaining[inst.sequence_number - 1] for inst in insts}
+    # the next installment's split and the schedule balance after it
+    fields["next"] = next(
+        (installment_at(loan.principal, loan.annual_interest_rate, loan.term_months,
+                        loan.first_payment_date, inst.sequence_number)
+         for inst in insts if inst.id == loan.next_installment_id),
+        None,
+    )
+    return fields, insts
+
+
+def _delete_loan(session, loan_id):
+    """returns False when the loan does not exist"""
+    loan = session.query(Loan).filter_by(id=loan_id).first()
+    if not loan:
+        return False
+    session.delete(loan)
+    session.flush()
+    return True
+
+
+# Handlers
+@with_session
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE, db: UpdateSession):
+    chat_id = update.effective_chat.id
+    await db.run(_register_user, chat_id, update.effective_user.first_name or "User")
+    await db.finish()
     await update.message.reply_text(
         "سلام! خوش اومدی 👋\nاز دکمه‌های پایین برای افزودن یا مشاهده وام استفاده کن.",
         reply_markup=main_reply_keyboard()
@@ -175,18 +364,11 @@ async def addloan_term(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # kb = build_month_keyboard(now_j.year, now_j.month, prefix="cal")
     # await update.message.reply_text("تاریخ اولین پرداخت را از تقویم زیر انتخاب کن (شمسی):\n(برای لغو، /cancel را بزنید)", reply_markup=kb)
     # return ADD_CALENDAR
-    current_year = jdatetime.date.today().year
-    years = list(range(current_year, current_year - 30, -1))
-
-    keyboard = []
-    for y in years:
-        keyboard.append([InlineKeyboardButton(str(y), callback_data=f"cal_year|{y}")])
-
-    keyboard.append([InlineKeyboardButton("❌ لغو", callback_data="cal_cancel")])
+    current_year = to_jalali(get_local_today())[0]
 
     await update.message.reply_text(
         "📅 سال اولین قسط را انتخاب کن:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=get_keyboard("years", current_year, None, "cal")
     )
     return ADD_CALENDAR
 
@@ -253,20 +435,9 @@ async def calendar_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         year = int(parts[1])
         context.user_data["cal_year"] = year
 
-        keyboard = []
-        for m in range(1, 13):
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"{m}",
-                    callback_data=f"cal_month|{year}|{m}"
-                )
-            ])
-
-        keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data="cal_cancel")])
-
         await query.edit_message_text(
             "📅 ماه اولین قسط را انتخاب کن:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=get_keyboard("months", year, None, "cal")
         )
         return
 
@@ -276,28 +447,9 @@ async def calendar_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         month = int(parts[2])
         context.user_data["cal_month"] = month
 
-        days_in_month = jdatetime.j_days_in_month[month - 1]
-
-        keyboard = []
-        row = []
-        for d in range(1, days_in_month + 1):
-            row.append(
-                InlineKeyboardButton(
-                    str(d),
-                    callback_data=f"cal_day|{year}|{month}|{d}"
-                )
-            )
-            if len(row) == 7:
-                keyboard.append(row)
-                row = []
-        if row:
-            keyboard.append(row)
-
-        keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data="cal_cancel")])
-
         await query.edit_message_text(
             "📅 روز اولین قسط را انتخاب کن:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=get_keyboard("days", year, month, "cal")
         )
         return
 
@@ -310,18 +462,10 @@ async def calendar_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         jalali_date = f"{year}-{month:02d}-{day:02d}"
         context.user_data["first_payment_jalali"] = jalali_date
 
-        markup = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("1 روز قبل", callback_data="rem|1"),
-                InlineKeyboardButton("2 روز قبل", callback_data="rem|2"),
-                InlineKeyboardButton("3 روز قبل", callback_data="rem|3"),
-            ]
-        ])
-
         await query.edit_message_text(
             f"📅 تاریخ اولین قسط انتخاب شد:\n{jalali_date}\n\n"
             "حالا بگو چند روز قبل یادآوری بدم 👇",
-            reply_markup=markup
+            reply_markup=REMINDER_DAYS_MARKUP
         )
         return
 
@@ -351,81 +495,32 @@ async def reminder_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     return ADD_PREV_PAID
 
-async def prevpaid_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@with_session
+async def prevpaid_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, db: UpdateSession):
     query = update.callback_query
     await query.answer()
 
     choice = query.data.split("|")[1]
 
-    session = get_session()
     chat_id = query.message.chat.id
-    user = session.query(User).filter_by(chat_id=chat_id).first()
-
-    # ساخت وام
-    loan = Loan(
-        user_id=user.id,
-        bank=context.user_data['bank'],
-        loan_name=context.user_data['bank'],
-        principal=context.user_data['principal'],
-        annual_interest_rate=context.user_data['rate'],
-        term_months=context.user_data['term'],
-        first_payment_date=jalali_to_gregorian_date(context.user_data['first_payment_jalali']),
-        reminder_days_before=context.user_data['reminder_days']
-    )
-    session.add(loan)
-    session.commit()
-
-    # ساخت اقساط
-    schedule = calculate_amortization(
-        loan.principal,
-        loan.annual_interest_rate,
-        loan.term_months,
-        loan.first_payment_date
-    )
-
-    for row in schedule:
-        inst = Installment(
-            loan_id=loan.id,
-            sequence_number=row['installment'],
-            due_date=row['due_date'],
-            amount_total=row['payment'],
-            amount_principal=row['principal'],
-            amount_interest=row['interest'],
-            is_paid=False
-        )
-        session.add(inst)
-    session.commit()
-
-    # اگر کاربر گفت اقساط قبلی پرداخت شده‌اند
-    if choice == "yes":
-        today = get_local_today()
-        past_insts = session.query(Installment).filter(
-            Installment.loan_id == loan.id,
-            Installment.due_date < today
-        ).all()
-
-        for p in past_insts:
-            p.is_paid = True
-            p.paid_amount = p.amount_total
-            p.paid_at = datetime.datetime.utcnow()
-
-        session.commit()
+    loan = await db.run(_create_loan, chat_id, dict(context.user_data), choice)
+    await db.finish()
+    await reminder_scheduler.reschedule(db, [loan["id"]])
 
     # پیام موفقیت
     text = (
         f"✅ وام با موفقیت ثبت شد!\n\n"
-        f"بانک: {loan.bank}\n"
-        f"اصل: {format_currency(loan.principal)}\n"
-        f"نرخ سالیانه: {loan.annual_interest_rate}%\n"
-        f"مدت: {loan.term_months} ماه\n"
+        f"بانک: {loan['bank']}\n"
+        f"اصل: {format_currency(loan['principal'])}\n"
+        f"نرخ سالیانه: {loan['rate']}%\n"
+        f"مدت: {loan['term']} ماه\n"
         f"تاریخ اولین قسط (شمسی): {context.user_data['first_payment_jalali']}\n"
-        f"یادآوری: {loan.reminder_days_before} روز قبل"
+        f"یادآوری: {loan['reminder_days']} روز قبل"
     )
 
     await query.edit_message_text(text, reply_markup=main_menu_markup())
     await context.bot.send_message(chat_id=chat_id, text="از منوی پایین ادامه بده 👇", reply_markup=main_reply_keyboard())
 
-    session.close()
     return ConversationHandler.END
 
 # Menu callback (after confirmation)
@@ -476,8 +571,8 @@ async def open_due_menu_from_message(update: Update, context: ContextTypes.DEFAU
     )
 
 
-def collect_upcoming_installments(session, user_id: int, days: int):
-    today = get_local_today()
+def collect_upcoming_installments(session, user_id: int, days: int, timezone=None):
+    today = get_local_today(timezone)
     end = today + datetime.timedelta(days=days)
     q = (
         session.query(Installment)
@@ -493,7 +588,8 @@ def collect_upcoming_installments(session, user_id: int, days: int):
     return q.all()
 
 
-async def due_range_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@with_session
+async def due_range_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, db: UpdateSession):
     query = update.callback_query
     await query.answer()
     parts = query.data.split("|")
@@ -503,42 +599,34 @@ async def due_range_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await query.edit_message_text("بازه نامعتبر است. دوباره انتخاب کن.", reply_markup=due_range_markup())
         return
 
-    session = get_session()
-    try:
-        user = session.query(User).filter_by(chat_id=query.message.chat.id).first()
-        if not user:
-            await query.edit_message_text("ابتدا /start را اجرا کن تا ثبت‌نام شوی.", reply_markup=main_menu_markup())
-            return
+    installments = await db.run(_upcoming_for_chat, query.message.chat.id, days)
+    if installments is None:
+        await query.edit_message_text("ابتدا /start را اجرا کن تا ثبت‌نام شوی.", reply_markup=main_menu_markup())
+        return
 
-        installments = collect_upcoming_installments(session, user.id, days)
-        label = due_range_label(days)
-        if not installments:
-            text = f"⏰ در بازه {label} هیچ قسط سررسیدی نداری."
-        else:
-            lines = [f"⏰ سررسیدهای {label}:"]
-            for inst in installments:
-                jd = jdatetime.date.fromgregorian(date=inst.due_date)
-                loan = inst.loan
-                lines.append(
-                    f"• {jd.year}/{jd.month}/{jd.day} — وام #{loan.id} ({loan.bank})\n"
-                    f"  قسط {inst.sequence_number}: {format_currency(inst.amount_total)} تومان"
-                )
-            text = "\n".join(lines)
-
-        await query.edit_message_text(text, reply_markup=due_range_markup())
-    finally:
-        session.close()
+    label = due_range_label(days)
+    if not installments:
+        text = f"⏰ در بازه {label} هیچ قسط سررسیدی نداری."
+    else:
+        lines = [f"⏰ سررسیدهای {label}:"]
+        for due_date, loan_id, bank, sequence_number, amount_total in installments:
+            lines.append(
+                f"• {format_jalali(due_date)} — وام #{loan_id} ({bank})\n"
+                f"  قسط {sequence_number}: {format_currency(amount_total)} تومان"
+            )
+        text = "\n".join(lines)
+
+    await query.edit_message_text(text, reply_markup=due_range_markup())
 #delete_loan
-async def delete_loan_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    session = get_session()
+@with_session
+async def delete_loan_start(update: Update, context: ContextTypes.DEFAULT_TYPE, db: UpdateSession):
     chat_id = update.effective_chat.id
-    user = session.query(User).filter_by(chat_id=chat_id).first()
+    loans = await db.run(_loans_for_chat, chat_id)
 
-    if not user:
+    if loans is None:
         await update.message.reply_text("اول /start را بزن.", reply_markup=main_reply_keyboard())
         return
 
-    loans = session.query(Loan).filter_by(user_id=user.id).all()
     if not loans:
         await update.message.reply_text("هیچ وامی برای حذف وجود ندارد.", reply_markup=main_reply_keyboard())
         return
@@ -556,7 +644,8 @@ async def delete_loan_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # myloans command / handler
-async def myloans_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@with_session
+async def myloans_list(update: Update, context: ContextTypes.DEFAULT_TYPE, db: UpdateSession):
     query = update.callback_query if getattr(update, "callback_query", None) else None
     if query:
         await query.answer()
@@ -564,9 +653,8 @@ async def myloans_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         chat_id = update.effective_chat.id
 
-    session = get_session()
-    user = session.query(User).filter_by(chat_id=chat_id).first()
-    if not user:
+    loans = await db.run(_loans_for_chat, chat_id)
+    if loans is None:
         text = "📋 شما هنوز ثبت‌نام نکردید. اول دستور /start رو بزن."
         if query:
             await query.edit_message_text(text, reply_markup=main_menu_markup())
@@ -574,7 +662,6 @@ async def myloans_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(text, reply_markup=main_menu_markup())
         return
 
-    loans = session.query(Loan).filter_by(user_id=user.id).all()
     if not loans:
         text = "💼 هنوز هیچ وامی ثبت نکردی. از دکمه «➕ افزودن وام جدید» استفاده کن."
         if query:
@@ -601,62 +688,74 @@ async def myloans_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # pay callback (mark installment paid)
-async def pay_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@with_session
+async def pay_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, db: UpdateSession):
     query = update.callback_query
     await query.answer()
     parts = query.data.split("|")
     inst_id = int(parts[1])
-    session = get_session()
-    inst = session.query(Installment).filter_by(id=inst_id).first()
-    if not inst:
+    paid = await db.run(_pay_installment, inst_id)
+    await db.finish()
+    if not paid:
         await query.edit_message.reply_text("قسط پیدا نشد.")
         return
-    if inst.is_paid:
+    if paid["already_paid"]:
         await query.edit_message.reply_text("این قسط قبلاً پرداخت شده است.")
         return
-    inst.is_paid = True
-    inst.paid_at = datetime.datetime.utcnow()
-    inst.paid_amount = inst.amount_total
-    session.commit()
+    reminder_scheduler.discard(inst_id)
 
-    # check if loan completed
-    loan = inst.loan
-    remaining = session.query(Installment).filter_by(loan_id=loan.id, is_paid=False).count()
-    chat_id = loan.user.chat_id
-    if remaining == 0:
+    if parts[-1] == "digest":
+        # keep the digest and the pay buttons of its other installments
+        buttons = [
+            [b for b in row if b.callback_data != query.data]
+            for row in query.message.reply_markup.inline_keyboard
+        ]
+        await query.edit_message_reply_markup(InlineKeyboardMarkup([row for row in buttons if row]))
+
+    # check if loan completed (no unpaid installment left)
+    if paid["completed"]:
         # send congrats
-        await context.bot.send_message(chat_id=chat_id, text=f"🎉 تبریک! همه‌ی اقساط وام #{loan.id} پرداخت شد. ممنون از اطلاع‌رسانی.")
+        await context.bot.send_message(chat_id=paid["chat_id"], text=f"🎉 تبریک! همه‌ی اقساط وام #{paid['loan_id']} پرداخت شد. ممنون از اطلاع‌رسانی.")
+    elif parts[-1] == "digest":
+        await query.message.reply_text(f"✅ قسط {paid['sequence_number']} وام #{paid['loan_id']} پرداخت‌شده علامت خورد.")
     else:
-        await query.edit_message_text(f"قسط {inst.sequence_number} با موفقیت علامت زده شد به‌عنوان پرداخت‌شده.")
+        await query.edit_message_text(f"قسط {paid['sequence_number']} با موفقیت علامت زده شد به‌عنوان پرداخت‌شده.")
 
-async def loan_detail_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@with_session
+async def loan_detail_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, db: UpdateSession):
     query = update.callback_query
     await query.answer()
     parts = query.data.split("|")
     loan_id = int(parts[2])
-    session = get_session()
-    loan = session.query(Loan).filter_by(id=loan_id).first()
-    if not loan:
+    detail = await db.run(_loan_detail, loan_id)
+    if not detail:
         await query.edit_message_text("⚠️ وام پیدا نشد.")
         return
 
-    insts = session.query(Installment).filter_by(loan_id=loan_id).order_by(Installment.sequence_number).all()
+    loan, insts = detail
     text_lines = [
-        f"💼 جزئیات وام #{loan.id}",
-        f"🏦 بانک: {loan.bank}",
-        f"💰 اصل وام: {format_currency(loan.principal)}",
-        f"📈 نرخ بهره: {loan.annual_interest_rate}%",
-        f"📅 مدت: {loan.term_months} ماه",
-        "",
-        "📊 لیست اقساط:"
+        f"💼 جزئیات وام #{loan['id']}",
+        f"🏦 بانک: {loan['bank']}",
+        f"💰 اصل وام: {format_currency(loan['principal'])}",
+        f"📈 نرخ بهره: {loan['rate']}%",
+        f"📅 مدت: {loan['term']} ماه",
+        f"✅ پرداخت‌شده: {loan['paid_count']} از {loan['term']} قسط",
+        f"💳 مانده اصل: {format_currency(loan['outstanding_principal'])}",
     ]
+    nxt = loan["next"]
+    if nxt:
+        text_lines += [
+            f"⏭ قسط بعدی: {nxt['installment']} — {format_jalali(nxt['due_date'])} — "
+            f"اصل {format_currency(nxt['principal'])} + بهره {format_currency(nxt['interest'])}",
+            f"📉 مانده اصل طبق جدول پس از آن: {format_currency(nxt['remaining'])}",
+        ]
+    text_lines += ["", "📊 لیست اقساط:"]
 
     for inst in insts:
-        jd = jdatetime.date.fromgregorian(date=inst.due_date)
         status = "✅ پرداخت‌شده" if inst.is_paid else "❌ در انتظار پرداخت"
         text_lines.append(
             f"قسط {inst.sequence_number}: {format_currency(inst.amount_total)} تومان — "
-            f"تاریخ {jd.year}/{jd.month}/{jd.day} — {status}"  # ← از jd.day استفاده شود
+            f"تاریخ {format_jalali(inst.due_date)} — مانده {format_currency(loan['remaining'][inst.id])} — {status}"
         )
 
     # دکمه‌ها برای پرداخت یا بازگشت
@@ -684,17 +783,17 @@ async def delete_loan_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE
         ])
     )
 
-async def delete_loan_execute(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@with_session
+async def delete_loan_execute(update: Update, context: ContextTypes.DEFAULT_TYPE, db: UpdateSession):
     query = update.callback_query
     await query.answer()
 
     loan_id = context.user_data.get("delete_target_id")
-    session = get_session()
-    loan = session.query(Loan).filter_by(id=loan_id).first()
 
-    if loan:
-        session.delete(loan)
-        session.commit()
+    deleted = await db.run(_delete_loan, loan_id)
+    await db.finish()
+    if deleted:
+        reminder_scheduler.discard_loan(loan_id)
         await query.edit_message_text(
             f"🗑️ وام شماره {loan_id} با موفقیت حذف شد.",
             reply_markup=main_menu_markup()
@@ -702,8 +801,6 @@ async def delete_loan_execute(update: Update, context: ContextTypes.DEFAULT_TYPE
     else:
         await query.edit_message_text("⚠️ وام پیدا نشد.", reply_markup=main_menu_markup())
 
-    session.close()
-
 async def delete_loan_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -725,36 +822,196 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(text, reply_markup=main_menu_markup())
 
 
-# Scheduled job: send reminders daily
-async def daily_reminder_job(context: ContextTypes.DEFAULT_TYPE):
-    session = get_session()
-    today_utc = datetime.datetime.utcnow().date()
-    # iterate loans and installments, and check if any installment's due_date - reminder_days_before == today
-    loans = session.query(Loan).all()
-    for loan in loans:
-        for inst in loan.installments:
-            if inst.is_paid:
-                continue
-            remind_on = inst.due_date - datetime.timedelta(days=loan.reminder_days_before)
-            if remind_on == today_utc:
-                # send reminder
-                chat_id = loan.user.chat_id
-                jd = jdatetime.date.fromgregorian(date=inst.due_date)
-                text = (
-                    f"🔔 یادآوری پرداخت قسط\n"
-                    f"وام #{loan.id} — {loan.bank}\n"
-                    f"قسط {inst.sequence_number} به مبلغ {format_currency(inst.amount_total)} در تاریخ {jd.year}/{jd.month}/{inst.due_date.day} سررسید می‌شود.\n"
-                    f"اگر پرداخت کردی، دکمه 'پرداخت شد' را بزن."
-                )
-                kb = InlineKeyboardMarkup([
-                    [InlineKeyboardButton("پرداخت شد ✅", callback_data=f"pay|{inst.id}")],
-                    [InlineKeyboardButton("مشاهده وام", callback_data=f"loan|detail|{loan.id}")]
-                ])
-                try:
-                    await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=kb)
-                except Exception as e:
-                    logger.error("Error sending reminder: %s", e)
-    session.close()
+async def dbstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # admin only: database time per handler since start
+    if update.effective_chat.id != ADMIN_CHAT_ID:
+        return
+    stats = db_timings.stats()
+    if not stats:
+        await update.message.reply_text("هنوز آماری ثبت نشده.")
+        return
+    lines = ["⏱ زمان دیتابیس به ازای هر هندلر (ms):"]
+    for name, st in stats.items():
+        lines.append(
+            f"{name}: {st['updates']}× — mean {st['mean_ms']:.1f}, max {st['max_ms']:.1f}, total {st['total_ms']:.0f}"
+        )
+    cache = schedule_cache.stats()
+    lines.append(f"schedule cache: {cache['size']}/{cache['capacity']} — hit rate {cache['hit_rate']:.0%}")
+    await update.message.reply_text("\n".join(lines))
+
+
+# Reminder messages
+REMINDER_MODE_LABELS = {
+    MODE_SINGLE: "یک پیام برای هر قسط",
+    MODE_DIGEST: "یک پیام خلاصه در روز",
+}
+
+
+def reminder_mode_markup():
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(label, callback_data=f"remmode|{mode}")]
+        for mode, label in REMINDER_MODE_LABELS.items()
+    ])
+
+
+def single_reminder_message(chat_id, loan_id, bank, inst_id, sequence_number, amount_total, due_date):
+    text = (
+        f"🔔 یادآوری پرداخت قسط\n"
+        f"وام #{loan_id} — {bank}\n"
+        f"قسط {sequence_number} به مبلغ {format_currency(amount_total)} در تاریخ {format_jalali(due_date)} سررسید می‌شود.\n"
+        f"اگر پرداخت کردی، دکمه 'پرداخت شد' را بزن."
+    )
+    kb = InlineKeyboardMarkup([
+        [InlineKeyboardButton("پرداخت شد ✅", callback_data=f"pay|{inst_id}")],
+        [InlineKeyboardButton("مشاهده وام", callback_data=f"loan|detail|{loan_id}")]
+    ])
+    return {"chat_id": chat_id, "text": text, "reply_markup": kb}
+
+
+def digest_reminder_messages(chat_id, rows):
+    """
+    One message for all of a chat's reminders of the day (split every DIGEST_MAX_ITEMS installments).
+    rows: [(loan_id, bank, inst_id, sequence_number, amount_total, due_date)]
+    """
+    messages = []
+    for start in range(0, len(rows), DIGEST_MAX_ITEMS):
+        part = rows[start:start + DIGEST_MAX_ITEMS]
+        lines = [f"🔔 یادآوری {len(part)} قسط:"]
+        buttons = []
+        for loan_id, bank, inst_id, sequence_number, amount_total, due_date in part:
+            lines.append(
+                f"• وام #{loan_id} ({bank}) — قسط {sequence_number}: "
+                f"{format_currency(amount_total)} در {format_jalali(due_date)}"
+            )
+            buttons.append([InlineKeyboardButton(
+                f"پرداخت شد ✅ وام #{loan_id} قسط {sequence_number}", callback_data=f"pay|{inst_id}|digest"
+            )])
+        lines.append("اگر پرداخت کردی، دکمه همان قسط را بزن.")
+        messages.append({"chat_id": chat_id, "text": "\n".join(lines), "reply_markup": InlineKeyboardMarkup(buttons)})
+    return messages
+
+
+def build_reminder_messages(reminders):
+    """
+    reminders: rows of reminders.reminders_by_ids (grouped by chat)
+    returns: (send_message kwargs, [(remind_on, installment_id) ledger keys it covers]) per message
+    """
+    messages = []
+    for chat_id, group in itertools.groupby(reminders, key=lambda r: r[0]):
+        group = list(group)
+        if group[0][-1] == MODE_DIGEST:
+            parts = digest_reminder_messages(chat_id, [r[1:7] for r in group])
+            for i, message in enumerate(parts):
+                chunk = group[i * DIGEST_MAX_ITEMS:(i + 1) * DIGEST_MAX_ITEMS]
+                messages.append((message, [(r[7], r[3]) for r in chunk]))
+        else:
+            messages.extend((single_reminder_message(*r[:7]), [(r[7], r[3])]) for r in group)
+    return messages
+
+
+@with_session
+async def reminder_mode_command(update: Update, context: ContextTypes.DEFAULT_TYPE, db: UpdateSession):
+    mode = await db.run(get_reminder_mode, update.effective_chat.id)
+    if mode is None:
+        await update.message.reply_text("اول /start را بزن.", reply_markup=main_reply_keyboard())
+        return
+    await update.message.reply_text(
+        f"حالت فعلی یادآوری: {REMINDER_MODE_LABELS[mode]}\nحالت دلخواه را انتخاب کن:",
+        reply_markup=reminder_mode_markup()
+    )
+
+
+@with_session
+async def reminder_mode_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, db: UpdateSession):
+    query = update.callback_query
+    await query.answer()
+    mode = query.data.split("|")[1]
+    if mode not in REMINDER_MODE_LABELS:
+        await query.edit_message_text("گزینه نامعتبر است.", reply_markup=reminder_mode_markup())
+        return
+    updated = await db.run(set_reminder_mode, query.message.chat.id, mode)
+    await db.finish()
+    if not updated:
+        await query.edit_message_text("اول /start را بزن.")
+        return
+    await query.edit_message_text(f"✅ حالت یادآوری: {REMINDER_MODE_LABELS[mode]}")
+
+
+REMIND_TIME_USAGE = (
+    "برای تغییر: /remindtime <ساعت 0 تا 23> [منطقه زمانی]\n"
+    "مثال: /remindtime 8 Asia/Tehran"
+)
+
+
+@with_session
+async def remind_time_command(update: Update, context: ContextTypes.DEFAULT_TYPE, db: UpdateSession):
+    # /remindtime → show; /remindtime 8 [Asia/Tehran] → change hour (and timezone)
+    chat_id = update.effective_chat.id
+    args = context.args or []
+    if args:
+        try:
+            hour = int(args[0])
+            timezone = args[1] if len(args) > 1 else None
+            loan_ids = await db.run(set_reminder_time, chat_id, hour, timezone)
+            await db.finish()
+        except ValueError:
+            await update.message.reply_text("ساعت یا منطقه زمانی نامعتبر است.\n" + REMIND_TIME_USAGE)
+            return
+        if loan_ids is None:
+            await update.message.reply_text("اول /start را بزن.", reply_markup=main_reply_keyboard())
+            return
+        await reminder_scheduler.reschedule(db, loan_ids)
+
+    current = await db.run(get_reminder_time, chat_id)
+    if current is None:
+        await update.message.reply_text("اول /start را بزن.", reply_markup=main_reply_keyboard())
+        return
+    timezone, hour = current
+    await update.message.reply_text(
+        f"⏰ یادآوری‌ها ساعت {hour:02d}:00 به وقت {timezone} ارسال می‌شوند.\n" + REMIND_TIME_USAGE
+    )
+
+
+# Reminders fire at their own times from the in-memory scheduler (scheduler.py), or
+# with REMINDER_WORKERS > 0 from sharded worker processes (workers.py); then this
+# scheduler is never loaded and the handlers' reschedule/discard calls are no-ops.
+reminder_scheduler = ReminderScheduler(build_reminder_messages)
+
+
+async def _start_reminder_scheduler(app: Application):
+    if REMINDER_WORKERS:
+        coordinator = Coordinator(REMINDER_WORKERS, backup_hours=BACKUP_INTERVAL_HOURS)
+        coordinator.start()
+        app.bot_data["coordinator"] = coordinator
+        app.bot_data["reminder_task"] = asyncio.create_task(coordinator.run())
+    else:
+        app.bot_data["reminder_task"] = asyncio.create_task(reminder_scheduler.run(app.bot))
+
+
+async def _stop_reminder_scheduler(app: Application):
+    task = app.bot_data.pop("reminder_task", None)
+    if task:
+        task.cancel()
+    coordinator = app.bot_data.pop("coordinator", None)
+    if coordinator:
+        coordinator.stop()
+
+
+async def workerstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # admin only: per-shard totals of the reminder workers
+    if update.effective_chat.id != ADMIN_CHAT_ID:
+        return
+    coordinator = context.application.bot_data.get("coordinator")
+    if not coordinator:
+        await update.message.reply_text("حالت worker فعال نیست (REMINDER_WORKERS = 0).")
+        return
+    lines = ["👷 آمار workerها:"]
+    for name, st in coordinator.summary().items():
+        lines.append(
+            f"{name}: sent {st.get('sent', 0)}, failed {st.get('failed', 0)}, "
+            f"retries {st.get('retries', 0)}, 429 {st.get('rate_limited', 0)}, starts {st.get('starts', '-')}"
+        )
+    await update.message.reply_text("\n".join(lines))
 
 # -----------------------
 # Backup runner (run sync backup in executor)
@@ -762,16 +1019,58 @@ async def daily_reminder_job(context: ContextTypes.DEFAULT_TYPE):
 async def _run_backup_in_executor():
     loop = asyncio.get_running_loop()
     try:
-        await loop.run_in_executor(None, backup_service.run_backup)
+        await loop.run_in_executor(None, backup_service.run_scheduled_backup)
     except Exception:
         logger.exception("Backup job raised exception")
 
 # -----------------------
 # Setup application
 # -----------------------
-def main():
-    init_db()
-    app = Application.builder().token(BOT_TOKEN).build()
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Updates of different chats are processed concurrently (up to max_concurrent_updates), so
+    one slow update no longer holds up every other chat; the updates of one chat still run
+    one after another and in order, as the /addloan ConversationHandler expects.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._chats = {}  # chat id → [asyncio.Lock, updates holding or waiting for it]
+
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, "effective_chat", None)
+        key = chat.id if chat else None
+        entry = self._chats.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def build_application(token=BOT_TOKEN, request=None):
+    """
+    The bot with every handler registered (jobs are added by main()).
+    request: telegram.request.BaseRequest for the Bot API calls (None → the default HTTP client)
+    """
+    builder = (
+        Application.builder().token(token)
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_init(_start_reminder_scheduler)
+        .post_stop(_stop_reminder_scheduler)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    app = builder.build()
 
     conv = ConversationHandler(
         entry_points=[
@@ -800,6 +1099,11 @@ def main():
     app.add_handler(CommandHandler("start", start))
     app.add_handler(conv)
     app.add_handler(CommandHandler("menu", show_main_menu))
+    app.add_handler(CommandHandler("dbstats", dbstats))
+    app.add_handler(CommandHandler("workerstats", workerstats))
+    app.add_handler(CommandHandler("reminders", reminder_mode_command))
+    app.add_handler(CallbackQueryHandler(reminder_mode_callback, pattern=r"^remmode\|"))
+    app.add_handler(CommandHandler("remindtime", remind_time_command))
     app.add_handler(MessageHandler(
         filters.TEXT & ~filters.COMMAND & filters.Regex(r"^💼 وام‌های من$"),
         myloans_list
@@ -827,12 +1131,20 @@ def main():
     app.add_handler(CommandHandler("myloans", myloans_list))
     app.add_handler(CallbackQueryHandler(prevpaid_callback, pattern=r"^prevpaid\|"))
 
-    # schedule daily job: run reminders (existing)
-    app.job_queue.run_repeating(daily_reminder_job, interval=24*60*60, first=10)
+    return app
+
+
+def main():
+    init_db()
+    # prebuild the first-payment pickers so calendar taps do no keyboard work
+    warm_keyboard_cache(to_jalali(get_local_today())[0], prefix="cal")
+    app = build_application()
 
     # schedule backup job (fixed interval)
     # run the synchronous backup in a thread to avoid blocking the event loop
-    app.job_queue.run_repeating(lambda ctx: asyncio.create_task(_run_backup_in_executor()), interval=int(BACKUP_INTERVAL_HOURS*3600), first=10)
+    # (in worker mode the coordinator runs it in a process of its own)
+    if not REMINDER_WORKERS:
+        app.job_queue.run_repeating(lambda ctx: asyncio.create_task(_run_backup_in_executor()), interval=int(BACKUP_INTERVAL_HOURS*3600), first=10)
 
     logger.info("Bot started")
     app.run_polling()
@@ -0,0 +1,155 @@
+# migrations.py
+# Versioned, in-place schema migrations for existing SQLite databases.
+# The schema version lives in PRAGMA user_version. create_all() only creates
+# missing tables, so every change to an existing table (new column, new index)
+# is added here as the next numbered step. Steps are idempotent, so a step
+# that was interrupted half-way can simply run again.
+import logging
+
+from sqlalchemy import inspect
+
+logger = logging.getLogger(__name__)
+
+
+def _has_column(conn, table, column):
+    rows = conn.exec_driver_sql(f"PRAGMA table_info({table})").fetchall()
+    return any(r[1] == column for r in rows)
+
+
+def add_column(conn, table, column, ddl):
+    """ALTER TABLE ... ADD COLUMN unless the column is already there."""
+    if not _has_column(conn, table, column):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def create_index(conn, name, table, columns):
+    conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+
+
+def drop_index(conn, name):
+    conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+
+# columns every UPDATE through the models writes (onupdate=utcnow, added in step 6).
+# Steps that update rows run with today's models, so migrate() adds these before the first
+# pending step instead of editing those steps.
+UPDATE_COLUMNS = [
+    ("users", "updated_at", "DATETIME"),
+    ("loans", "updated_at", "DATETIME"),
+    ("installments", "updated_at", "DATETIME"),
+]
+
+
+def _m001_composite_indexes(conn):
+    create_index(conn, "ix_loans_user_status", "loans", ["user_id", "status"])
+    create_index(conn, "ix_installments_loan_paid_due", "installments", ["loan_id", "is_paid", "due_date"])
+    create_index(conn, "ix_installments_due_paid", "installments", ["due_date", "is_paid"])
+
+
+def _m002_loan_progress(conn):
+    from progress import repair_progress
+
+    add_column(conn, "loans", "paid_count", "INTEGER DEFAULT 0")
+    add_column(conn, "loans", "outstanding_principal", "FLOAT")
+    add_column(conn, "loans", "next_due_date", "DATE")
+    add_column(conn, "loans", "next_installment_id", "INTEGER")
+    repair_progress(conn)
+
+
+def _m003_remind_on(conn):
+    from reminders import backfill_remind_on
+
+    add_column(conn, "installments", "remind_on", "DATE")
+    create_index(conn, "ix_installments_remind_paid", "installments", ["remind_on", "is_paid"])
+    backfill_remind_on(conn)
+
+
+def _m004_reminder_mode(conn):
+    add_column(conn, "users", "reminder_mode", "VARCHAR")
+
+
+def _m005_remind_at(conn):
+    from reminders import refresh_remind_at
+
+    add_column(conn, "users", "reminder_hour", "INTEGER")
+    add_column(conn, "installments", "remind_at", "DATETIME")
+    create_index(conn, "ix_installments_remind_at_paid", "installments", ["remind_at", "is_paid"])
+    refresh_remind_at(conn)
+
+
+def _m006_change_times(conn):
+    import datetime
+    from sqlalchemy import update
+    from models import User, Loan, Installment
+
+    for table, column, ddl in UPDATE_COLUMNS:
+        add_column(conn, table, column, ddl)
+    now = datetime.datetime.utcnow()
+    for model in (User, Loan, Installment):
+        table = model.__table__
+        conn.execute(update(table).where(table.c.updated_at.is_(None)).values(updated_at=now))
+    create_index(conn, "ix_users_updated_at", "users", ["updated_at"])
+    create_index(conn, "ix_loans_updated_at", "loans", ["updated_at"])
+    create_index(conn, "ix_installments_updated_at", "installments", ["updated_at"])
+
+
+def _m007_drop_remind_on_index(conn):
+    # the scheduler reads pending reminders by remind_at (ix_installments_remind_at_paid);
+    # nothing filters on remind_on any more, so the index only slowed down every write
+    drop_index(conn, "ix_installments_remind_paid")
+
+
+# (version, description, step) — append only, never renumber
+MIGRATIONS = [
+    (1, "composite indexes on loans and installments", _m001_composite_indexes),
+    (2, "denormalized loan progress counters", _m002_loan_progress),
+    (3, "indexed installments.remind_on for the reminder job", _m003_remind_on),
+    (4, "per-user reminder mode (single / digest)", _m004_reminder_mode),
+    (5, "per-user reminder hour and indexed installments.remind_at", _m005_remind_at),
+    (6, "indexed updated_at on users, loans and installments for the incremental backup", _m006_change_times),
+    (7, "drop the unused installments (remind_on, is_paid) index", _m007_drop_remind_on_index),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def _set_version(conn, version):
+    conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def is_fresh(engine):
+    """True when the database has no tables yet (create_all will build the latest schema)."""
+    return not inspect(engine).has_table("loans")
+
+
+def migrate(engine, fresh=False):
+    """
+    Apply every pending migration to the database behind engine.
+    fresh: the schema was just created from the models, so only stamp the latest version.
+    returns: list of applied versions
+    """
+    with engine.begin() as conn:
+        if fresh:
+            _set_version(conn, LATEST_VERSION)
+            return []
+        version = get_version(conn)
+
+    if version < LATEST_VERSION:
+        with engine.begin() as conn:
+            for table, column, ddl in UPDATE_COLUMNS:
+                add_column(conn, table, column, ddl)
+
+    applied = []
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        logger.info("Applying migration %d: %s", number, description)
+        with engine.begin() as conn:
+            step(conn)
+            _set_version(conn, number)
+        applied.append(number)
+    return applied
@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    Column, Integer, String, Float, Date, Boolean, ForeignKey, DateTime
+    Column, Integer, String, Float, Date, Boolean, ForeignKey, DateTime, Index, event, insert
 )
 from sqlalchemy.orm import relationship, declarative_base
 import enum
@@ -16,9 +16,20 @@ class User(Base):
     chat_id = Column(Integer, unique=True, index=True)
     name = Column(String)
     timezone = Column(String, default="Europe/Amsterdam")
+    # "single" | "digest" | None (→ config.REMINDER_MODE_DEFAULT), see reminders.py
+    reminder_mode = Column(String, nullable=True)
+    # local hour reminders go out at, 0-23 | None (→ config.REMINDER_SEND_HOUR)
+    reminder_hour = Column(Integer, nullable=True)
+    # change time for the incremental backup (backup_service.py)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     loans = relationship("Loan", back_populates="user")
 
+    __table_args__ = (
+        # rows changed since the last backup
+        Index("ix_users_updated_at", "updated_at"),
+    )
+
 
 class Loan(Base):
     __tablename__ = "loans"
@@ -38,11 +49,27 @@ class Loan(Base):
     status = Column(String, default="active")  
     # active | completed | deleted
 
+    # پیشرفت وام (غیرنرمال‌شده؛ در progress.py همراه هر پرداخت به‌روز می‌شود)
+    paid_count = Column(Integer, default=0)
+    outstanding_principal = Column(Float)
+    next_due_date = Column(Date, nullable=True)
+    next_installment_id = Column(Integer, nullable=True)
+
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     user = relationship("User", back_populates="loans")
-    installments = relationship("Installment", back_populates="loan", cascade="all, delete-orphan")
+    installments = relationship(
+        "Installment", back_populates="loan", cascade="all, delete-orphan",
+        order_by="Installment.sequence_number",
+    )
+
+    __table_args__ = (
+        # loans of one user (optionally by status): myloans, delete menu, reminders
+        Index("ix_loans_user_status", "user_id", "status"),
+        # rows changed since the last backup
+        Index("ix_loans_updated_at", "updated_at"),
+    )
 
 
 class Installment(Base):
@@ -57,5 +84,56 @@ class Installment(Base):
     is_paid = Column(Boolean, default=False)
     paid_at = Column(DateTime, nullable=True)
     paid_amount = Column(Float, nullable=True)
+    # روز ارسال یادآوری = due_date - loan.reminder_days_before (reminders.py نگهش می‌دارد)
+    remind_on = Column(Date, nullable=True)
+    # لحظه ارسال به UTC: remind_on در ساعت دلخواه و منطقه زمانی کاربر (reminders.py، برای اقساط پرداخت‌نشده)
+    remind_at = Column(DateTime, nullable=True)
+    # زمان آخرین تغییر، برای بکاپ افزایشی (backup_service.py)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     loan = relationship("Loan", back_populates="installments")
+
+    __table_args__ = (
+        # installments of a loan, unpaid first, in due order: detail view, remaining count
+        Index("ix_installments_loan_paid_due", "loan_id", "is_paid", "due_date"),
+        # unpaid installments due in a date range: upcoming list, reminder job
+        Index("ix_installments_due_paid", "due_date", "is_paid"),
+        # unpaid installments whose reminder falls in an hour range: reminder scheduler
+        Index("ix_installments_remind_at_paid", "remind_at", "is_paid"),
+        # rows changed since the last backup
+        Index("ix_installments_updated_at", "updated_at"),
+    )
+
+
+class SentReminder(Base):
+    """Ledger of delivered reminders; the reminder job skips keys that are already here."""
+    __tablename__ = "sent_reminders"
+    # remind_on first: range lookups by day, and pruning of old days
+    remind_on = Column(Date, primary_key=True)
+    installment_id = Column(Integer, primary_key=True)
+    sent_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class JobState(Base):
+    """Small persisted key/value state of background jobs (watermarks), see job_state.py"""
+    __tablename__ = "job_state"
+    name = Column(String, primary_key=True)
+    value = Column(String)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
+class Tombstone(Base):
+    """Deleted rows, so the incremental backup finds deletions without comparing every row"""
+    __tablename__ = "tombstones"
+    table_name = Column(String, primary_key=True)
+    row_id = Column(Integer, primary_key=True)
+    deleted_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+
+@event.listens_for(Loan, "after_delete")
+def _loan_tombstone(mapper, connection, target):
+    # installments go with their loan (cascade), one tombstone covers them
+    connection.execute(
+        insert(Tombstone.__table__).prefix_with("OR REPLACE"),
+        {"table_name": Loan.__tablename__, "row_id": target.id, "deleted_at": datetime.datetime.utcnow()},
+    )
@@ -0,0 +1,104 @@
+# progress.py
+# Denormalized per-loan progress: Loan.paid_count, outstanding_principal,
+# next_due_date and next_installment_id. They are kept up to date by the
+# creation (including prepaid marking) and payment paths, in the same transaction
+# as the installment change, so showing progress or deciding that a loan is complete
+# never has to count or scan installments.
+#
+#   python progress.py     # recompute the counters of every loan from its installments
+import datetime
+
+from sqlalchemy import select, update, func, and_, case
+
+from models import Loan, Installment
+
+
+def _next_unpaid(session, loan_id):
+    # served by ix_installments_loan_paid_due
+    return (
+        session.query(Installment.id, Installment.due_date)
+        .filter(Installment.loan_id == loan_id, Installment.is_paid.is_(False))
+        .order_by(Installment.due_date.asc(), Installment.sequence_number.asc())
+        .first()
+    )
+
+
+def _set_next(session, loan):
+    nxt = _next_unpaid(session, loan.id)
+    loan.next_installment_id = nxt.id if nxt else None
+    loan.next_due_date = nxt.due_date if nxt else None
+    if loan.status != "deleted":
+        loan.status = "active" if nxt else "completed"
+
+
+def record_payment(session, loan, inst):
+    """
+    Update loan's counters after inst (one of its installments) was marked paid.
+    Call before committing the payment so both land in one transaction.
+    """
+    loan.paid_count = (loan.paid_count or 0) + 1
+    loan.outstanding_principal = round((loan.outstanding_principal or 0) - (inst.amount_principal or 0), 2)
+    if loan.next_installment_id in (None, inst.id):
+        session.flush()
+        _set_next(session, loan)
+
+
+def start_progress(session, loan, paid_count, outstanding_principal):
+    """
+    Set the counters of a loan whose installments were just inserted, from the totals the
+    caller computed while building the rows; only the next unpaid installment is looked up.
+    """
+    session.flush()
+    loan.paid_count = paid_count
+    loan.outstanding_principal = round(outstanding_principal, 2)
+    _set_next(session, loan)
+
+
+def repair_progress(bind, loan_ids=None):
+    """
+    Recompute the counters of every loan (or only loan_ids) in one UPDATE statement.
+    Loans with status "deleted" (kept in backup.db) get their counters but keep their status.
+    bind: Session or Connection
+    """
+    inst = Installment.__table__
+    loans = Loan.__table__
+    unpaid = and_(inst.c.loan_id == loans.c.id, inst.c.is_paid.is_(False))
+    next_unpaid = (
+        select(inst.c.id, inst.c.due_date)
+        .where(unpaid)
+        .order_by(inst.c.due_date.asc(), inst.c.sequence_number.asc())
+        .limit(1)
+    )
+    stmt = update(loans).values(
+        paid_count=select(func.count(inst.c.id))
+        .where(inst.c.loan_id == loans.c.id, inst.c.is_paid.is_(True))
+        .scalar_subquery(),
+        outstanding_principal=select(func.round(func.coalesce(func.sum(inst.c.amount_principal), 0), 2))
+        .where(unpaid)
+        .scalar_subquery(),
+        next_installment_id=next_unpaid.with_only_columns(inst.c.id).scalar_subquery(),
+        next_due_date=next_unpaid.with_only_columns(inst.c.due_date).scalar_subquery(),
+        status=case(
+            (loans.c.status == "deleted", loans.c.status),
+            (next_unpaid.exists(), "active"),
+            else_="completed",
+        ),
+        updated_at=datetime.datetime.utcnow(),
+    )
+    if loan_ids is not None:
+        stmt = stmt.where(loans.c.id.in_(list(loan_ids)))
+    result = bind.execute(stmt)
+    return result.rowcount
+
+
+if __name__ == "__main__":
+    from db import SessionLocal, init_db
+
+    init_db()
+    session = SessionLocal()
+    try:
+        count = repair_progress(session)
+        session.commit()
+        print(f"recomputed progress of {count} loans")
+    finally:
+        session.close()
@@ -0,0 +1,269 @@
+# reminders.py
+# Which installments to remind about, and when.
+# Every installment stores remind_on = due_date - loan.reminder_days_before, a day in
+# the user's own timezone, set when the loan is created (backfill_remind_on recomputes it).
+# Unpaid installments also store remind_at: that day at the user's preferred hour
+# (reminder_hour, default config.REMINDER_SEND_HOUR) converted to UTC, so reminders
+# spread over the UTC day. The in-memory scheduler (scheduler.py) loads them one hourly
+# bucket at a time with scheduled_reminders() through ix_installments_remind_at_paid, and
+# re-reads what it fires with reminders_by_ids(), so a payment made meanwhile is honoured.
+# Users choose between one message per installment (single) and one digest per day
+# (digest); None means config.REMINDER_MODE_DEFAULT.
+# Delivered reminders are recorded in sent_reminders, keyed by (remind_on,
+# installment_id), and the last processed day is kept in job_state. Every load looks
+# at [watermark, today] minus the ledger, so a restart never re-sends and days the bot
+# was down are caught up (at most REMINDER_CATCHUP_DAYS back).
+#
+#   python reminders.py     # recompute remind_on and remind_at for every installment
+import datetime
+
+import pytz
+from sqlalchemy import select, update, delete, insert, func, and_, bindparam
+
+from config import REMINDER_MODE_DEFAULT, REMINDER_CATCHUP_DAYS, REMINDER_SEND_HOUR, TIMEZONE
+from job_state import get_date, set_date
+from models import User, Loan, Installment, SentReminder
+
+WATERMARK = "reminders.last_day"
+
+MODE_SINGLE = "single"
+MODE_DIGEST = "digest"
+REMINDER_MODES = (MODE_SINGLE, MODE_DIGEST)
+
+
+def effective_mode(mode):
+    """a user's reminder_mode with the default applied"""
+    return mode if mode in REMINDER_MODES else REMINDER_MODE_DEFAULT
+
+
+def set_reminder_mode(session, chat_id, mode):
+    """returns False when the chat is not registered"""
+    if mode not in REMINDER_MODES:
+        raise ValueError(f"unknown reminder mode: {mode!r}")
+    updated = session.query(User).filter_by(chat_id=chat_id).update({User.reminder_mode: mode})
+    return bool(updated)
+
+
+def get_reminder_mode(session, chat_id):
+    """None when the chat is not registered"""
+    row = session.query(User.reminder_mode).filter_by(chat_id=chat_id).first()
+    return effective_mode(row.reminder_mode) if row else None
+
+
+def get_timezone(name):
+    """pytz timezone of a user; config.TIMEZONE when unset or unknown"""
+    try:
+        return pytz.timezone(name or TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        return pytz.timezone(TIMEZONE)
+
+
+def local_today(timezone=None):
+    """today in the user's timezone (name, None → config.TIMEZONE)"""
+    return datetime.datetime.now(get_timezone(timezone)).date()
+
+
+def remind_on_for(due_date, days_before):
+    """day the reminder for an installment due on due_date is sent"""
+    return due_date - datetime.timedelta(days=days_before or 0)
+
+
+def remind_at_for(remind_on, timezone=None, hour=None):
+    """
+    UTC moment (naive datetime, as stored) of a reminder: remind_on at the user's hour in
+    the user's timezone; DST and half-hour offsets included.
+    timezone: str | None, hour: int | None (→ config.REMINDER_SEND_HOUR)
+    """
+    hour = REMINDER_SEND_HOUR if hour is None else hour
+    local = get_timezone(timezone).localize(datetime.datetime.combine(remind_on, datetime.time(hour)))
+    return local.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def get_reminder_time(session, chat_id):
+    """(timezone name, hour) with the defaults applied; None when the chat is not registered"""
+    row = session.query(User.timezone, User.reminder_hour).filter_by(chat_id=chat_id).first()
+    if not row:
+        return None
+    return get_timezone(row.timezone).zone, REMINDER_SEND_HOUR if row.reminder_hour is None else row.reminder_hour
+
+
+def set_reminder_time(session, chat_id, hour=None, timezone=None):
+    """
+    Change a user's reminder hour and/or timezone (None: keep) and move remind_at of their
+    pending installments; the caller commits.
+    returns: ids of the user's loans, None when the chat is not registered
+    raises: ValueError for an hour outside 0-23 or an unknown timezone
+    """
+    if hour is not None and not 0 <= hour <= 23:
+        raise ValueError(f"reminder hour out of range: {hour!r}")
+    if timezone is not None and timezone not in pytz.all_timezones_set:
+        raise ValueError(f"unknown timezone: {timezone!r}")
+    user = session.query(User).filter_by(chat_id=chat_id).first()
+    if not user:
+        return None
+    if hour is not None:
+        user.reminder_hour = hour
+    if timezone is not None:
+        user.timezone = timezone
+    session.flush()
+    refresh_remind_at(session, user_ids=[user.id])
+    return [row.id for row in session.query(Loan.id).filter_by(user_id=user.id)]
+
+
+def _pending(query):
+    """restrict a query over Installment to unpaid installments missing from the ledger"""
+    return (
+        query.outerjoin(SentReminder, and_(SentReminder.remind_on == Installment.remind_on,
+                                           SentReminder.installment_id == Installment.id))
+        .filter(Installment.is_paid.is_(False), SentReminder.installment_id.is_(None))
+    )
+
+
+def _reminder_rows(session, *criteria):
+    rows = (
+        _pending(
+            session.query(User.chat_id, Loan.id, Loan.bank, Installment.id, Installment.sequence_number,
+                          Installment.amount_total, Installment.due_date, Installment.remind_on,
+                          User.reminder_mode)
+            .select_from(Installment)
+            .join(Loan, Installment.loan_id == Loan.id)
+            .join(User, Loan.user_id == User.id)
+        )
+        .filter(*criteria)
+        .order_by(User.chat_id, Installment.due_date, Installment.sequence_number)
+        .all()
+    )
+    return [(*row[:-1], effective_mode(row.reminder_mode)) for row in rows]
+
+
+def reminders_by_ids(session, inst_ids):
+    """
+    The given installments, if still unpaid and not in the sent_reminders ledger yet.
+    returns: [(chat_id, loan_id, bank, inst_id, sequence_number, amount_total, due_date, remind_on,
+    reminder_mode)], grouped by chat_id; reminder_mode has the default applied
+    """
+    return _reminder_rows(session, Installment.id.in_(list(inst_ids)))
+
+
+def shard_of(chat_id, shards):
+    """shard (0..shards-1) that owns a chat's reminders in worker mode (workers.py)"""
+    return chat_id % shards
+
+
+def scheduled_reminders(session, start, end, loan_ids=None, shard=None):
+    """
+    What the in-memory scheduler keeps: pending reminders in the hourly buckets
+    start <= remind_at < end (naive UTC datetimes), optionally of some loans only.
+    shard: (index, shards) → only chats with shard_of(chat_id, shards) == index
+    returns: [(inst_id, loan_id, chat_id, remind_at)]
+    """
+    query = _pending(
+        session.query(Installment.id, Installment.loan_id, User.chat_id, Installment.remind_at)
+        .select_from(Installment)
+        .join(Loan, Installment.loan_id == Loan.id)
+        .join(User, Loan.user_id == User.id)
+    ).filter(Installment.remind_at >= start, Installment.remind_at < end)
+    if loan_ids is not None:
+        query = query.filter(Installment.loan_id.in_(list(loan_ids)))
+    if shard is not None:
+        index, shards = shard
+        # SQLite's % keeps the sign of negative (group) chat ids; Python's does not
+        query = query.filter((User.chat_id % shards + shards) % shards == index)
+    return [tuple(row) for row in query.all()]
+
+
+def reminder_window(session, today, watermark=WATERMARK):
+    """
+    Days the reminder job covers: from the last processed day (it may have been cut short)
+    to today, at most REMINDER_CATCHUP_DAYS back; just today on the first run.
+    watermark: job_state name (one per shard in worker mode)
+    """
+    last = get_date(session, watermark)
+    earliest = today - datetime.timedelta(days=REMINDER_CATCHUP_DAYS)
+    return (max(last, earliest) if last else today), today
+
+
+def record_sent(session, keys, today, watermark=WATERMARK):
+    """
+    Add delivered (remind_on, installment_id) keys to the ledger in one executemany, move the
+    watermark to today and drop ledger days that can no longer be looked at; the caller commits.
+    """
+    if keys:
+        session.execute(
+            insert(SentReminder.__table__).prefix_with("OR IGNORE"),
+            [{"remind_on": remind_on, "installment_id": inst_id, "sent_at": datetime.datetime.utcnow()}
+             for remind_on, inst_id in keys],
+        )
+    set_date(session, watermark, today)
+    # remind_on is a local day and may lie one day before the UTC day its bucket is in
+    session.execute(delete(SentReminder.__table__).where(
+        SentReminder.remind_on < today - datetime.timedelta(days=REMINDER_CATCHUP_DAYS + 1)))
+
+
+def backfill_remind_on(bind, loan_ids=None):
+    """
+    Recompute remind_on from due_date and the loan's reminder_days_before in one UPDATE.
+    bind: Session or Connection
+    """
+    inst = Installment.__table__
+    loans = Loan.__table__
+    days = (
+        select(func.coalesce(loans.c.reminder_days_before, 0))
+        .where(loans.c.id == inst.c.loan_id)
+        .scalar_subquery()
+    )
+    # SQLite keeps dates as 'YYYY-MM-DD' text, which date() reads and writes
+    stmt = update(inst).values(remind_on=func.date(inst.c.due_date, func.printf("-%d days", days)))
+    if loan_ids is not None:
+        stmt = stmt.where(inst.c.loan_id.in_(list(loan_ids)))
+    return bind.execute(stmt).rowcount
+
+
+# remind_at updates per executemany
+REMIND_AT_BATCH = 1000
+
+
+def refresh_remind_at(bind, user_ids=None, loan_ids=None):
+    """
+    Recompute remind_at of unpaid installments from remind_on and the owner's timezone and
+    hour (the conversion needs pytz, so it is done here and written back in executemany
+    batches); paid installments get NULL.
+    bind: Session or Connection
+    returns: number of installments updated
+    """
+    inst = Installment.__table__
+    loans = Loan.__table__
+    users = User.__table__
+    query = (
+        select(inst.c.id, inst.c.remind_on, users.c.timezone, users.c.reminder_hour)
+        .select_from(inst.join(loans, inst.c.loan_id == loans.c.id).join(users, loans.c.user_id == users.c.id))
+        .where(inst.c.is_paid.is_(False), inst.c.remind_on.isnot(None))
+    )
+    if user_ids is not None:
+        query = query.where(loans.c.user_id.in_(list(user_ids)))
+    if loan_ids is not None:
+        query = query.where(inst.c.loan_id.in_(list(loan_ids)))
+    params = [
+        {"b_id": row.id, "b_at": remind_at_for(row.remind_on, row.timezone, row.reminder_hour)}
+        for row in bind.execute(query)
+    ]
+    if user_ids is None and loan_ids is None:
+        bind.execute(update(inst).where(inst.c.is_paid.is_(True)).values(remind_at=None))
+    stmt = update(inst).where(inst.c.id == bindparam("b_id")).values(remind_at=bindparam("b_at"))
+    for start in range(0, len(params), REMIND_AT_BATCH):
+        bind.execute(stmt, params[start:start + REMIND_AT_BATCH])
+    return len(params)
+
+
+if __name__ == "__main__":
+    from db import SessionLocal, init_db
+
+    init_db()
+    session = SessionLocal()
+    try:
+        count = backfill_remind_on(session)
+        pending = refresh_remind_at(session)
+        session.commit()
+        print(f"recomputed remind_on of {count} installments, remind_at of {pending} unpaid ones")
+    finally:
+        session.close()
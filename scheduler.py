@@ -0,0 +1,247 @@
+# scheduler.py
+# In-process reminder scheduler.
+# At startup the pending reminders of the catch-up window and the next
+# REMINDER_HORIZON_DAYS days are loaded into a heap, each with its own fire time.
+# Reminders sit in hourly UTC buckets (installments.remind_at, the user's local hour,
+# see reminders.py), so sends spread over the day with the users' hours and
+# timezones. Loan creation, payment, deletion and a changed reminder time update the
+# heap incrementally, and every hour the horizon is extended by one indexed range
+# query for the new bucket only. Each fire time
+# re-reads just its installments by id (skipping anything paid or already in the
+# ledger meanwhile), sends them through delivery.py and records them in
+# sent_reminders, so a restart never repeats a reminder.
+# In worker mode (workers.py) every process runs one scheduler for its shard of the
+# chats and, since it does not see the bot's updates, reloads its buckets every
+# reload_seconds.
+import asyncio
+import datetime
+import heapq
+import logging
+import zlib
+
+import pytz
+
+from config import REMINDER_HORIZON_DAYS, REMINDER_RETRY_MINUTES, REMINDER_CATCHUP_DAYS
+from db import with_session, UpdateSession
+from delivery import Delivery
+from reminders import scheduled_reminders, reminders_by_ids, reminder_window, record_sent, WATERMARK
+
+logger = logging.getLogger(__name__)
+
+# longest sleep between checks, so a changed clock or horizon is noticed
+MAX_SLEEP_SECONDS = 3600
+BUCKET = datetime.timedelta(hours=1)
+
+
+def utc_now():
+    return datetime.datetime.now(pytz.utc)
+
+
+def bucket_of(moment):
+    """hourly bucket (naive UTC, like installments.remind_at) an aware datetime falls in"""
+    return moment.astimezone(pytz.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+
+
+def fire_time(remind_at, chat_id):
+    """
+    UTC moment a chat's reminders of remind_at go out: a fixed per-chat offset within the
+    following hour, so the sends of one bucket spread over it and all of one chat's
+    reminders of a day fire together (one digest).
+    """
+    offset = zlib.crc32(str(chat_id).encode()) % int(BUCKET.total_seconds())
+    return pytz.utc.localize(remind_at) + datetime.timedelta(seconds=offset)
+
+
+class ReminderScheduler:
+    """
+    build_messages: rows of reminders.reminders_by_ids → [(send_message kwargs, ledger keys)]
+    shard: (index, shards) → only the chats of that shard (reminders.shard_of), with their own watermark
+    reload_seconds: reload everything this often (worker mode); None: rely on reschedule()/discard()
+    delivery_options: keyword arguments for delivery.Delivery (e.g. a share of the global rate)
+    on_fired: called with a stats dict after every fire
+    """
+
+    def __init__(self, build_messages, horizon_days=REMINDER_HORIZON_DAYS, shard=None,
+                 reload_seconds=None, delivery_options=None, on_fired=None):
+        self.build_messages = build_messages
+        self.horizon_days = horizon_days
+        self.shard = shard
+        self.watermark = WATERMARK if shard is None else f"{WATERMARK}.{shard[0]}/{shard[1]}"
+        self.reload_seconds = reload_seconds
+        self.delivery_options = delivery_options or {}
+        self.on_fired = on_fired
+        self._heap = []      # (fire_at, inst_id); entries no longer in _entries are skipped
+        self._entries = {}   # inst_id → (fire_at, loan_id)
+        self._by_loan = {}   # loan_id → {inst_id}
+        self._retry = {}     # inst_id → retry time of a failed send, kept across reloads
+        self._wakeup = asyncio.Event()
+        self.loaded_at = None
+        self.loaded_from = None   # buckets held in memory: loaded_from <= remind_at < loaded_until
+        self.loaded_until = None
+        self.fired = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _push(self, inst_id, loan_id, fire_at):
+        self.discard(inst_id)
+        self._entries[inst_id] = (fire_at, loan_id)
+        self._by_loan.setdefault(loan_id, set()).add(inst_id)
+        heapq.heappush(self._heap, (fire_at, inst_id))
+
+    def add(self, rows):
+        """rows of reminders.scheduled_reminders; days beyond the loaded horizon are left for extend()"""
+        for inst_id, loan_id, chat_id, remind_at in rows:
+            if self.loaded_until is None or remind_at < self.loaded_until:
+                fire_at = fire_time(remind_at, chat_id)
+                self._push(inst_id, loan_id, max(fire_at, self._retry.get(inst_id, fire_at)))
+        self._wakeup.set()
+
+    def discard(self, inst_id):
+        """forget an installment (paid, deleted); its stale heap entry is skipped later"""
+        entry = self._entries.pop(inst_id, None)
+        if entry is not None:
+            insts = self._by_loan.get(entry[1])
+            if insts is not None:
+                insts.discard(inst_id)
+                if not insts:
+                    del self._by_loan[entry[1]]
+
+    def discard_loan(self, loan_id):
+        for inst_id in self._by_loan.pop(loan_id, ()):
+            self._entries.pop(inst_id, None)
+
+    def next_fire(self):
+        while self._heap:
+            fire_at, inst_id = self._heap[0]
+            entry = self._entries.get(inst_id)
+            if entry is not None and entry[0] == fire_at:
+                return fire_at
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now):
+        """installments whose fire time has come, removed from the schedule: {inst_id: loan_id}"""
+        due = {}
+        while self.next_fire() is not None and self._heap[0][0] <= now:
+            _, inst_id = heapq.heappop(self._heap)
+            due[inst_id] = self._entries[inst_id][1]
+            self.discard(inst_id)
+        return due
+
+    def retry_later(self, inst_id, loan_id, retry_at):
+        """put an installment back for retry_at; the retry time survives a reload"""
+        self._retry[inst_id] = retry_at
+        self._push(inst_id, loan_id, retry_at)
+
+    def _horizon(self, now):
+        """first bucket beyond the horizon"""
+        return bucket_of(now) + datetime.timedelta(days=self.horizon_days) + BUCKET
+
+    @with_session
+    async def load(self, now, db: UpdateSession):
+        """(re)load from scratch: the catch-up window (see reminders.reminder_window) and the horizon"""
+        start_day, _ = await db.run(reminder_window, now.date(), self.watermark)
+        start, end = datetime.datetime.combine(start_day, datetime.time()), self._horizon(now)
+        rows = await db.run(scheduled_reminders, start, end, None, self.shard)
+        self._heap, self._entries, self._by_loan = [], {}, {}
+        log = logger.info if self.loaded_at is None else logger.debug
+        self.loaded_from, self.loaded_until, self.loaded_at = start, end, now
+        self.add(rows)
+        log("Reminder scheduler: %d reminders for %s..%s UTC", len(self), start, end)
+
+    @with_session
+    async def extend(self, now, db: UpdateSession):
+        """add the buckets that entered the horizon since the last load"""
+        end = self._horizon(now)
+        if end <= self.loaded_until:
+            return
+        rows = await db.run(scheduled_reminders, self.loaded_until, end, None, self.shard)
+        self.loaded_until = end
+        self.add(rows)
+
+    async def reschedule(self, db, loan_ids):
+        """
+        (re)schedule the reminders of new loans or of loans whose reminder time changed,
+        from today on; db: the caller's UpdateSession
+        """
+        if self.loaded_until is None:
+            return  # not started yet, load() will find them
+        for loan_id in loan_ids:
+            self.discard_loan(loan_id)
+        today = datetime.datetime.combine(utc_now().date(), datetime.time())
+        start = max(self.loaded_from, today)
+        self.add(await db.run(scheduled_reminders, start, self.loaded_until, loan_ids, self.shard))
+
+    @with_session
+    async def fire(self, bot, inst_ids, db: UpdateSession):
+        rows = await db.run(reminders_by_ids, inst_ids)
+        # release the connection before sending
+        await db.finish()
+        for inst_id in inst_ids:
+            self._retry.pop(inst_id, None)
+        if not rows:
+            return
+
+        messages = self.build_messages(rows)
+        stats = await Delivery(bot, **self.delivery_options).send_all([message for message, _ in messages])
+        delivered = set(stats.delivered)
+        # permanent failures (blocked bot, chat not found) go into the ledger as well, so
+        # neither a retry nor a reload or restart tries them again
+        done = delivered | set(stats.permanent)
+        sent_keys = [key for i in delivered for key in messages[i][1]]
+        done_keys = [key for i in done for key in messages[i][1]]
+        await db.run(record_sent, done_keys, utc_now().date(), self.watermark)
+        # commit the ledger now: what was sent must stay recorded whatever happens below
+        await db.finish()
+        self.fired += len(sent_keys)
+
+        # other failed messages are tried again later, until they leave the catch-up window
+        retry_at = utc_now() + datetime.timedelta(minutes=REMINDER_RETRY_MINUTES)
+        oldest = utc_now().date() - datetime.timedelta(days=REMINDER_CATCHUP_DAYS)
+        loan_of = {row[3]: row[1] for row in rows}
+        for i, (_, keys) in enumerate(messages):
+            if i not in done:
+                for remind_on, inst_id in keys:
+                    if remind_on >= oldest:
+                        self.retry_later(inst_id, loan_of[inst_id], retry_at)
+        logger.info("Reminders fired: %d installments in %d messages: %s",
+                    len(rows), len(messages), stats.as_dict())
+        if self.on_fired is not None:
+            self.on_fired({"installments": len(rows), "messages": len(messages),
+                           "recorded": len(sent_keys), **stats.as_dict()})
+
+    async def run(self, bot):
+        """load, then fire reminders at their times until cancelled"""
+        await self.load(utc_now())
+        while True:
+            now = utc_now()
+            reload_at = None
+            if self.reload_seconds:
+                reload_at = self.loaded_at + datetime.timedelta(seconds=self.reload_seconds)
+                if now >= reload_at:
+                    await self.load(now)
+                    continue
+            if self._horizon(now) > self.loaded_until:
+                await self.extend(now)
+            due = self.pop_due(now)
+            if due:
+                try:
+                    await self.fire(bot, due)
+                except Exception:
+                    # they were taken off the heap already and the ledger may have no record
+                    # of them: queue them again (fire() skips whatever did get recorded)
+                    logger.exception("Sending %d reminders failed", len(due))
+                    retry_at = utc_now() + datetime.timedelta(minutes=REMINDER_RETRY_MINUTES)
+                    for inst_id, loan_id in due.items():
+                        self.retry_later(inst_id, loan_id, retry_at)
+                continue
+            next_at = self.next_fire()
+            if reload_at is not None and (next_at is None or reload_at < next_at):
+                next_at = reload_at
+            timeout = MAX_SLEEP_SECONDS if next_at is None else (next_at - now).total_seconds()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, min(timeout, MAX_SLEEP_SECONDS)))
+            except asyncio.TimeoutError:
+                pass
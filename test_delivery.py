@@ -0,0 +1,111 @@
+# test_delivery.py
+# delivery.Delivery.send_all against fake_bot.FakeBot: the global pause on RetryAfter,
+# backoff retries on TimedOut, permanent errors tried once, and the per-chat spacing.
+#
+#   python -m pytest -q test_delivery.py
+import asyncio
+import time
+
+from telegram.error import TimedOut
+
+from delivery import Delivery
+from fake_bot import FakeBot
+
+# no simulated latency and fast buckets, so a test takes well under a second unless it
+# waits for a RetryAfter on purpose
+FAST = {"concurrency": 4, "global_rate": 100, "chat_rate": 100, "backoff_base": 0.05, "backoff_max": 0.2}
+# asyncio may wake a sleeper up to a clock tick early
+EPS = 0.005
+
+
+class RecordingBot(FakeBot):
+    """FakeBot that records (chat_id, monotonic time) of every call; timeouts: first calls of each chat → TimedOut"""
+
+    def __init__(self, timeouts=0, **kwargs):
+        kwargs.setdefault("latency", 0)
+        kwargs.setdefault("global_rate", 1000)
+        kwargs.setdefault("chat_rate", 1000)
+        super().__init__(**kwargs)
+        self.timeouts = timeouts
+        self.times = []
+
+    def times_of(self, chat_id):
+        return [at for chat, at in self.times if chat == chat_id]
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        self.times.append((chat_id, time.monotonic()))
+        if self.calls_by_chat.get(chat_id, 0) < self.timeouts:
+            self.calls += 1
+            self.calls_by_chat[chat_id] = self.calls_by_chat.get(chat_id, 0) + 1
+            self.network_errors += 1
+            raise TimedOut()
+        return await super().send_message(chat_id, text, reply_markup, **kwargs)
+
+
+def messages(chat_ids):
+    return [{"chat_id": chat_id, "text": f"reminder {i}"} for i, chat_id in enumerate(chat_ids)]
+
+
+def send(bot, chat_ids, **options):
+    return asyncio.run(Delivery(bot, **{**FAST, **options}).send_all(messages(chat_ids)))
+
+
+def test_retry_after_pauses_every_worker():
+    # the 5th call gets a flood-control RetryAfter(1)
+    bot = RecordingBot(flood_every=5, retry_after=1)
+    stats = send(bot, range(1, 7))
+
+    assert sorted(stats.delivered) == list(range(6)) and stats.failed == 0
+    assert stats.rate_limited == 1 and stats.retries == 1
+    assert len(bot.times) == 7
+    flood_at = bot.times[4][1]
+    # no worker sent anything while the bot was paused, not only the one that was told to wait
+    assert all(at >= flood_at + 1 - EPS for _, at in bot.times[5:])
+
+
+def test_timed_out_is_retried_with_backoff():
+    bot = RecordingBot(timeouts=2)
+    stats = send(bot, [1, 2])
+
+    assert sorted(stats.delivered) == [0, 1] and stats.failed == 0 and not stats.permanent
+    assert stats.retries == 4 and bot.calls == 6
+    for chat_id in (1, 2):
+        first, second, third = bot.times_of(chat_id)
+        # jittered exponential backoff: base * 2**(attempt-1), times 0.5..1
+        assert second - first >= FAST["backoff_base"] * 0.5 - EPS
+        assert third - second >= FAST["backoff_base"] * 2 * 0.5 - EPS
+
+
+def test_timed_out_gives_up_after_max_attempts():
+    bot = RecordingBot(timeouts=10)
+    stats = send(bot, [1], max_attempts=3)
+
+    assert stats.delivered == [] and stats.permanent == []
+    assert stats.failed == 1 and stats.retries == 2 and bot.calls == 3
+    assert "TimedOut" in stats.errors[0][1]
+
+
+def test_permanent_errors_are_tried_once():
+    # 7 blocked the bot, 8 does not exist (BadRequest, a NetworkError subclass)
+    bot = RecordingBot(blocked_chats={7}, bad_chats={8})
+    chat_ids = [1, 7, 2, 8, 3]
+    stats = send(bot, chat_ids)
+
+    assert sorted(stats.permanent) == [1, 3]
+    assert sorted(stats.delivered) == [0, 2, 4]
+    assert stats.failed == 2 and stats.retries == 0
+    assert bot.calls_by_chat[7] == 1 and bot.calls_by_chat[8] == 1
+    assert stats.as_dict()["permanent"] == 2
+
+
+def test_messages_to_one_chat_are_spaced():
+    chat_rate = 20
+    # FakeBot answers RetryAfter to two messages of a chat within 1/chat_rate seconds
+    bot = RecordingBot(chat_rate=chat_rate)
+    stats = send(bot, [1] * 5 + [2] * 5 + [3], chat_rate=chat_rate)
+
+    assert len(stats.delivered) == 11 and bot.limit_violations == 0 and stats.rate_limited == 0
+    for chat_id in (1, 2):
+        times = bot.times_of(chat_id)
+        assert len(times) == 5
+        assert all(b - a >= 1 / chat_rate - EPS for a, b in zip(times, times[1:]))
@@ -0,0 +1,366 @@
+# test_handlers.py
+# Handlers against a temporary loans.db with stand-ins for the Telegram objects: a write
+# is committed before the user sees it (and before the next Telegram call), so SQLite's
+# write lock is never held while the bot waits on the API; and what the loan view shows.
+# Updates fed through main.build_application() check that a slow query in one chat does
+# not hold up the others, while one chat's updates (the /addloan conversation) stay in order.
+#
+#   python -m pytest -q test_handlers.py
+import asyncio
+import json
+import sqlite3
+import time
+import types
+
+import pytest
+from telegram import Update
+from telegram.request import BaseRequest
+
+import main
+
+
+class Obj(types.SimpleNamespace):
+    pass
+
+
+def can_write_now(path="loans.db"):
+    """True when another connection gets the write lock at once (no write transaction open)"""
+    conn = sqlite3.connect(path, timeout=0)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.rollback()
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+def scalar(sql):
+    conn = sqlite3.connect("loans.db")
+    try:
+        return conn.execute(sql).fetchone()[0]
+    finally:
+        conn.close()
+
+
+class Chat:
+    """records what a handler sends, and the database state at that moment"""
+
+    def __init__(self, chat_id=1, check=None):
+        self.chat_id = chat_id
+        self.check = check
+        self.sent = []
+
+    async def _send(self, *args, **kwargs):
+        self.sent.append((args, kwargs, can_write_now(), self.check() if self.check else None))
+
+    def message(self, text):
+        msg = Obj(text=text, chat=Obj(id=self.chat_id), reply_text=self._send)
+        return Obj(callback_query=None, effective_chat=Obj(id=self.chat_id),
+                   effective_user=Obj(first_name="A"), message=msg)
+
+    def callback(self, data):
+        async def answer(*args, **kwargs):
+            pass
+        msg = Obj(chat=Obj(id=self.chat_id), reply_text=self._send, reply_markup=None)
+        query = Obj(data=data, message=msg, answer=answer, edit_message_text=self._send,
+                    edit_message_reply_markup=self._send)
+        return Obj(callback_query=query, effective_chat=Obj(id=self.chat_id),
+                   effective_user=Obj(first_name="A"), message=None)
+
+    def context(self, **user_data):
+        return Obj(user_data=user_data, args=[], bot=Obj(send_message=self._send))
+
+
+LOAN = {"bank": "B", "principal": 12_000_000.0, "rate": 18.0, "term": 12,
+        "first_payment_jalali": "1405-01-10", "reminder_days": 2}
+
+
+def test_writes_are_committed_before_the_reply(fresh_db):
+    chat = Chat(check=lambda: (scalar("select count(*) from loans"),
+                               scalar("select count(*) from installments where is_paid")))
+
+    async def run():
+        await main.start(chat.message("/start"), chat.context())
+        await main.prevpaid_callback(chat.callback("prevpaid|no"), chat.context(**LOAN))
+        inst_id = scalar("select min(id) from installments")
+        await main.pay_callback(chat.callback(f"pay|{inst_id}"), chat.context())
+        await main.delete_loan_execute(chat.callback("delete|yes"), chat.context(delete_target_id=1))
+
+    asyncio.run(run())
+    # every reply found the write committed and the write lock free
+    assert [lock_free for _, _, lock_free, _ in chat.sent] == [True] * len(chat.sent)
+    states = [state for _, _, _, state in chat.sent]
+    assert states[1] == (1, 0)          # "loan saved": the loan is already there
+    assert (1, 1) in states             # "marked paid": the payment is already there
+    assert states[-1] == (0, 0)         # "deleted": the loan is already gone
+
+
+def test_reminder_settings_are_committed_before_the_reply(fresh_db):
+    chat = Chat(check=lambda: (scalar("select reminder_mode from users"),
+                               scalar("select reminder_hour from users")))
+
+    async def run():
+        await main.start(chat.message("/start"), chat.context())
+        await main.reminder_mode_callback(chat.callback("remmode|digest"), chat.context())
+        context = chat.context()
+        context.args = ["9", "Asia/Tehran"]
+        await main.remind_time_command(chat.message("/remindtime 9 Asia/Tehran"), context)
+
+    asyncio.run(run())
+    assert all(lock_free for _, _, lock_free, _ in chat.sent)
+    assert chat.sent[1][3] == ("digest", None)
+    assert chat.sent[2][3] == ("digest", 9)
+
+
+def test_a_failed_commit_shows_nothing(fresh_db, monkeypatch):
+    chat = Chat()
+
+    def broken_commit(self):
+        raise sqlite3.OperationalError("database is locked")
+
+    asyncio.run(main.start(chat.message("/start"), chat.context()))
+    monkeypatch.setattr("sqlalchemy.orm.Session.commit", broken_commit)
+    with pytest.raises(sqlite3.OperationalError):
+        asyncio.run(main.prevpaid_callback(chat.callback("prevpaid|no"), chat.context(**LOAN)))
+    monkeypatch.undo()
+    assert len(chat.sent) == 1  # only the /start greeting
+    assert scalar("select count(*) from loans") == 0
+
+
+def test_loan_detail_shows_the_next_installment(fresh_db):
+    chat = Chat()
+
+    async def run():
+        await main.start(chat.message("/start"), chat.context())
+        await main.prevpaid_callback(chat.callback("prevpaid|no"), chat.context(**LOAN))
+        first = scalar("select min(id) from installments")
+        await main.pay_callback(chat.callback(f"pay|{first}"), chat.context())
+        await main.loan_detail_callback(chat.callback("loan|detail|1"), chat.context())
+
+    asyncio.run(run())
+    text = chat.sent[-1][0][0]
+    principal, interest = (scalar(f"select {column} from installments where sequence_number = 2")
+                           for column in ("amount_principal", "amount_interest"))
+    # installment 2 is next; its split matches the stored row
+    assert "⏭ قسط بعدی: 2 — " in text
+    assert f"اصل {main.format_currency(principal)} + بهره {main.format_currency(interest)}" in text
+    remaining = round(LOAN["principal"] - scalar(
+        "select sum(amount_principal) from installments where sequence_number <= 2"), 2)
+    assert f"مانده اصل طبق جدول پس از آن: {main.format_currency(remaining)}" in text
+    assert f"قسط 2: {main.format_currency(scalar('select amount_total from installments where sequence_number = 2'))}" \
+           f" تومان — " in text and f"مانده {main.format_currency(remaining)} — ❌" in text
+
+
+def test_loan_detail_reuses_the_cached_schedule(fresh_db, monkeypatch):
+    chat = Chat()
+    monkeypatch.setattr(main, "schedule_cache", main.schedule_cache.__class__(capacity=8))
+    monkeypatch.setattr(main, "cached_amortization", main.schedule_cache.get)
+
+    async def run():
+        await main.start(chat.message("/start"), chat.context())
+        await main.prevpaid_callback(chat.callback("prevpaid|no"), chat.context(**LOAN))
+        # creation streams its rows and leaves the cache alone
+        assert main.schedule_cache.stats()["size"] == 0
+        for _ in range(3):
+            await main.loan_detail_callback(chat.callback("loan|detail|1"), chat.context())
+
+    asyncio.run(run())
+    stats = main.schedule_cache.stats()
+    assert (stats["size"], stats["hits"], stats["misses"]) == (1, 2, 1)
+    assert chat.sent[-1][0][0] == chat.sent[-2][0][0]
+
+
+def test_warmed_keyboards_serve_the_addloan_calendar(fresh_db):
+    from calendar_helper import YEAR_PICKER_SPAN, get_keyboard, warm_keyboard_cache
+
+    get_keyboard.cache_clear()
+    year = main.to_jalali(main.get_local_today())[0]
+    info = warm_keyboard_cache(year, prefix="cal")
+    # years + months and days of every offered year; no full month calendars
+    assert info.currsize == 1 + YEAR_PICKER_SPAN * 13
+    chat = Chat()
+
+    async def run():
+        await main.addloan_term(chat.message("12"), chat.context())
+        await main.calendar_callback(chat.callback(f"cal_year|{year - 3}"), chat.context())
+        await main.calendar_callback(chat.callback(f"cal_month|{year - 3}|7"), chat.context())
+
+    asyncio.run(run())
+    assert get_keyboard.cache_info().misses == info.misses
+    assert [kwargs["reply_markup"] for _, kwargs, _, _ in chat.sent] == [
+        get_keyboard("years", year, None, "cal"),
+        get_keyboard("months", year - 3, None, "cal"),
+        get_keyboard("days", year - 3, 7, "cal"),
+    ]
+
+def test_users_keep_one_reminder_per_installment_until_they_choose_digest(fresh_db):
+    from db import SessionLocal
+    from reminders import reminders_by_ids
+
+    chat = Chat()
+
+    async def run():
+        await main.start(chat.message("/start"), chat.context())
+        await main.prevpaid_callback(chat.callback("prevpaid|no"), chat.context(**LOAN))
+
+    def messages():
+        with SessionLocal() as session:
+            rows = reminders_by_ids(session, [1, 2, 3])
+        return main.build_reminder_messages(rows)
+
+    asyncio.run(run())
+    assert scalar("select reminder_mode from users") is None
+    single = messages()
+    assert len(single) == 3 and all(m["text"].startswith("🔔 یادآوری پرداخت قسط") for m, _ in single)
+
+    asyncio.run(main.reminder_mode_callback(chat.callback("remmode|digest"), chat.context()))
+    digest = messages()
+    assert len(digest) == 1 and digest[0][0]["text"].startswith("🔔 یادآوری 3 قسط")
+
+# ----------------------------------------------------------------------
+# Through the Application: updates go through the update queue, the update processor
+# and Application.process_update, and the Bot API is answered locally.
+# ----------------------------------------------------------------------
+class BotApiStub(BaseRequest):
+    """answers Bot API calls without a network; records (method, chat_id, text, loop time)"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        name = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((name, params.get("chat_id"), params.get("text"), asyncio.get_running_loop().time()))
+        if name == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "loan", "username": "loan_bot"}
+        elif name in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            result = {"message_id": len(self.calls), "date": 0, "text": params.get("text", ""),
+                      "chat": {"id": params.get("chat_id", 0), "type": "private"}}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def replies(self, chat_id):
+        return [(text, at) for name, chat, text, at in self.calls
+                if name in ("sendMessage", "editMessageText") and chat == chat_id]
+
+
+class Updates:
+    """Update JSON for the Application, one private chat per user"""
+
+    def __init__(self):
+        self.next_id = 0
+
+    def _chat(self, chat_id):
+        return {"id": chat_id, "type": "private"}, {"id": chat_id, "is_bot": False, "first_name": "A"}
+
+    def message(self, chat_id, text):
+        self.next_id += 1
+        chat, user = self._chat(chat_id)
+        message = {"message_id": self.next_id, "date": 0, "chat": chat, "from": user, "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": self.next_id, "message": message}
+
+    def callback(self, chat_id, data):
+        self.next_id += 1
+        chat, user = self._chat(chat_id)
+        return {"update_id": self.next_id, "callback_query": {
+            "id": str(self.next_id), "from": user, "chat_instance": str(chat_id), "data": data,
+            "message": {"message_id": 1, "date": 0, "chat": chat, "text": "…"},
+        }}
+
+
+async def run_updates(updates, until, timeout=10.0):
+    """feed updates to the bot's Application and wait until until(api) is true"""
+    api = BotApiStub()
+    app = main.build_application(token="123:test", request=api)
+    async with app:
+        await app.start()
+        try:
+            started = asyncio.get_running_loop().time()
+            for update in updates:
+                await app.update_queue.put(Update.de_json(update, app.bot))
+            while not until(api):
+                assert asyncio.get_running_loop().time() - started < timeout, api.calls
+                await asyncio.sleep(0.01)
+        finally:
+            await app.stop()
+    return api, started
+
+
+SLOW_QUERY_SECONDS = 1.0
+
+
+@pytest.fixture
+def slow_loans_query(monkeypatch):
+    """/myloans spends SLOW_QUERY_SECONDS in the database"""
+    loans_for_chat = main._loans_for_chat
+
+    def slow(session, chat_id):
+        time.sleep(SLOW_QUERY_SECONDS)
+        return loans_for_chat(session, chat_id)
+    monkeypatch.setattr(main, "_loans_for_chat", slow)
+
+
+def test_a_slow_query_does_not_delay_other_chats(fresh_db, slow_loans_query):
+    u = Updates()
+    updates = [u.message(1, "/start"), u.message(2, "/start"),
+               u.message(1, "/myloans"), u.message(2, "/start")]
+    api, started = asyncio.run(run_updates(updates, lambda api: len(api.replies(1)) == 2
+                                           and len(api.replies(2)) == 2))
+    slow_reply_at = api.replies(1)[-1][1]
+    other_reply_at = api.replies(2)[-1][1]
+    assert slow_reply_at - started >= SLOW_QUERY_SECONDS
+    # chat 2's second /start was queued behind chat 1's slow /myloans and still answered at once
+    assert other_reply_at - started < SLOW_QUERY_SECONDS / 2
+
+
+def test_updates_of_one_chat_keep_their_order(fresh_db, slow_loans_query):
+    u = Updates()
+    updates = [u.message(1, "/start"), u.message(1, "/myloans"), u.message(1, "/start")]
+    api, _ = asyncio.run(run_updates(updates, lambda api: len(api.replies(1)) == 3))
+    texts = [text for text, _ in api.replies(1)]
+    assert texts[0].startswith("سلام") and texts[2].startswith("سلام")
+    assert not texts[1].startswith("سلام")  # /myloans answered before the second /start ran
+
+
+def test_addloan_conversations_of_two_chats_interleave(fresh_db):
+    u = Updates()
+    steps = {
+        1: ["/start", "/addloan", "Bank A", "1000000", "18", "12",
+            "cal_year|1405", "cal_month|1405|2", "cal_day|1405|2|31", "rem|2", "prevpaid|no"],
+        2: ["/start", "/addloan", "Bank B", "2500000", "23.5", "36",
+            "cal_year|1404", "cal_month|1404|12", "cal_day|1404|12|29", "rem|1", "prevpaid|no"],
+    }
+    updates = []
+    for step_a, step_b in zip(steps[1], steps[2]):
+        for chat_id, step in ((1, step_a), (2, step_b)):
+            make = u.callback if "|" in step else u.message
+            updates.append(make(chat_id, step))
+    done = lambda api: all(any(text and text.startswith("✅ وام با موفقیت") for text, _ in api.replies(c))
+                           for c in (1, 2))
+    asyncio.run(run_updates(updates, done))
+
+    conn = sqlite3.connect("loans.db")
+    try:
+        loans = conn.execute(
+            "select u.chat_id, l.bank, l.principal, l.annual_interest_rate, l.term_months, "
+            "l.first_payment_date, l.reminder_days_before, count(i.id) from loans l "
+            "join users u on u.id = l.user_id join installments i on i.loan_id = l.id "
+            "group by l.id order by u.chat_id").fetchall()
+    finally:
+        conn.close()
+    assert loans == [
+        (1, "Bank A", 1_000_000.0, 18.0, 12, str(main.jalali_to_gregorian_date("1405-02-31")), 2, 12),
+        (2, "Bank B", 2_500_000.0, 23.5, 36, str(main.jalali_to_gregorian_date("1404-12-29")), 1, 36),
+    ]
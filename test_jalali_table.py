@@ -0,0 +1,44 @@
+# test_jalali_table.py
+# The precomputed jalali table against jdatetime.
+#
+#   python -m pytest -q test_jalali_table.py
+import datetime
+
+import jdatetime
+import pytest
+
+import jalali_table
+
+
+@pytest.mark.parametrize("first_year, last_year", [
+    (jalali_table.FIRST_YEAR, jalali_table.FIRST_YEAR + 2),
+    (1390, 1420),
+    (jalali_table.LAST_YEAR - 2, jalali_table.LAST_YEAR),
+])
+def test_validate_finds_no_mismatch(first_year, last_year):
+    assert jalali_table.validate(first_year, last_year) == []
+
+
+def test_validate_reports_a_wrong_table(monkeypatch):
+    real = jalali_table.to_jalali
+    broken = datetime.date(2024, 9, 21)  # 31 Shahrivar 1403
+    monkeypatch.setattr(jalali_table, "to_jalali",
+                        lambda gdate: (1403, 7, 1) if gdate == broken else real(gdate))
+    errors = jalali_table.validate(1403, 1403)
+    assert len(errors) == 1 and "2024-09-21" in errors[0]
+
+
+@pytest.mark.parametrize("year", [1399, 1402, 1403, 1407, 1408])
+def test_month_lengths_and_leap_years(year):
+    for month in range(1, 13):
+        next_first = jdatetime.date(year + month // 12, month % 12 + 1, 1).togregorian()
+        first = jdatetime.date(year, month, 1).togregorian()
+        assert jalali_table.month_length(year, month) == (next_first - first).days
+    assert jalali_table.is_leap(year) == jdatetime.date(year, 1, 1).isleap()
+
+
+@pytest.mark.parametrize("gdate", [datetime.date(1700, 1, 1), datetime.date(2300, 6, 15)])
+def test_dates_outside_the_table_fall_back_to_jdatetime(gdate):
+    jd = jdatetime.date.fromgregorian(date=gdate)
+    assert jalali_table.to_jalali(gdate) == (jd.year, jd.month, jd.day)
+    assert jalali_table.to_gregorian(jd.year, jd.month, jd.day) == gdate
@@ -0,0 +1,352 @@
+# test_logic.py
+# Schedules from logic.py against the original list-of-dicts implementation
+# (jdatetime month arithmetic, one dict per row), plus the batch engine and the
+# jalali month series against their single-loan counterparts, and the batch
+# engine's vectorized rounding against round(), and the fixed-point engine and how
+# the engine is chosen.
+#
+#   python -m pytest -q test_logic.py
+import datetime
+import os
+import random
+import subprocess
+import sys
+
+import jdatetime
+import numpy as np
+import pytest
+
+import jalali_table
+import logic
+from logic import (
+    Schedule, ScheduleRow, add_months_preserve_day, calculate_amortization,
+    calculate_amortization_batch, iter_amortization, jalali_monthly_series,
+)
+
+
+def _old_add_months(date_obj, months):
+    # the original add_months_preserve_day: jdatetime, and step the day down until it exists
+    jdate = jdatetime.date.fromgregorian(date=date_obj)
+    total = jdate.month + months
+    new_y = jdate.year + (total - 1) // 12
+    new_m = (total - 1) % 12 + 1
+    for day in range(jdate.day, 0, -1):
+        try:
+            return jdatetime.date(new_y, new_m, day).togregorian()
+        except ValueError:
+            continue
+
+
+def _old_calculate_amortization(principal, annual_rate, term_months, first_payment_date):
+    # the original calculate_amortization, returning a list of dicts
+    if term_months <= 0:
+        return []
+
+    r = annual_rate / 100 / 12
+    if r == 0:
+        payment = round(principal / term_months, 2)
+    else:
+        payment = principal * r / (1 - (1 + r) ** -term_months)
+
+    schedule = []
+    balance = principal
+    for i in range(1, term_months + 1):
+        interest = round(balance * r, 10)
+        principal_part = payment - interest
+        if i == term_months:
+            principal_part = balance
+            payment_amount = round(interest + principal_part, 2)
+        else:
+            payment_amount = round(payment, 2)
+            principal_part = round(principal_part, 2)
+
+        interest = round(interest, 2)
+        balance = round(balance - principal_part, 2)
+        schedule.append({
+            "installment": i,
+            "due_date": _old_add_months(first_payment_date, i - 1),
+            "payment": payment_amount,
+            "interest": interest,
+            "principal": principal_part,
+            "remaining": balance,
+        })
+    return schedule
+
+
+# 31 Shahrivar 1403, 30 Esfand 1403 (leap), 29 Esfand 1402, 30 Bahman 1402, 1 Farvardin 1404
+MONTH_END_DATES = [
+    jalali_table.to_gregorian(1403, 6, 31),
+    jalali_table.to_gregorian(1403, 12, 30),
+    jalali_table.to_gregorian(1402, 12, 29),
+    jalali_table.to_gregorian(1402, 11, 30),
+    jalali_table.to_gregorian(1404, 1, 1),
+]
+
+LOANS = [
+    (100_000_000, 18.0, 12, datetime.date(2024, 3, 20)),
+    (250_000_000, 23.5, 36, MONTH_END_DATES[0]),
+    (1_234_567.89, 4.0, 60, MONTH_END_DATES[1]),
+    (50_000_000, 0.0, 7, MONTH_END_DATES[2]),   # no interest
+    (10_000, 30.0, 1, MONTH_END_DATES[3]),
+    (999_999_999.99, 12.75, 120, MONTH_END_DATES[4]),
+    (1_000, 18.0, 0, datetime.date(2024, 1, 1)),  # empty schedule
+]
+
+
+@pytest.fixture(autouse=True)
+def float_engine():
+    # the old implementation is the float engine; don't depend on config.AMORTIZATION_ENGINE
+    previous = logic._default_engine
+    logic.set_default_engine(logic.ENGINE_FLOAT)
+    yield
+    logic._default_engine = previous
+
+
+@pytest.mark.parametrize("loan", LOANS)
+def test_schedule_matches_old_list_of_dicts(loan):
+    expected = _old_calculate_amortization(*loan)
+    schedule = calculate_amortization(*loan)
+
+    assert isinstance(schedule, Schedule)
+    assert len(schedule) == len(expected)
+    assert schedule.to_list() == expected
+    assert schedule == expected
+    assert [dict(row) for row in schedule] == expected
+    assert list(iter_amortization(*loan)) == expected
+
+
+def test_schedule_row_behaves_like_the_old_dict():
+    expected = _old_calculate_amortization(*LOANS[1])
+    schedule = calculate_amortization(*LOANS[1])
+
+    row = schedule[-1]
+    assert isinstance(row, ScheduleRow)
+    assert row == expected[-1]
+    assert row["installment"] == len(expected)
+    assert row["remaining"] == 0.0
+    assert list(row) == list(expected[-1])
+    assert row.get("missing") is None
+    with pytest.raises(KeyError):
+        row["missing"]
+    assert schedule[2:5] == expected[2:5]
+    assert schedule.due_dates() == [r["due_date"] for r in expected]
+    with pytest.raises(IndexError):
+        schedule[len(expected)]
+
+
+def test_frozen_schedule_is_read_only():
+    schedule = calculate_amortization(*LOANS[0]).freeze()
+    assert schedule.frozen
+    with pytest.raises(AttributeError):
+        schedule.append(datetime.date(2025, 1, 1), 1.0, 1.0, 1.0, 1.0)
+    with pytest.raises(TypeError):
+        schedule.payment[0] = 0.0
+    assert schedule == _old_calculate_amortization(*LOANS[0])
+
+
+def test_batch_matches_single_loans():
+    rng = random.Random(7)
+    loans = list(LOANS)
+    for _ in range(300):
+        loans.append((
+            round(rng.uniform(1_000, 2_000_000_000), rng.choice((0, 2))),
+            rng.choice((0.0, 4.0, 12.5, 18.0, 23.0, rng.uniform(0.1, 40))),
+            rng.randint(0, 96),
+            rng.choice(MONTH_END_DATES + [datetime.date(2024, 1, 1) + datetime.timedelta(days=rng.randint(0, 800))]),
+        ))
+
+    schedules = calculate_amortization_batch(*zip(*loans))
+    assert len(schedules) == len(loans)
+    for loan, schedule in zip(loans, schedules):
+        assert schedule == calculate_amortization(*loan), loan
+
+
+def test_batch_spans_several_blocks(monkeypatch):
+    monkeypatch.setattr(logic, "BATCH_BLOCK_SIZE", 4)
+    loans = LOANS * 3
+    schedules = calculate_amortization_batch(*zip(*loans))
+    assert [s.to_list() for s in schedules] == [_old_calculate_amortization(*loan) for loan in loans]
+
+
+def test_batch_rejects_mismatched_lengths():
+    with pytest.raises(ValueError):
+        calculate_amortization_batch([1_000.0], [18.0, 20.0], [12], [datetime.date(2024, 1, 1)])
+
+
+@pytest.mark.parametrize("first_date", MONTH_END_DATES + [datetime.date(2023, 3, 21), datetime.date(2024, 8, 22)])
+def test_jalali_monthly_series_matches_add_months(first_date):
+    n = 40
+    series = list(jalali_monthly_series(first_date, n))
+    assert series == [add_months_preserve_day(first_date, i) for i in range(n)]
+    assert series == [_old_add_months(first_date, i) for i in range(n)]
+
+
+def test_jalali_monthly_series_caps_to_month_end():
+    # 31 Shahrivar 1403 -> 30 in Mehr..Esfand (1403 is leap, so Esfand has 30), back to 31 in Farvardin 1404
+    days = [jalali_table.to_jalali(d) for d in jalali_monthly_series(MONTH_END_DATES[0], 8)]
+    assert days == [
+        (1403, 6, 31), (1403, 7, 30), (1403, 8, 30), (1403, 9, 30),
+        (1403, 10, 30), (1403, 11, 30), (1403, 12, 30), (1404, 1, 31),
+    ]
+    # 30 Esfand of a leap year falls to 29 Esfand in the next (common) year
+    assert jalali_table.to_jalali(add_months_preserve_day(MONTH_END_DATES[1], 12)) == (1404, 12, 29)
+    assert list(jalali_monthly_series(MONTH_END_DATES[0], 0)) == []
+
+
+def _same_as_round(values, ndigits):
+    out = logic._round_like_python(np.array(values, dtype=np.float64), ndigits).tolist()
+    expected = [round(v, ndigits) for v in values]
+    # compare as strings so -0.0 vs 0.0 and nan count too
+    return [repr(v) for v in out] == [repr(v) for v in expected]
+
+
+@pytest.mark.parametrize("ndigits", [2, 10])
+def test_round_like_python_on_ties(ndigits):
+    step = 10.0 ** -ndigits
+    # .xx5 ties: most are not exactly representable, so round() goes by the exact binary value
+    ties = [(k + 0.5) * step for k in range(-5000, 5000)]
+    ties += [k / 1000 for k in range(-20005, 20005, 10)]
+    ties += [0.125, 0.375, 2.675, 1.005, 0.285, -0.125, -2.675, -1.005]
+    assert _same_as_round(ties, ndigits)
+
+
+@pytest.mark.parametrize("ndigits", [2, 10])
+def test_round_like_python_on_random_and_negative_values(ndigits):
+    rng = random.Random(11)
+    values = [rng.uniform(-1e12, 1e12) for _ in range(20000)]
+    values += [rng.uniform(-1, 1) for _ in range(5000)]
+    values += [0.0, -0.0, 5e-324, -5e-324]
+    assert _same_as_round(values, ndigits)
+
+
+def test_round_like_python_on_large_magnitudes():
+    values = [x + 0.005 for x in (1e6, 1e9, 1e12, 1e13, 1e14, 1e15, 1e16)]
+    values += [-(x + 0.005) for x in (1e12, 1e15)]
+    values += [2.0 ** 50 + 0.5, 2.0 ** 53, -2.0 ** 53, 2.0 ** 53 + 2, 2.0 ** 60, 1e300, -1e300]
+    values += [float("inf"), -float("inf"), float("nan")]
+    assert _same_as_round(values, 2)
+    assert _same_as_round(values, 10)
+
+
+def test_schedule_cache_hits_and_evicts():
+    cache = logic.ScheduleCache(capacity=2)
+    first = cache.get(*LOANS[0])
+    assert cache.get(*LOANS[0]) is first and first.frozen
+    assert first == _old_calculate_amortization(*LOANS[0])
+    cache.get(*LOANS[1])
+    cache.get(*LOANS[2])  # evicts LOANS[0], the least recently used
+    assert cache.get(*LOANS[0]) is not first
+    assert cache.stats() == {"size": 2, "capacity": 2, "hits": 1, "misses": 4, "hit_rate": 0.2}
+
+
+@pytest.mark.parametrize("engine", logic.ENGINES)
+@pytest.mark.parametrize("loan", [loan for loan in LOANS if loan[2] > 0])
+def test_single_row_lookups_match_the_schedule(loan, engine):
+    principal, rate, term, first = loan
+    schedule = calculate_amortization(*loan, engine=engine)
+    assert logic.remaining_balance_at(principal, rate, term, 0, engine=engine) == principal
+    for k in range(1, term + 1):
+        assert logic.installment_at(principal, rate, term, first, k, engine=engine) == dict(schedule[k - 1])
+        assert logic.remaining_balance_at(principal, rate, term, k, engine=engine) == schedule[k - 1]["remaining"]
+
+
+@pytest.mark.parametrize("loan", [loan for loan in LOANS if loan[2] > 0])
+def test_closed_form_balance_stays_close(loan):
+    principal, rate, term, _ = loan
+    schedule = calculate_amortization(*loan)
+    for k in range(1, term):
+        # the closed form skips the per-row rounding: off by at most a cent per row
+        estimate = logic.remaining_balance_at(principal, rate, term, k, exact=False)
+        assert abs(estimate - schedule[k - 1]["remaining"]) <= 0.01 * k
+
+
+def test_single_row_lookups_reject_out_of_range_rows():
+    principal, rate, term, first = LOANS[0]
+    with pytest.raises(ValueError):
+        logic.installment_at(principal, rate, term, first, 0)
+    with pytest.raises(ValueError):
+        logic.installment_at(principal, rate, term, first, term + 1)
+    with pytest.raises(ValueError):
+        logic.remaining_balance_at(principal, rate, term, -1)
+
+
+FIXED_LOANS = [loan for loan in LOANS if loan[2] > 0] + [
+    (1_000_000.01, 18.5, 37, datetime.date(2024, 5, 31)),
+    (333_333.33, 0.0, 7, datetime.date(2024, 1, 31)),   # no interest, does not divide evenly
+    (10_000_000, 0.01, 240, datetime.date(2024, 2, 29)),
+]
+
+
+def _minor(value):
+    return round(value * logic.AMOUNT_MINOR_UNITS)
+
+
+@pytest.mark.parametrize("loan", FIXED_LOANS)
+def test_fixed_engine_principal_adds_up_exactly(loan):
+    principal, rate, term, _ = loan
+    schedule = calculate_amortization(*loan, engine=logic.ENGINE_FIXED)
+    assert len(schedule) == term
+    # every amount is a whole number of minor units
+    for column in (schedule.payment, schedule.interest, schedule.principal, schedule.remaining):
+        assert all(v == _minor(v) / logic.AMOUNT_MINOR_UNITS for v in column)
+    assert sum(_minor(p) for p in schedule.principal) == _minor(principal)
+    assert schedule[-1]["remaining"] == 0.0
+    # each row's payment is its interest plus its principal part, and the balance follows
+    balance = _minor(principal)
+    for row in schedule:
+        assert _minor(row["payment"]) == _minor(row["interest"]) + _minor(row["principal"])
+        balance -= _minor(row["principal"])
+        assert _minor(row["remaining"]) == balance
+    # level payments except the last
+    assert len({_minor(p) for p in schedule.payment[:-1]}) <= 1
+
+
+def test_fixed_engine_zero_rate():
+    schedule = calculate_amortization(333_333.33, 0.0, 7, datetime.date(2024, 1, 31), engine=logic.ENGINE_FIXED)
+    assert all(v == 0.0 for v in schedule.interest)
+    assert list(schedule.payment[:-1]) == [47_619.05] * 6
+    assert schedule[-1]["payment"] == schedule[-1]["principal"] == 47_619.03
+    assert schedule.due_dates() == calculate_amortization(333_333.33, 0.0, 7, datetime.date(2024, 1, 31)).due_dates()
+
+
+def test_fixed_engine_stays_close_to_the_float_engine():
+    for loan in FIXED_LOANS:
+        fixed = calculate_amortization(*loan, engine=logic.ENGINE_FIXED)
+        floating = calculate_amortization(*loan, engine=logic.ENGINE_FLOAT)
+        assert fixed.due_dates() == floating.due_dates()
+        assert all(abs(a - b) <= 0.01 for a, b in zip(fixed.payment[:-1], floating.payment[:-1])), loan
+
+
+def test_engine_selection():
+    loan = (1_000_000.01, 18.5, 37, datetime.date(2024, 5, 31))
+    fixed = calculate_amortization(*loan, engine=logic.ENGINE_FIXED)
+    floating = calculate_amortization(*loan, engine=logic.ENGINE_FLOAT)
+    assert fixed != floating
+
+    assert calculate_amortization(*loan) == floating   # the float_engine fixture's default
+    logic.set_default_engine(logic.ENGINE_FIXED)
+    assert calculate_amortization(*loan) == fixed
+    assert list(iter_amortization(*loan)) == fixed
+    assert calculate_amortization(*loan, engine=logic.ENGINE_FLOAT) == floating  # engine= wins
+    assert calculate_amortization_batch(*zip(loan)) == [floating]   # the batch engine is float only
+
+    for bad in ("decimal", "FIXED"):
+        with pytest.raises(ValueError):
+            calculate_amortization(*loan, engine=bad)
+        with pytest.raises(ValueError):
+            logic.set_default_engine(bad)
+    assert logic._default_engine == logic.ENGINE_FIXED   # a rejected engine leaves the default alone
+
+
+@pytest.mark.parametrize("configured, expected", [("float", "float"), ("fixed", "fixed"), ("decimal", None)])
+def test_engine_from_config(configured, expected):
+    # a fresh interpreter, since logic reads config.AMORTIZATION_ENGINE at import
+    code = ("import config; config.AMORTIZATION_ENGINE = %r\n"
+            "import logic; print(logic._default_engine)" % configured)
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(logic.__file__)))
+    if expected is None:
+        assert result.returncode != 0 and "unknown amortization engine: 'decimal'" in result.stderr
+    else:
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip() == expected
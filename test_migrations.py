@@ -0,0 +1,182 @@
+# test_migrations.py
+# init_db() on a loans.db with the schema of the first release (the models before any
+# migration existed, as CREATE TABLE statements): every step runs, the schema ends up
+# like a fresh one and the new columns are backfilled from the old rows.
+#
+#   python -m pytest -q test_migrations.py
+import datetime
+import os
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+import migrations
+from config import TIMEZONE
+from db import engine, init_db
+from models import Base
+from reminders import remind_at_for
+
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL,
+    chat_id INTEGER,
+    name VARCHAR,
+    timezone VARCHAR,
+    PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_users_chat_id ON users (chat_id);
+CREATE TABLE loans (
+    id INTEGER NOT NULL,
+    user_id INTEGER,
+    bank VARCHAR,
+    loan_name VARCHAR,
+    principal FLOAT,
+    annual_interest_rate FLOAT,
+    term_months INTEGER,
+    payment_cycle VARCHAR,
+    first_payment_date DATE,
+    installments_paid INTEGER,
+    reminder_days_before INTEGER,
+    status VARCHAR,
+    created_at DATETIME,
+    updated_at DATETIME,
+    PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES users (id)
+);
+CREATE TABLE installments (
+    id INTEGER NOT NULL,
+    loan_id INTEGER,
+    sequence_number INTEGER,
+    due_date DATE,
+    amount_total FLOAT,
+    amount_principal FLOAT,
+    amount_interest FLOAT,
+    is_paid BOOLEAN,
+    paid_at DATETIME,
+    paid_amount FLOAT,
+    PRIMARY KEY (id),
+    FOREIGN KEY(loan_id) REFERENCES loans (id)
+);
+"""
+
+USERS = [(1, 5, "a", "Asia/Tehran"), (2, 6, "b", None)]
+# (id, user_id, reminder_days_before, status, updated_at)
+LOANS = [
+    (1, 1, 2, "active", None),
+    (2, 2, None, "active", "2024-01-01 00:00:00.000000"),   # every installment paid
+    (3, 1, 1, "deleted", None),                             # kept in backup.db, keeps its status
+]
+# (id, loan_id, sequence_number, due_date, amount_principal, is_paid)
+INSTALLMENTS = [
+    (1, 1, 1, "2026-01-10", 100.10, 1),
+    (2, 1, 2, "2026-02-10", 200.20, 0),
+    (3, 1, 3, "2026-03-10", 300.30, 0),
+    (4, 2, 1, "2026-01-31", 50.0, 1),
+    (5, 2, 2, "2026-02-28", 50.0, 1),
+    (6, 3, 1, "2026-05-05", 70.0, 0),
+]
+
+
+def rows(conn, sql):
+    return conn.execute(sql).fetchall()
+
+
+def schema(path):
+    """{table: (columns, indexes)} of a database file"""
+    conn = sqlite3.connect(path)
+    try:
+        tables = [name for (name,) in rows(conn, "select name from sqlite_master where type = 'table'")]
+        return {
+            table: ({r[1] for r in rows(conn, f"PRAGMA table_info({table})")},
+                    {r[1] for r in rows(conn, f"PRAGMA index_list({table})") if not r[1].startswith("sqlite_")})
+            for table in tables
+        }
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def baseline_db():
+    engine.dispose()
+    for name in os.listdir("."):
+        if name.startswith("loans.db"):
+            os.remove(name)
+    conn = sqlite3.connect("loans.db")
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany("insert into users values (?, ?, ?, ?)", USERS)
+    conn.executemany(
+        "insert into loans (id, user_id, bank, loan_name, principal, annual_interest_rate, term_months, "
+        "payment_cycle, first_payment_date, installments_paid, reminder_days_before, status, created_at, "
+        "updated_at) values (?, ?, 'B', 'B', 1000.0, 18.0, 3, 'monthly', '2026-01-10', 0, ?, ?, "
+        "'2024-01-01 00:00:00.000000', ?)", LOANS)
+    conn.executemany(
+        "insert into installments (id, loan_id, sequence_number, due_date, amount_total, amount_principal, "
+        "amount_interest, is_paid) values (?, ?, ?, ?, 0, ?, 0, ?)", INSTALLMENTS)
+    conn.commit()
+    conn.close()
+    yield "loans.db"
+    engine.dispose()
+
+
+def test_baseline_database_is_migrated(baseline_db):
+    started = datetime.datetime.utcnow()
+    init_db()
+    engine.dispose()
+
+    # the same columns and indexes as a database created from today's models
+    fresh = create_engine("sqlite:///fresh.db")
+    Base.metadata.create_all(fresh)
+    fresh.dispose()
+    try:
+        assert schema(baseline_db) == schema("fresh.db")
+    finally:
+        os.remove("fresh.db")
+
+    conn = sqlite3.connect(baseline_db)
+    try:
+        assert rows(conn, "PRAGMA user_version") == [(migrations.LATEST_VERSION,)]
+        indexes = {name for (name,) in rows(conn, "select name from sqlite_master where type = 'index'")}
+        assert {
+            "ix_loans_user_status", "ix_installments_loan_paid_due", "ix_installments_due_paid",
+            "ix_installments_remind_at_paid", "ix_users_updated_at", "ix_loans_updated_at",
+            "ix_installments_updated_at",
+        } <= indexes
+        # created by step 3, dropped again by step 7
+        assert "ix_installments_remind_paid" not in indexes
+
+        # step 2: repair_progress
+        assert rows(conn, "select id, paid_count, outstanding_principal, next_installment_id, next_due_date, "
+                          "status from loans order by id") == [
+            (1, 1, 500.5, 2, "2026-02-10", "active"),
+            (2, 2, 0.0, None, None, "completed"),
+            (3, 0, 70.0, 6, "2026-05-05", "deleted"),
+        ]
+        # step 3: backfill_remind_on (no reminder_days_before: on the due date)
+        assert rows(conn, "select id, remind_on from installments order by id") == [
+            (1, "2026-01-08"), (2, "2026-02-08"), (3, "2026-03-08"),
+            (4, "2026-01-31"), (5, "2026-02-28"), (6, "2026-05-04"),
+        ]
+        # step 5: refresh_remind_at, in the owner's timezone (or the default), only for unpaid rows
+        expected = {
+            2: remind_at_for(datetime.date(2026, 2, 8), "Asia/Tehran"),
+            3: remind_at_for(datetime.date(2026, 3, 8), "Asia/Tehran"),
+            6: remind_at_for(datetime.date(2026, 5, 4), "Asia/Tehran"),
+        }
+        assert remind_at_for(datetime.date(2026, 5, 4), None) == remind_at_for(datetime.date(2026, 5, 4), TIMEZONE)
+        remind_at = dict(rows(conn, "select id, remind_at from installments"))
+        assert remind_at == {i: str(expected[i]) + ".000000" if i in expected else None for i in remind_at}
+        assert rows(conn, "select reminder_mode, reminder_hour from users") == [(None, None), (None, None)]
+
+        # step 6 (and UPDATE_COLUMNS before step 2): every row has updated_at
+        for table in ("users", "loans", "installments"):
+            stamps = [value for (value,) in rows(conn, f"select updated_at from {table}")]
+            assert all(stamps), table
+        # rows the steps touched were stamped by them
+        assert all(datetime.datetime.fromisoformat(value) >= started
+                   for (value,) in rows(conn, "select updated_at from loans"))
+    finally:
+        conn.close()
+
+    # nothing left to do on the next start
+    assert migrations.migrate(engine) == []
@@ -0,0 +1,258 @@
+# test_scheduler.py
+# scheduler.ReminderScheduler against a temporary loans.db and fake_bot.FakeBot: the heap
+# bookkeeping, reschedule(), and the sent_reminders ledger (reminders.record_sent,
+# reminder_window) through fire() and the run loop. The clock is scheduler.utc_now,
+# replaced by a fixed moment the tests move by hand.
+#
+#   python -m pytest -q test_scheduler.py
+import asyncio
+import datetime
+
+import pytest
+import pytz
+
+import scheduler
+from db import SessionLocal, UpdateSession
+from fake_bot import FakeBot
+from models import User, Loan, Installment, SentReminder
+from reminders import WATERMARK, record_sent
+from job_state import get_date
+from scheduler import ReminderScheduler
+
+NOW = datetime.datetime(2026, 3, 10, 12, 0, tzinfo=pytz.utc)
+HOUR = datetime.timedelta(hours=1)
+DAY = datetime.timedelta(days=1)
+DELIVERY = {"global_rate": 1000, "chat_rate": 1000, "max_attempts": 1}
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(NOW)
+    monkeypatch.setattr(scheduler, "utc_now", clock)
+    return clock
+
+
+def naive(moment):
+    return moment.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def add_loan(chat_id, remind_ats, paid=()):
+    """one loan with an installment per remind_at (aware UTC); returns (loan id, [installment ids])"""
+    with SessionLocal() as session:
+        user = session.query(User).filter_by(chat_id=chat_id).first()
+        if user is None:
+            user = User(chat_id=chat_id, name="A", timezone="UTC")
+            session.add(user)
+            session.flush()
+        loan = Loan(user_id=user.id, bank="B", principal=1000.0, annual_interest_rate=18.0,
+                    term_months=len(remind_ats), first_payment_date=naive(remind_ats[0]).date())
+        session.add(loan)
+        session.flush()
+        insts = []
+        for i, remind_at in enumerate(remind_ats, 1):
+            inst = Installment(loan_id=loan.id, sequence_number=i, amount_total=100.0,
+                               due_date=naive(remind_at).date() + 2 * DAY, is_paid=i in paid,
+                               remind_on=naive(remind_at).date(), remind_at=naive(remind_at))
+            session.add(inst)
+            insts.append(inst)
+        session.commit()
+        return loan.id, [inst.id for inst in insts]
+
+
+def sql(fn, *args):
+    with SessionLocal() as session:
+        result = fn(session, *args)
+        session.commit()
+        return result
+
+
+def ledger():
+    return sql(lambda s: sorted(row.installment_id for row in s.query(SentReminder)))
+
+
+def build_messages(rows):
+    # one message per installment, like the single reminder mode
+    return [({"chat_id": row[0], "text": f"installment {row[3]}"}, [(row[7], row[3])]) for row in rows]
+
+
+def fake_bot(**kwargs):
+    return FakeBot(latency=0, global_rate=1000, chat_rate=1000, **kwargs)
+
+
+def sent_ids(bot):
+    return sorted(int(text.split()[-1]) for _, text in bot.delivered)
+
+
+async def wait_for(condition, timeout=5.0):
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    while not condition():
+        assert loop.time() - started < timeout
+        await asyncio.sleep(0.01)
+
+
+async def run_until(sched, bot, condition):
+    """run sched.run(bot) until condition() holds, then cancel it"""
+    task = asyncio.create_task(sched.run(bot))
+    try:
+        await wait_for(lambda: condition() or task.done())
+        if task.done():
+            task.result()
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def test_heap_bookkeeping():
+    sched = ReminderScheduler(build_messages)
+    at = naive(NOW)
+    sched.add([(1, 10, 5, at), (2, 10, 5, at + HOUR), (3, 20, 6, at + 2 * HOUR), (4, 20, 6, at - HOUR)])
+    assert len(sched) == 4
+    assert sched.next_fire() == scheduler.fire_time(at - HOUR, 6)
+
+    sched.discard(4)           # paid
+    sched.discard_loan(20)     # deleted
+    assert len(sched) == 2 and sched._by_loan == {10: {1, 2}}
+    # the stale heap entries are skipped
+    assert sched.next_fire() == scheduler.fire_time(at, 5)
+    # adding an installment again replaces its entry
+    sched.add([(1, 10, 5, at + 3 * HOUR)])
+    assert sched.pop_due(NOW + 2 * HOUR) == {2: 10}
+    assert sched.pop_due(NOW + 5 * HOUR) == {1: 10}
+    assert len(sched) == 0 and sched._by_loan == {} and sched.next_fire() is None
+
+    # beyond the loaded horizon: left for extend()
+    sched.loaded_until = at
+    sched.add([(5, 30, 7, at)])
+    assert len(sched) == 0
+
+
+def test_reschedule_adds_new_loans_from_today(fresh_db, clock):
+    sched = ReminderScheduler(build_messages)
+
+    async def run():
+        await sched.load(NOW)
+        loan_id, insts = add_loan(1, [NOW - DAY, NOW + 2 * HOUR, NOW + 3 * DAY, NOW + 30 * DAY])
+        db = UpdateSession()
+        await sched.reschedule(db, [loan_id])
+        await db.finish()
+        return insts
+
+    insts = asyncio.run(run())
+    # yesterday is before today, the last one beyond the horizon
+    assert set(sched._entries) == {insts[1], insts[2]}
+
+
+def test_no_resend_after_a_restart(fresh_db, clock):
+    _, insts = add_loan(1, [NOW - 2 * HOUR, NOW + DAY])
+    bot = fake_bot()
+
+    async def run():
+        first = ReminderScheduler(build_messages, delivery_options=DELIVERY)
+        # fired counts what was recorded in the ledger, not only sent
+        await run_until(first, bot, lambda: first.fired)
+        restarted = ReminderScheduler(build_messages, delivery_options=DELIVERY)
+        await run_until(restarted, bot, lambda: restarted.loaded_at is not None)
+        await asyncio.sleep(0.1)
+        return restarted
+
+    restarted = asyncio.run(run())
+    assert sent_ids(bot) == [insts[0]] and bot.calls == 1
+    assert ledger() == [insts[0]]
+    # only tomorrow's reminder is left after the restart
+    assert set(restarted._entries) == {insts[1]}
+
+
+def test_catch_up_after_downtime(fresh_db, clock):
+    # the bot last ran two days ago
+    sql(record_sent, [], (NOW - 2 * DAY).date())
+    _, insts = add_loan(1, [NOW - 5 * DAY, NOW - 2 * DAY, NOW - DAY, NOW + DAY])
+    bot = fake_bot()
+    sched = ReminderScheduler(build_messages, delivery_options=DELIVERY)
+    asyncio.run(run_until(sched, bot, lambda: sched.fired == 2))
+
+    # the days since the watermark are sent; older ones are past the catch-up window
+    assert sent_ids(bot) == insts[1:3]
+    assert ledger() == insts[1:3]
+    assert sql(get_date, WATERMARK) == NOW.date()
+    assert set(sched._entries) == {insts[3]}
+
+
+def test_a_payment_between_load_and_fire_is_skipped(fresh_db, clock):
+    _, insts = add_loan(1, [NOW - 3 * HOUR, NOW - 2 * HOUR])
+    bot = fake_bot()
+    sched = ReminderScheduler(build_messages, delivery_options=DELIVERY)
+
+    async def run():
+        await sched.load(NOW)
+        sql(lambda s: s.query(Installment).filter_by(id=insts[0]).update({"is_paid": True}))
+        await sched.fire(bot, sched.pop_due(NOW))
+
+    asyncio.run(run())
+    assert sent_ids(bot) == [insts[1]]
+    assert ledger() == [insts[1]]
+
+
+def test_a_failed_send_is_retried(fresh_db, clock):
+    loan_id, insts = add_loan(1, [NOW - 2 * HOUR])
+    bot = fake_bot(failure_rate=1.0)  # every send times out
+    sched = ReminderScheduler(build_messages, delivery_options=DELIVERY)
+    retry_at = NOW + datetime.timedelta(minutes=scheduler.REMINDER_RETRY_MINUTES)
+
+    async def run():
+        await sched.load(NOW)
+        await sched.fire(bot, sched.pop_due(NOW))
+        assert bot.calls == 1 and not bot.delivered and ledger() == []
+        assert sched._entries == {insts[0]: (retry_at, loan_id)}
+        # a reload keeps the retry time
+        await sched.load(NOW)
+        assert sched._entries == {insts[0]: (retry_at, loan_id)}
+        assert sched.pop_due(NOW) == {}
+
+        bot.failure_rate = 0.0
+        clock.now = retry_at
+        await sched.fire(bot, sched.pop_due(retry_at))
+
+    asyncio.run(run())
+    assert sent_ids(bot) == insts and ledger() == insts
+    assert sched._retry == {} and len(sched) == 0
+
+
+def test_fire_raising_requeues_the_installments(fresh_db, clock):
+    loan_id, insts = add_loan(1, [NOW - 2 * HOUR])
+    bot = fake_bot()
+    failures = []
+
+    def flaky_build_messages(rows):
+        if not failures:
+            failures.append(rows)
+            raise RuntimeError("boom")
+        return build_messages(rows)
+
+    sched = ReminderScheduler(flaky_build_messages, delivery_options=DELIVERY)
+    retry_at = NOW + datetime.timedelta(minutes=scheduler.REMINDER_RETRY_MINUTES)
+
+    async def run():
+        task = asyncio.create_task(sched.run(bot))
+        try:
+            # the run loop survived the error and put the installment back
+            await wait_for(lambda: sched._entries.get(insts[0]) == (retry_at, loan_id))
+            assert not bot.delivered
+            clock.now = retry_at
+            sched._wakeup.set()
+            await wait_for(lambda: sched.fired)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    assert len(failures) == 1
+    assert sent_ids(bot) == insts and ledger() == insts
@@ -0,0 +1,256 @@
+# workers.py
+# Worker mode: reminders are computed and sent by N worker processes instead of the
+# bot process (config.REMINDER_WORKERS). Worker i owns the chats with
+# reminders.shard_of(chat_id, N) == i and runs a scheduler.ReminderScheduler for that
+# shard only, with its own watermark and 1/N of the bot-wide send rate (a chat never
+# spans shards, so the per-chat limit holds as it is). Workers do not see the bot's
+# updates and reload their shard every REMINDER_WORKER_RELOAD_SECONDS; payments are
+# still honoured at once because every fire re-reads its installments.
+# The coordinator starts the workers, starts a dead worker again on the same shard and
+# collects the stats each worker reports after every fire. With a backup interval the
+# backup runs in a process of its own too. Everything meets in the SQLite database
+# (WAL, busy_timeout), so the whole setup runs locally against fake_bot.FakeBot:
+#
+#   python workers.py --shards 4 --fake-bot --demo-chats 200 --seconds 20
+#   python workers.py --shards 4 --backup-hours 6      # real bot, next to main.py
+import argparse
+import asyncio
+import datetime
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+
+from sqlalchemy import insert, func, select
+
+from config import (
+    BOT_TOKEN, DELIVERY_GLOBAL_RATE, REMINDER_WORKER_RELOAD_SECONDS, WORKER_STATS_INTERVAL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+BACKUP = "backup"
+# counters summed per shard from the workers' reports
+STAT_FIELDS = ("installments", "messages", "recorded", "sent", "failed", "permanent", "retries", "rate_limited")
+
+
+async def _serve(scheduler, bot):
+    task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    async with bot:
+        try:
+            await scheduler.run(bot)
+        except asyncio.CancelledError:
+            pass
+
+
+def run_worker(index, shards, stats_queue, fake_bot=False, reload_seconds=REMINDER_WORKER_RELOAD_SECONDS):
+    """process entry point of shard index of shards"""
+    logging.basicConfig(level=logging.INFO)
+    from main import build_reminder_messages  # the message layout lives with the handlers
+    from scheduler import ReminderScheduler
+
+    if fake_bot:
+        from fake_bot import FakeBot
+        bot = FakeBot(seed=index)
+    else:
+        from telegram import Bot
+        bot = Bot(BOT_TOKEN)
+
+    def report(stats):
+        stats_queue.put((index, os.getpid(), dict(stats, scheduled=len(scheduler))))
+
+    scheduler = ReminderScheduler(
+        build_reminder_messages, shard=(index, shards), reload_seconds=reload_seconds,
+        delivery_options={"global_rate": DELIVERY_GLOBAL_RATE / shards}, on_fired=report,
+    )
+    asyncio.run(_serve(scheduler, bot))
+
+
+def run_backup_worker(interval_hours, stats_queue):
+    """process entry point of the backup: backup_service.run_scheduled_backup() every interval_hours"""
+    logging.basicConfig(level=logging.INFO)
+    import backup_service
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    while True:
+        started = time.monotonic()
+        try:
+            report = dict(backup_service.run_scheduled_backup(), ok=True)
+        except Exception:
+            logger.exception("Backup worker: backup failed")
+            report = {"ok": False}
+        report["elapsed_s"] = round(time.monotonic() - started, 3)
+        stats_queue.put((BACKUP, os.getpid(), report))
+        time.sleep(interval_hours * 3600)
+
+
+class Coordinator:
+    """
+    Starts one process per shard (and one for the backup when backup_hours is set),
+    keeps them running and collects their reports.
+    shards: number of reminder workers
+    fake_bot: workers send through fake_bot.FakeBot instead of Telegram
+    """
+
+    def __init__(self, shards, fake_bot=False, backup_hours=None, reload_seconds=REMINDER_WORKER_RELOAD_SECONDS):
+        self.shards = shards
+        self.fake_bot = fake_bot
+        self.backup_hours = backup_hours
+        self.reload_seconds = reload_seconds
+        # spawn: no inherited event loop, engine or open SQLite connections
+        self._mp = multiprocessing.get_context("spawn")
+        self.queue = self._mp.Queue()
+        self.processes = {}   # shard index | BACKUP → Process
+        self.stats = {}       # shard index | BACKUP → dict of totals
+
+    def _spawn(self, name):
+        if name == BACKUP:
+            process = self._mp.Process(target=run_backup_worker, args=(self.backup_hours, self.queue),
+                                       name="loan-backup", daemon=True)
+        else:
+            process = self._mp.Process(
+                target=run_worker, args=(name, self.shards, self.queue, self.fake_bot, self.reload_seconds),
+                name=f"loan-reminders-{name}", daemon=True,
+            )
+        process.start()
+        self.processes[name] = process
+        stats = self.stats.setdefault(name, {"starts": 0, "reports": 0})
+        stats["starts"] += 1
+        stats["pid"] = process.pid
+        logger.info("Coordinator: started %s (pid %s)", process.name, process.pid)
+
+    def start(self):
+        for index in range(self.shards):
+            self._spawn(index)
+        if self.backup_hours:
+            self._spawn(BACKUP)
+
+    def check(self):
+        """start dead workers again on the same shard"""
+        for name, process in list(self.processes.items()):
+            if not process.is_alive():
+                logger.warning("Coordinator: %s exited with %s, restarting", process.name, process.exitcode)
+                self._spawn(name)
+
+    def collect(self, timeout=1.0):
+        """wait up to timeout for reports and add everything queued to the totals"""
+        try:
+            item = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return 0
+        count = 0
+        while True:
+            name, pid, report = item
+            stats = self.stats.setdefault(name, {"starts": 0, "reports": 0})
+            stats["reports"] += 1
+            stats["last_report"] = datetime.datetime.utcnow().isoformat(timespec="seconds")
+            for field, value in report.items():
+                if field in STAT_FIELDS:
+                    stats[field] = stats.get(field, 0) + value
+                else:
+                    stats[field] = value
+            count += 1
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return count
+
+    def summary(self):
+        """per-shard totals, plus "total" over the reminder shards"""
+        total = {field: sum(self.stats.get(i, {}).get(field, 0) for i in range(self.shards))
+                 for field in STAT_FIELDS}
+        return {**{name: dict(stats) for name, stats in self.stats.items()}, "total": total}
+
+    async def run(self, seconds=None):
+        """collect and supervise until cancelled (or for seconds)"""
+        loop = asyncio.get_running_loop()
+        started = last_log = time.monotonic()
+        while seconds is None or time.monotonic() - started < seconds:
+            await loop.run_in_executor(None, self.collect, 1.0)
+            self.check()
+            if time.monotonic() - last_log >= WORKER_STATS_INTERVAL_SECONDS:
+                last_log = time.monotonic()
+                logger.info("Coordinator: %s", self.summary())
+
+    def stop(self, timeout=10):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join(timeout)
+        self.collect(timeout=0.1)
+
+
+def seed_demo(chats):
+    """
+    Local runs: chats users (every tenth a negative group chat id) with one loan each whose
+    first reminder fell in the previous hour, so every worker has something to send at once.
+    returns: number of reminders seeded
+    """
+    from db import engine, init_db
+    from models import User, Loan, Installment
+    from progress import repair_progress
+    from scheduler import utc_now, bucket_of, BUCKET
+
+    init_db()
+    now = utc_now()
+    today = now.date()
+    with engine.begin() as conn:
+        first_user = (conn.execute(select(func.max(User.id))).scalar() or 0) + 1
+        first_loan = (conn.execute(select(func.max(Loan.id))).scalar() or 0) + 1
+        conn.execute(insert(User.__table__), [
+            {"id": first_user + i, "name": f"demo {i}",
+             "chat_id": (-1 if i % 10 == 0 else 1) * (900_000 + first_user + i)}
+            for i in range(chats)])
+        conn.execute(insert(Loan.__table__), [
+            {"id": first_loan + i, "user_id": first_user + i, "bank": "demo", "loan_name": "demo",
+             "principal": 1_000_000.0, "annual_interest_rate": 20.0, "term_months": 1,
+             "first_payment_date": today + datetime.timedelta(days=1), "reminder_days_before": 1,
+             "status": "active"}
+            for i in range(chats)])
+        conn.execute(insert(Installment.__table__), [
+            {"loan_id": first_loan + i, "sequence_number": 1, "due_date": today + datetime.timedelta(days=1),
+             "amount_total": 1_016_666.67, "amount_principal": 1_000_000.0, "amount_interest": 16_666.67,
+             "is_paid": False, "remind_on": today, "remind_at": bucket_of(now) - BUCKET}
+            for i in range(chats)])
+        repair_progress(conn, range(first_loan, first_loan + chats))
+    return chats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="run the reminder (and backup) worker processes")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--fake-bot", action="store_true", help="send through fake_bot.FakeBot")
+    parser.add_argument("--backup-hours", type=float, help="also run the backup every this many hours")
+    parser.add_argument("--reload-seconds", type=int, default=REMINDER_WORKER_RELOAD_SECONDS)
+    parser.add_argument("--demo-chats", type=int, default=0, help="first seed this many chats with a reminder due now")
+    parser.add_argument("--seconds", type=float, help="stop after this long and print the stats")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    seeded = seed_demo(args.demo_chats) if args.demo_chats else 0
+    coordinator = Coordinator(args.shards, fake_bot=args.fake_bot, backup_hours=args.backup_hours,
+                              reload_seconds=args.reload_seconds)
+    coordinator.start()
+    try:
+        asyncio.run(coordinator.run(args.seconds))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        coordinator.stop()
+
+    summary = coordinator.summary()
+    for name, stats in summary.items():
+        print(f"{name}: {stats}")
+    if seeded:
+        recorded = summary["total"]["recorded"]
+        print(f"demo: {recorded} of {seeded} seeded reminders sent and recorded")
+        return 0 if recorded >= seeded else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())